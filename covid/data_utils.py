@@ -1,9 +1,15 @@
 """ Data Utility Module with helping functions used from different
 classes (Oxford and Mobility).
 """
+import io
+import os
+import time
+import hashlib
+import numpy as np
 import pandas as pd
 
 from world_data import WorldPopulationData
+from fetch import fetch
 
 
 class COL:
@@ -76,43 +82,146 @@ FEATURE_DICT = {FEATURE.stringency: 'Stringency (st)',
                 FEATURE.international_travel_controls: 'International Travel Controls (s9)'}
 
 
+class SCHEMA:
+	"""Column types of the mobility data (see `downcast`)"""
+	version = 3
+	
+	category = ['Country_Code', 'CountryName']
+	datetime = ['DateTime']
+	# indices, relative cases and country attributes (NaN for unknown
+	# countries), the exact values carried to the next update are kept in
+	# the state table (see `country_state`)
+	float32 = COL.si_cols + [COL.si, 'pt', 'Pt', 'mt', 'Mt', 'st', 'St',
+	                         'RelativeConfirmedCases', 'RelativeConfirmedDeaths', 'RelativeRecovered', 'RelativeActive',
+	                         'Density', 'LandArea', 'MedAge', 'UrbanPop']
+	# counts, stored as integer type if all values are integers, fixed types
+	# (not the smallest of today's values), so sums and differences of the
+	# counts do not overflow
+	int64 = [COL.cc, COL.cd, COL.rc, COL.ac, 'Population']
+	int32 = [COL.dcc, COL.dcd, COL.drc, COL.dac, 'DaysCountFromFirstCase']
+	# string dates are created on demand, see `date_strings`
+	dropped = ['Date']
+	columns = category + datetime + float32 + int64 + int32
+	# float64 columns of the state table (besides DateTime), see `country_state`
+	state = COL.si_cols + [COL.si, 'Pt', 'Mt', 'St', COL.cc, COL.cd, COL.rc, COL.ac, 'DaysCountFromFirstCase']
+
+
+# columns of the merged Oxford and Hopkins data that are processed
+MOBILITY_COLUMNS = ['Country_Code', 'CountryName', 'Date', 'DateTime', COL.cc, COL.cd, COL.rc, COL.si]
+
+FILE_PATH = os.path.dirname(os.path.abspath(__file__))
+# processed features of the bundled Hopkins data computed by the previous
+# per-country implementation (see `test_reference`)
+REFERENCE_CSV_PATH = os.path.join(FILE_PATH, "data/JEK_reference_features_v21.csv")
+
 OXFORD_DATA_URL = "https://raw.githubusercontent.com/OxCGRT/covid-policy-tracker/master/data/OxCGRT_latest.csv"
 
+# columns of the OxCGRT data that are used (renamed, see load_oxford_data),
+# all other columns (notes, flags and indices of other indicators) are
+# not loaded
+OXFORD_COLUMNS = ['CountryName', 'Country_Code', 'Date', COL.si] + COL.ci_cols + \
+                 [c.split('_')[0] + '_Flag' for c in COL.ci_cols if c != COL.c8]
+# number of rows parsed at once
+OXFORD_CHUNK_SIZE = 100000
+
+# Oxford indicators of the mobility features S1..S9 (see COL.si_cols)
+MOBILITY_INDICATORS = COL.ci_cols[1:] + COL.ci_cols[:1]
+# maximum level of the indicators
+MOBILITY_DIVISORS = np.array([3, 3, 2, 4, 2, 3, 2, 4, 2])
+# indicators with a flag for the general (or targeted) scope, all but C8
+MOBILITY_HAS_FLAG = np.array([True, True, True, True, True, True, True, False, True])
+# general scope weight
+MOBILITY_WEIGHT = 0.28375
+
+# window features of `create_window_features()`: (kind, column, window in days)
+#   mean: rolling mean of the column
+#   reproduction: sum of the window / sum of the window before (R proxy)
+#   doubling: doubling time in days of the (cumulative) column
+#   incidence: sum of the window per 100k population
+WINDOW_FEATURES = [('mean', COL.dcc, 7), ('mean', COL.dcd, 7), ('mean', COL.drc, 7), ('mean', COL.dac, 7),
+                   ('mean', COL.dcc, 14), ('mean', COL.dcd, 14), ('mean', COL.drc, 14), ('mean', COL.dac, 14),
+                   ('reproduction', COL.dcc, 7), ('doubling', COL.cc, 7),
+                   ('incidence', COL.dcc, 7), ('incidence', COL.dcc, 14)]
+WINDOW_NAMES = {'mean': '{}Mean{}', 'reproduction': '{}R{}', 'doubling': '{}DoublingTime{}',
+                'incidence': '{}Incidence{}'}
+
 
-def load_oxford_data() -> pd.DataFrame:
+def _oxford_column_name(column) -> str:
+	"""Column name of the OxCGRT csv file as used by the DataFrame"""
+	if column == 'CountryCode':
+		return 'Country_Code'
+	return '_'.join(column.split(' '))
+
+
+def load_oxford_data(source=None, min_date=None, max_date=None, countries=None) -> pd.DataFrame:
 	"""Load Oxford Covid-19 Government Response Tracker (OxCGRT) data
 	from repository, reformat date and rename some columns.
 	
+	The csv file is parsed in chunks of OXFORD_CHUNK_SIZE rows, only the
+	columns OXFORD_COLUMNS are parsed and the rows are filtered by date and
+	country chunk by chunk, so the complete file is never held as DataFrame.
+	
+	Parameters
+	----------
+	source: bytes
+		Downloaded OxCGRT csv file (see fetch.py), default download from
+		OXFORD_DATA_URL
+	min_date: str
+		Only dates after min_date (%Y-%m-%d), default all dates
+	max_date: str
+		Only dates until max_date (%Y-%m-%d, included), default all dates
+	countries: list
+		Only these country codes, default all countries
+	
 	Returns
 	-------
 	df: DataFrame
 		Modified data of OxCGRT data
+	
+	Raises
+	------
+	ValueError
+		If the csv file can't be parsed (e.g. missing columns or invalid
+		dates), download errors are raised by fetch (see fetch.py)
 	"""
 	print("Load latest Oxford data from URL...")
+	if source is None:
+		source = fetch(OXFORD_DATA_URL)
+	
+	dtypes = {col: 'float64' for col in OXFORD_COLUMNS}
+	dtypes.update({'CountryName': str, 'Country_Code': str, 'Date': str})
 	try:
-		df = pd.read_csv(OXFORD_DATA_URL)
-		# reformat date
-		df["DateTime"] = pd.to_datetime(df["Date"], format="%Y%m%d", errors="ignore")
-		df["Date"] = df["DateTime"].dt.strftime("%Y-%m-%d")
-		
-		# rename and clean columns
-		new_cols = ['_'.join(c.split(' ')) for c in df.columns]
-		for o, n in zip(df.columns, new_cols):
-			df.rename({o: n}, axis=1, inplace=True)
+		# parse the header once to map the csv columns to the new names
+		header = pd.read_csv(io.BytesIO(source), nrows=0).columns
+		columns = {col: _oxford_column_name(col) for col in header if _oxford_column_name(col) in dtypes}
+		reader = pd.read_csv(io.BytesIO(source), usecols=list(columns),
+		                     dtype={col: dtypes[name] for col, name in columns.items()},
+		                     chunksize=OXFORD_CHUNK_SIZE)
 		
-		df = df.drop(columns=['ConfirmedCases', 'ConfirmedDeaths'])
-		df = df.rename(columns={'CountryCode': 'Country_Code'})
+		chunks = []
+		for chunk in reader:
+			# dates are %Y%m%d strings, so they are compared as strings
+			if min_date is not None:
+				chunk = chunk[chunk['Date'] > min_date.replace('-', '')]
+			if max_date is not None:
+				chunk = chunk[chunk['Date'] <= max_date.replace('-', '')]
+			if countries is not None:
+				chunk = chunk[chunk['CountryCode'].isin(countries)]
+			chunks.append(chunk)
+		df = pd.concat(chunks, ignore_index=True).rename(columns=columns)
 		
-		print(" - loaded:", df.shape)
-		
-		return df
+		# reformat date
+		df["DateTime"] = pd.to_datetime(df["Date"], format="%Y%m%d")
+	except (ValueError, KeyError, pd.errors.ParserError) as e:
+		raise ValueError("Parsing of OxCGRT data failed ({}): {}".format(OXFORD_DATA_URL, e)) from e
+	df["Date"] = date_strings(df)
 	
-	except Exception as e:
-		print("ERROR: No data available for URL", OXFORD_DATA_URL)
-		print(e)
+	print(" - loaded:", df.shape)
+	
+	return df
 
 
-def process_data(df, old_df) -> pd.DataFrame:
+def process_data(df, old_df, weights=MOBILITY_WEIGHT, state=None) -> tuple:
 	"""Helper Function that performs some processing steps.
 
 	Parameters
@@ -121,22 +230,138 @@ def process_data(df, old_df) -> pd.DataFrame:
 		Data to process and finally returned
 	old_df: DataFrame
 		Initial data without any processing steps applied
+	weights: float or array
+		General scope weights (see `mobility_matrix()`)
+	state: DataFrame
+		State table of the rows before df (see `country_state`), the time
+		series of df continue these rows, default None (df starts the
+		time series)
 	
 	Returns
 	-------
 	df: DataFrame
-		Processed data
+		Processed data with SCHEMA column types
+	state: DataFrame
+		State table to continue the time series of df
 	"""
 	print("Process data...")
-	df = extend_data(df, old_df)
-	df = fill_missing_values(df)
+	df = extend_data(df, old_df, weights)
+	df = fill_missing_values(df, state=state)
 	df = add_world_population_data(df)
-	df = create_features(df)
+	df = create_features(df, state=state)
+	state = country_state(df, state)
+	df = downcast(df)
+	validate_schema(df)
+	
+	return df, state
+
+
+def downcast(df) -> pd.DataFrame:
+	"""Convert the mobility data to the memory-compact column types of
+	SCHEMA: categorical country codes and names, a single datetime column,
+	float32 indices and int32/int64 for counts.
+	
+	Parameters
+	----------
+	df: DataFrame
+		Mobility data
+	
+	Returns
+	-------
+	df: DataFrame
+		Mobility data with SCHEMA column types
+	"""
+	if 'DateTime' not in df.columns:
+		df['DateTime'] = pd.to_datetime(df['Date'], format="%Y-%m-%d")
+	df = df.drop(columns=[c for c in SCHEMA.dropped if c in df.columns])
+	
+	for col in df.columns:
+		if col in SCHEMA.category:
+			df[col] = df[col].astype('category')
+		elif col in SCHEMA.datetime:
+			df[col] = pd.to_datetime(df[col])
+		elif col in SCHEMA.float32:
+			df[col] = df[col].astype(np.float32)
+		elif col in SCHEMA.int64:
+			df[col] = _integer(df[col], np.int64)
+		elif col in SCHEMA.int32:
+			df[col] = _integer(df[col], np.int32)
 	
 	return df
 
 
-def extend_data(df, old_df) -> pd.DataFrame:
+def _integer(values, dtype) -> pd.Series:
+	"""Convert values to the integer type dtype if all values are integers,
+	otherwise values are returned unchanged."""
+	if _is_integral(values):
+		return values.astype(dtype)
+	
+	return values
+
+
+def _is_integral(values) -> bool:
+	"""Check if values are integers (of integer type or without NaN and
+	fractions)."""
+	return pd.api.types.is_integer_dtype(values) or bool(values.notna().all() and (values % 1 == 0).all())
+
+
+def validate_schema(df):
+	"""Check the column types of the mobility data (see SCHEMA), every
+	column must be declared by SCHEMA. Count columns with NaN or fractions
+	are kept as float (see `downcast`).
+	
+	Parameters
+	----------
+	df: DataFrame
+		Mobility data
+	
+	Raises
+	------
+	ValueError
+		If any column is not declared by SCHEMA or has a type different
+		from SCHEMA
+	"""
+	invalid = []
+	for col in df.columns:
+		dtype = df[col].dtype
+		if col not in SCHEMA.columns:
+			invalid.append(col)
+		elif col in SCHEMA.category and not isinstance(dtype, pd.CategoricalDtype):
+			invalid.append(col)
+		elif col in SCHEMA.datetime and not pd.api.types.is_datetime64_dtype(dtype):
+			invalid.append(col)
+		elif col in SCHEMA.float32 and dtype != np.float32:
+			invalid.append(col)
+		elif col in SCHEMA.int64 and dtype != np.int64 and (dtype.kind != 'f' or _is_integral(df[col])):
+			invalid.append(col)
+		elif col in SCHEMA.int32 and dtype != np.int32 and (dtype.kind != 'f' or _is_integral(df[col])):
+			invalid.append(col)
+	
+	if len(invalid) > 0:
+		raise ValueError("Invalid column types (see SCHEMA): {}".format(
+			{col: str(df[col].dtype) for col in invalid}))
+
+
+def date_strings(df) -> pd.Series:
+	"""String dates (%Y-%m-%d) of the DateTime column.
+	
+	Parameters
+	----------
+	df: DataFrame
+		Data with DateTime column
+	
+	Returns
+	-------
+	dates: Series
+		String dates with the index of df
+	"""
+	codes, dates = pd.factorize(df['DateTime'])
+	dates = np.append(dates.strftime("%Y-%m-%d").to_numpy(dtype=object), None)
+	
+	return pd.Series(dates[codes], index=df.index)
+
+
+def extend_data(df, old_df, weights=MOBILITY_WEIGHT) -> pd.DataFrame:
 	"""Extend data does different things:
 	* transform Oxford indices into continuous values
 	* fill with NaN
@@ -150,24 +375,19 @@ def extend_data(df, old_df) -> pd.DataFrame:
 		Data to process and finally returned
 	old_df: DataFrame
 		Initial data without any processing steps applied
+	weights: float or array
+		General scope weights (see `mobility_matrix()`)
 	
 	Returns
 	-------
 	df: DataFrame
 		Extended data
 	"""
-	i = 0
-	for s_col in COL.ci_cols:
-		print("- process col", s_col)
-		if i == 8:  # C_8
-			transform_to_mobility(df, old_df, s_col, has_flag=False)
-		else:
-			transform_to_mobility(df, old_df, s_col)
-		i += 1
+	print("- process cols", ", ".join(COL.si_cols))
+	transform_to_mobility(df, old_df, weights)
 		
 	# fill all NaN with zero
-	for col in df.columns:
-		df[col].fillna(0, inplace=True)
+	df = df.fillna(0)
 		
 	# sort values
 	df = df.sort_values(by=['Country_Code', 'DateTime'], ignore_index=True)
@@ -182,102 +402,293 @@ def extend_data(df, old_df) -> pd.DataFrame:
 	return df
 	
 	
-def fill_missing_values(df) -> pd.DataFrame:
+def fill_missing_values(df, state=None) -> pd.DataFrame:
 	"""Fill missing values with last known one (forward fill) and
 	compute mobility features (mt, Mt, pt, Pt, st, St)
 	
+	The rows are grouped by country once (stable, so the row order within
+	a country is kept) and all columns are filled with segmented array
+	operations instead of filtering the frame for every country.
+	
 	Parameters
 	----------
 	df: DataFrame
 		Data to process and finally returned
+	state: DataFrame
+		State table of the rows before df (see `country_state`), the time
+		series of df continue these rows, default None (df starts the
+		time series)
 	
 	Returns
 	-------
 	df: DataFrame
 		Extended data
 	"""
-	for c_code in df['Country_Code'].unique():
-		for col in COL.si_cols:
-			# it does not fill zeros at the beginning
-			filled_col = df.loc[(df.Country_Code == c_code)][col].replace(to_replace=0, method='ffill')
-			df.loc[(df.Country_Code == c_code), col] = filled_col
-		# some Countries missing values of confirmed cases, e.g. Aruba(ABW)
-		filled_cases = df.loc[(df.Country_Code == c_code)]['ConfirmedCases'].replace(to_replace=0.0, method='ffill')
-		df.loc[(df.Country_Code == c_code), 'ConfirmedCases'] = filled_cases
-		
-		filled_deaths = df.loc[(df.Country_Code == c_code)]['ConfirmedDeaths'].replace(to_replace=0.0, method='ffill')
-		df.loc[(df.Country_Code == c_code), 'ConfirmedDeaths'] = filled_deaths
-		
-		filled_recovered = df.loc[(df.Country_Code == c_code)]['Recovered'].replace(to_replace=0.0, method='ffill')
-		df.loc[(df.Country_Code == c_code), 'Recovered'] = filled_recovered
-		
-		stringency = df.loc[(df.Country_Code == c_code)]['StringencyIndex'].replace(to_replace=0.0, method='ffill')
-		df.loc[(df.Country_Code == c_code), 'StringencyIndex'] = stringency
-		
-		# compute m(t|L)
-		df.loc[(df.Country_Code == c_code), 'pt'] = df.loc[(df.Country_Code == c_code)][COL.si_cols].sum(axis=1) / 9
-		df.loc[(df.Country_Code == c_code), 'Pt'] = df.loc[(df.Country_Code == c_code)]['pt'].cumsum()
-		df.loc[(df.Country_Code == c_code), 'mt'] = 1 - df.loc[(df.Country_Code == c_code)]['pt']
-		df.loc[(df.Country_Code == c_code), 'Mt'] = df.loc[(df.Country_Code == c_code)]['mt'].cumsum()
-		df.loc[(df.Country_Code == c_code), 'st'] = df.loc[(df.Country_Code == c_code)]['StringencyIndex'] / 100
-		df.loc[(df.Country_Code == c_code), 'St'] = df.loc[(df.Country_Code == c_code)]['st'].cumsum()
+	order, groups = _country_order(df)
+	valid = groups >= 0
+	starts = _segment_starts(groups)
+	codes = df['Country_Code'].to_numpy()[order]
+	
+	# it does not fill zeros at the beginning, some Countries missing
+	# values of confirmed cases, e.g. Aruba(ABW)
+	fill_cols = COL.si_cols + [COL.cc, COL.cd, COL.rc, COL.si]
+	for col in fill_cols:
+		values = df[col].to_numpy()[order]
+		filled = _ffill_zeros(values, starts, _carried(state, col, codes, 0.0))
+		_set_segment_values(df, col, order, valid, filled)
+	
+	# compute m(t|L)
+	pt = np.zeros(len(df))
+	for col in COL.si_cols:
+		pt = pt + df[col].fillna(0).to_numpy()
+	pt = pt[order] / 9
+	st = (df[COL.si] / 100).to_numpy()[order]
+	mt = 1 - pt
+	features = {'pt': pt, 'Pt': _segment_cumsum(pt, starts, _carried(state, 'Pt', codes, 0.0)),
+	            'mt': mt, 'Mt': _segment_cumsum(mt, starts, _carried(state, 'Mt', codes, 0.0)),
+	            'st': st, 'St': _segment_cumsum(st, starts, _carried(state, 'St', codes, 0.0))}
+	for col, values in features.items():
+		_set_segment_values(df, col, order, valid, values)
 		
 	return df
 
 
-def transform_to_mobility(df, old_df, column, has_flag=True) -> pd.DataFrame:
+def country_state(df, state=None) -> pd.DataFrame:
+	"""State table to continue the time series of processed data with
+	`fill_missing_values` and `create_features`: DateTime and the float64
+	values of the columns SCHEMA.state (e.g. last non-zero values, Pt/Mt/St
+	totals and cumulative cases) of the last row of each country. The data
+	itself stores these columns as float32 (see `downcast`), so the state
+	is taken before and stored next to the data.
+	
+	Parameters
+	----------
+	df: DataFrame
+		Processed data before `downcast`
+	state: DataFrame
+		State table of the rows before df, kept for countries without rows
+		in df
+	
+	Returns
+	-------
+	state: DataFrame
+		State table indexed by Country_Code
+	"""
+	last = df.groupby('Country_Code', sort=False, observed=True).tail(1).set_index('Country_Code')
+	last = last[['DateTime']].join(last[SCHEMA.state].astype(np.float64))
+	if state is not None:
+		last = pd.concat([state[~state.index.isin(last.index)], last])
+	last.index = last.index.astype(object)
+	
+	return last
+
+
+def _carried(state, col, codes, default):
+	"""Values of the column `col` carried from `state` to the rows of the
+	given country codes, `default` for countries without state."""
+	if state is None:
+		return None
+	
+	return state[col].reindex(codes, fill_value=default).to_numpy()
+
+
+def _country_order(df):
+	"""Stable permutation that groups the rows by country code.
+	
+	Parameters
+	----------
+	df: DataFrame
+	
+	Returns
+	-------
+	order: ndarray
+		Row positions grouped by country, the relative order of the rows
+		of a country is kept
+	groups: ndarray
+		Group id of each row in `order`, rows without a country code
+		have the id -1
+	"""
+	codes = pd.factorize(df['Country_Code'])[0]
+	order = np.argsort(codes, kind='stable')
+	
+	return order, codes[order]
+
+
+def _segment_starts(groups) -> np.ndarray:
+	"""Boolean mask that marks the first row of every group segment."""
+	starts = np.ones(len(groups), dtype=bool)
+	starts[1:] = groups[1:] != groups[:-1]
+	
+	return starts
+
+
+def _ffill_zeros(values, starts, initial=None) -> np.ndarray:
+	"""Replace zeros with the last non-zero value of the same segment,
+	leading zeros of a segment are kept (like `replace(0, method='ffill')`)
+	or replaced by the values `initial` carried over from previous rows.
+	"""
+	pos = np.arange(len(values))
+	seg_start = np.maximum.accumulate(np.where(starts, pos, 0))
+	last = np.maximum.accumulate(np.where(values != 0, pos, -1))
+	
+	filled = np.where(last >= seg_start, values[np.maximum(last, 0)], values)
+	if initial is not None:
+		filled = np.where((last < seg_start) & (values == 0), initial, filled)
+	
+	return filled
+
+
+def _segment_cumsum(values, starts, initial=None) -> np.ndarray:
+	"""Cumulative sum restarting at every group segment (with the values
+	`initial` carried over from previous rows), NaN values are skipped
+	like in `Series.cumsum`.
+	
+	The segments are laid out as rows of a zero padded 2D array, so the
+	values are summed up in the same order as for each country alone.
+	"""
+	if len(values) == 0:
+		return np.asarray(values, dtype=float)
+	
+	pos = np.arange(len(values))
+	seg_id = np.cumsum(starts) - 1
+	offset = pos - np.maximum.accumulate(np.where(starts, pos, 0))
+	
+	isna = np.isnan(values)
+	padded = np.zeros((seg_id[-1] + 1, offset.max() + 2))
+	if initial is not None:
+		padded[:, 0] = np.nan_to_num(initial[starts])
+	padded[seg_id, offset + 1] = np.where(isna, 0.0, values)
+	result = np.cumsum(padded, axis=1)[seg_id, offset + 1]
+	result[isna] = np.nan
+	
+	return result
+
+
+def _segment_diff(values, starts, initial=None) -> np.ndarray:
+	"""First discrete difference within every group segment, the first
+	value of a segment is NaN (like `Series.diff`) or the difference to
+	the values `initial` carried over from previous rows."""
+	diff = np.empty(len(values))
+	diff[1:] = values[1:] - values[:-1]
+	diff[starts] = np.nan if initial is None else values[starts] - initial[starts]
+	
+	return diff
+
+
+def _segment_min(values, starts) -> np.ndarray:
+	"""Minimum of every group segment broadcast to all rows of the segment."""
+	if len(values) == 0:
+		return values
+	
+	seg_id = np.cumsum(starts) - 1
+	
+	return np.minimum.reduceat(values, np.flatnonzero(starts))[seg_id]
+
+
+def _set_segment_values(df, col, order, valid, values):
+	"""Write values computed in grouped row order back to `df[col]`,
+	rows without a country code are left untouched."""
+	new_values = df[col].to_numpy(copy=True)
+	new_values[order[valid]] = values[valid]
+	df[col] = new_values
+
+
+def indicator_matrix(old_df) -> tuple:
+	"""Oxford indicator values and flags of the mobility features S1..S9
+	as (rows x 9) matrices, the flags of C8 are 1.
+	
+	Parameters
+	----------
+	old_df: DataFrame
+		Oxford data (see `load_oxford_data()`)
+	
+	Returns
+	-------
+	values: ndarray
+	flags: ndarray
+	"""
+	# columns are stored contiguous (column-major), as in the frame
+	values = np.empty((len(MOBILITY_INDICATORS), len(old_df)))
+	flags = np.ones_like(values)
+	for j, col in enumerate(MOBILITY_INDICATORS):
+		values[j] = old_df[col].to_numpy(dtype=np.float64)
+		if MOBILITY_HAS_FLAG[j]:
+			flags[j] = old_df[col.split('_')[0] + '_Flag'].to_numpy(dtype=np.float64)
+	values, flags = values.T, flags.T
+	
+	return values, flags
+
+
+def mobility_matrix(values, flags, weights=MOBILITY_WEIGHT, divisors=MOBILITY_DIVISORS) -> np.ndarray:
+	"""Transform the Oxford indicator values to our model that describes
+	the mobility of the population of a country, all features S1..S9 at
+	once: Si = Xi / di * (1 - w) + w * Fi, where di is the maximum level of
+	the indicator and Fi denotes weather a lockdown is general or just in
+	some area. S8 doesn't use the regional reach: S8 = X8 / d8.
+	
+	Parameters
+	----------
+	values: ndarray
+		Indicator values (rows x 9), see `indicator_matrix()`, or any
+		other shape with the indicators on the last axis
+	flags: ndarray
+		Indicator flags, same shape as values
+	weights: float or array
+		General scope weight, an array of shape (9,) for a weight per
+		feature, or (k, 1) or (k, 9) for a batch of k weight sets
+	divisors: array
+		Maximum levels of the indicators (9,), or (k, 9) for a batch
+	
+	Returns
+	-------
+	features: ndarray
+		S1..S9 (rows x 9), or (k x rows x 9) for a batch of weight sets
+	"""
+	w = _batch_parameter(weights, values.ndim)
+	d = _batch_parameter(divisors, values.ndim)
+	scale = np.where(MOBILITY_HAS_FLAG, 1 - w, 1.0)
+	flag_weight = np.where(MOBILITY_HAS_FLAG, w, 0.0)
+	
+	features = values / d * scale
+	features += flag_weight * flags
+	
+	return features
+
+
+def _batch_parameter(param, ndim) -> np.ndarray:
+	"""Parameter of the 9 features with the batch axes (all but the last)
+	moved in front of the ndim axes of the values"""
+	param = np.asarray(param, dtype=np.float64)
+	if param.ndim < 2:
+		return param
+	
+	return param.reshape(param.shape[:-1] + (1,) * (ndim - 1) + param.shape[-1:])
+
+
+def transform_to_mobility(df, old_df, weights=MOBILITY_WEIGHT) -> pd.DataFrame:
 	"""Transform the given Oxford Indicator values for S1 to S9
 	to our model that describes the mobility of the population
-	of a country.
+	of a country (see `mobility_matrix()`).
 	
 	Parameters:
 	-----------
-	data : DataFrame object
-	column : str
-			column name of dataframe
-	has_flag : bool
-			Denotes weather a lockdown is general or just in some area
-			Note: S8 doesn't use the regional reach (targeted
-			or general).
+	df : DataFrame object
+			data to add the columns S1..S9 to
+	old_df : DataFrame object
+			Oxford data with the indicators and flags, same index as df
+	weights : float or array
+			General scope weight or a weight per feature
 			
 	Returns:
 	--------
 	data : DataFrame object
 	"""
-	s_id = column.split('_')[0]
-	if s_id == 'H1':
-		idx = 9
-	else:
-		idx = int(s_id[1:])
-	
-	m_id = 'S' + str(idx)
-	# set initial values
-	si = old_df[column].copy()
-	
-	# set Si general initially to 1
-	# because C8 needs a multiplication by 1
-	si_g = old_df[column] * 0.0 + 1
-	if has_flag:
-		si_g = old_df[s_id + '_Flag']
-	
-	# general scope weight
-	w = 0.28375
-	# normalization factor
-	nf = 1  # / 9
-	
-	if idx in [3, 5, 7, 9]:
-		l_i = nf * (si / 2 * (1 - w) + (w * si_g))
-	elif idx in [1, 2, 6]:
-		l_i = nf * (si / 3 * (1 - w) + (w * si_g))
-	elif idx in [4]:  # C_4
-		l_i = nf * (si / 4 * (1 - w) + (w * si_g))
-	elif idx in [8]:
-		l_i = nf * si / 4  # C8
-	else:
-		l_i = 0.0
-	
-	df[m_id] = 0.0
-	df[m_id] = l_i
+	features = mobility_matrix(*indicator_matrix(old_df), weights)
+	# columns in the order of COL.ci_cols (S9, S1..S8)
+	for column in COL.ci_cols:
+		j = MOBILITY_INDICATORS.index(column)
+		df[COL.si_cols[j]] = features[:, j] if df.index.equals(old_df.index) else \
+			pd.Series(features[:, j], index=old_df.index)
 	
 	return df
 
@@ -305,13 +716,17 @@ def add_world_population_data(df) -> pd.DataFrame:
 	return df
 
 
-def create_features(df) -> pd.DataFrame:
+def create_features(df, state=None) -> pd.DataFrame:
 	"""Create additional features like active cases, relative
 	cases (percentage of number of population) and daily cases.
 	
 	Parameters
 	----------
 	df: DataFrame
+	state: DataFrame
+		State table of the rows before df (see `country_state`), the time
+		series of df continue these rows, default None (df starts the
+		time series)
 
 	Returns
 	-------
@@ -325,38 +740,437 @@ def create_features(df) -> pd.DataFrame:
 	df["RelativeRecovered"] = df.Recovered / df.Population
 	df["RelativeActive"] = df.Active / df.Population
 	
-	df['DailyConfirmedCases'] = 0
-	df['DailyConfirmedDeaths'] = 0
-	df["DailyRecovered"] = 0
-	df["DailyActive"] = 0
+	order, groups = _country_order(df)
+	valid = groups >= 0
+	starts = _segment_starts(groups)
+	codes = df['Country_Code'].to_numpy()[order]
 	
-	df['DaysCountFromFirstCase'] = 0
+	daily_cols = {COL.dcc: COL.cc, COL.dcd: COL.cd, COL.drc: COL.rc, COL.dac: COL.ac}
+	for daily_col, col in daily_cols.items():
+		daily = np.zeros(len(df))
+		values = df[col].to_numpy(dtype=float)[order]
+		daily[order[valid]] = _segment_diff(values, starts, _carried(state, col, codes, np.nan))[valid]
+		# replace the starting values that are set to Nan with 0
+		daily[np.isnan(daily)] = 0.0
+		df[daily_col] = daily
 	
-	for c in df.Country_Code.unique():
-		dates = df.loc[(df.Country_Code == c) & (df.ConfirmedCases > 0)]['DateTime']
-		days_count = dates - dates.min()
-		
-		df.loc[(df.Country_Code == c) & (
-			df.ConfirmedCases > 0), 'DaysCountFromFirstCase'] = days_count.dt.days.values
-		
-		df.loc[(df.Country_Code == c), 'DailyConfirmedCases'] = df.loc[
-			(df.Country_Code == c), 'ConfirmedCases'].diff()
+	# count days from the first confirmed case of each country
+	no_case = np.iinfo(np.int64).max
+	day = pd.Timedelta(1, 'D').value
+	case_rows = valid & (df.ConfirmedCases > 0).to_numpy()[order]
+	times = df['DateTime'].to_numpy().astype('datetime64[ns]').astype(np.int64)[order]
+	first_case = _segment_min(np.where(case_rows, times, no_case), starts)
+	if state is not None:
+		state_times = state['DateTime'].to_numpy().astype('datetime64[ns]').astype(np.int64)
+		state_first = np.where(state[COL.cc] > 0, state_times - state['DaysCountFromFirstCase'].to_numpy(dtype=np.int64) * day, no_case)
+		first_case = np.minimum(first_case, pd.Series(state_first, index=state.index).reindex(codes, fill_value=no_case).to_numpy())
+	days = np.zeros(len(df), dtype=np.int64)
+	days[order[case_rows]] = (times[case_rows] - first_case[case_rows]) // day
+	df['DaysCountFromFirstCase'] = days
+	
+	print("- shape", df.shape)
 		
-		df.loc[(df.Country_Code == c), 'DailyConfirmedDeaths'] = df.loc[
-			(df.Country_Code == c), 'ConfirmedDeaths'].diff()
+	return df
+
+
+def window_feature_name(kind, column, window) -> str:
+	"""Column name of a window feature, e.g. DailyConfirmedCasesMean7"""
+	return WINDOW_NAMES[kind].format(column, window)
+
+
+def create_window_features(df, features=WINDOW_FEATURES) -> pd.DataFrame:
+	"""Create rolling window features (rolling means, reproduction number
+	proxies, doubling times and incidences) of all countries at once.
+	
+	The windows are counted in days, not rows: the values of each country
+	are placed on a daily grid from its first to its last date, days
+	without row are missing values. The windows are computed from the
+	cumulative sums on the grid instead of a rolling window per country.
+	Like `rolling(window)` the first window - 1 days of a country and
+	windows with missing values (or missing days) are NaN, so are
+	reproduction numbers of windows without cases and doubling times
+	without growth.
+	
+	Parameters
+	----------
+	df: DataFrame
+	features: list
+		Window features (kind, column, window in days), default
+		WINDOW_FEATURES
+	
+	Returns
+	-------
+	windows: DataFrame
+		One column per feature (see `window_feature_name`) with the index
+		of df
+	
+	Raises
+	------
+	ValueError
+		If a country has more than one row of a date
+	"""
+	print("Create Window Features...")
+	order, groups = _country_order(df)
+	rows = order[groups >= 0]
+	cells, starts = _daily_grid(df['DateTime'].to_numpy()[rows], _segment_starts(groups[groups >= 0]))
+	pos = np.arange(len(starts))
+	offset = pos - np.maximum.accumulate(np.where(starts, pos, 0))
+	
+	def before(values, window):
+		"""Values of the same country `window` days before"""
+		return np.where(offset >= window, values[np.maximum(pos - window, 0)], np.nan)
+	
+	def on_grid(col):
+		"""Values of the column on the daily grid, NaN for missing days"""
+		values = np.full(len(starts), np.nan)
+		values[cells] = df[col].to_numpy(dtype=float, na_value=np.nan)[rows]
+		return values
+	
+	sums = {}
+	windows = {}
+	for kind, col, window in features:
+		values = on_grid(col)
+		if kind != 'doubling' and (col, window) not in sums:
+			sums[col, window] = _segment_window_sum(values, starts, window)
 		
-		df.loc[(df.Country_Code == c), 'DailyRecovered'] = df.loc[
-			(df.Country_Code == c), 'Recovered'].diff()
+		with np.errstate(divide='ignore', invalid='ignore'):
+			if kind == 'mean':
+				result = sums[col, window] / window
+			elif kind == 'reproduction':
+				last = before(sums[col, window], window)
+				result = np.where(last > 0, sums[col, window] / last, np.nan)
+			elif kind == 'doubling':
+				growth = values / before(values, window)
+				result = np.where(growth > 1, window * np.log(2) / np.log(growth), np.nan)
+			elif kind == 'incidence':
+				result = sums[col, window] / on_grid('Population') * 100000
+			else:
+				raise ValueError("Unknown window feature: {}".format(kind))
 		
-		df.loc[(df.Country_Code == c), 'DailyActive'] = df.loc[
-			(df.Country_Code == c), 'Active'].diff()
+		column = np.full(len(df), np.nan)
+		column[rows] = result[cells]
+		windows[window_feature_name(kind, col, window)] = column
+	windows = pd.DataFrame(windows, index=df.index)
 	
-	# replace the starting values that are set to Nan with 0
-	df['DailyConfirmedCases'].fillna(0, inplace=True)
-	df['DailyConfirmedDeaths'].fillna(0, inplace=True)
-	df['DailyRecovered'].fillna(0, inplace=True)
-	df['DailyActive'].fillna(0, inplace=True)
+	print("- shape", windows.shape)
 	
-	print("- shape", df.shape)
+	return windows
+
+
+def _daily_grid(times, starts) -> tuple:
+	"""Daily grid of every group segment from its first to its last date.
+	
+	Parameters
+	----------
+	times: ndarray
+		Dates (datetime64) of the rows grouped by segment
+	starts: ndarray
+		Boolean mask of the first row of every segment
+	
+	Returns
+	-------
+	cells: ndarray
+		Position of each row on the grid
+	grid_starts: ndarray
+		Boolean mask of the first day of every segment on the grid
+	
+	Raises
+	------
+	ValueError
+		If a segment has more than one row of a date
+	"""
+	if len(times) == 0:
+		return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=bool)
+	
+	days = times.astype('datetime64[D]').astype(np.int64)
+	first = np.flatnonzero(starts)
+	seg_id = np.cumsum(starts) - 1
+	first_day = np.minimum.reduceat(days, first)
+	length = np.maximum.reduceat(days, first) - first_day + 1
+	grid_start = np.concatenate([[0], np.cumsum(length)[:-1]])
+	
+	cells = grid_start[seg_id] + days - first_day[seg_id]
+	if len(np.unique(cells)) < len(cells):
+		raise ValueError("More than one row of a date of a country")
+	grid_starts = np.zeros(length.sum(), dtype=bool)
+	grid_starts[grid_start] = True
+	
+	return cells, grid_starts
+
+
+def _segment_window_sum(values, starts, window) -> np.ndarray:
+	"""Sum of the last `window` values of every group segment (like
+	`rolling(window).sum()`), the first window - 1 values of a segment and
+	windows with NaN values are NaN."""
+	pos = np.arange(len(values))
+	offset = pos - np.maximum.accumulate(np.where(starts, pos, 0))
+	
+	isna = np.isnan(values)
+	total = _segment_cumsum(np.where(isna, 0.0, values), starts)
+	missing = np.concatenate([[0], np.cumsum(isna)])
+	result = total - np.where(offset >= window, total[np.maximum(pos - window, 0)], 0.0)
+	result[(offset < window - 1) | (missing[pos + 1] > missing[np.maximum(pos + 1 - window, 0)])] = np.nan
+	
+	return result
+
+
+def _synthetic_frame(num_countries=180, num_days=500, seed=0) -> pd.DataFrame:
+	"""Synthetic merged Oxford and Hopkins data (the input of
+	`process_data`) from 2020-01-01 with indicators, flags and stringency
+	index with missing values and cumulative cases from 2020-02-15 with
+	days without new cases and without report.
+	
+	Parameters
+	----------
+	num_countries: int
+		Countries (with world population data)
+	num_days: int
+		Days of each country
+	seed: int
+		Seed of the random values
+	
+	Returns
+	-------
+	old_df: DataFrame
+	"""
+	rng = np.random.default_rng(seed)
+	countries = WorldPopulationData().df.drop_duplicates(subset=['Code'], keep=False).head(num_countries)
+	dates = pd.date_range('2020-01-01', periods=num_days)
+	old_df = pd.DataFrame({'Country_Code': np.repeat(countries['Code'].to_numpy(), len(dates)),
+	                       'CountryName': np.repeat(countries['CountryName'].to_numpy(), len(dates)),
+	                       'DateTime': np.tile(dates, len(countries))})
+	old_df['Date'] = date_strings(old_df)
+	_synthetic_indicators(old_df, rng)
+	for col in [COL.cc, COL.cd, COL.rc]:
+		daily = rng.integers(0, 1000, len(old_df)) * (rng.random(len(old_df)) > 0.2)
+		daily[old_df['DateTime'] < '2020-02-15'] = 0
+		old_df[col] = pd.Series(daily).groupby(old_df['Country_Code']).cumsum().astype(float)
+		old_df.loc[rng.random(len(old_df)) < 0.05, col] = np.nan
+	
+	return old_df
+
+
+def _synthetic_indicators(df, rng):
+	"""Add synthetic Oxford indicators, flags and stringency index with
+	missing values to df (in place).
+	
+	Parameters
+	----------
+	df: DataFrame
+	rng: Generator
+		Random generator of the values
+	"""
+	for col, divisor in zip(MOBILITY_INDICATORS, MOBILITY_DIVISORS):
+		df[col] = rng.integers(0, divisor + 1, len(df)).astype(float)
+		df.loc[rng.random(len(df)) < 0.1, col] = np.nan
+		if col != COL.c8:
+			df[col.split('_')[0] + '_Flag'] = rng.integers(0, 2, len(df)).astype(float)
+	df[COL.si] = np.round(rng.random(len(df)) * 100, 2)
+	df.loc[rng.random(len(df)) < 0.1, COL.si] = np.nan
+
+
+def best_of(run, repeat=3) -> tuple:
+	"""Time a function for the benchmarks, best of `repeat` runs.
+	
+	Parameters
+	----------
+	run: callable
+		Function without arguments
+	repeat: int
+		Number of runs
+	
+	Returns
+	-------
+	result:
+		Result of the last run
+	seconds: float
+		Time of the fastest run
+	"""
+	times = []
+	for _ in range(repeat):
+		start = time.perf_counter()
+		result = run()
+		times.append(time.perf_counter() - start)
+	
+	return result, min(times)
+
+
+def test_incremental():
+	"""Split a synthetic frame at a date: processing the dates after the
+	split, continued from the state of the processed dates before (like
+	Mobility.update), must equal the processing of the complete frame"""
+	import contextlib
+	
+	print("Testing incremental processing:")
+	old_df = _synthetic_frame(num_countries=4, num_days=120)
+	
+	with contextlib.redirect_stdout(io.StringIO()):
+		full, full_state = process_data(old_df[MOBILITY_COLUMNS].copy(), old_df)
+		for split in ['2020-02-10', '2020-03-20', '2020-04-28']:
+			before = old_df[old_df['DateTime'] <= split]
+			after = old_df[old_df['DateTime'] > split]
+			data, state = process_data(before[MOBILITY_COLUMNS].copy(), before)
+			new_df, state = process_data(after[MOBILITY_COLUMNS].copy(), after, state=state)
+			data = downcast(pd.concat([data, new_df], ignore_index=True))
+			data = data.sort_values(by=['Country_Code', 'DateTime'], ignore_index=True)
+			pd.testing.assert_frame_equal(data, full, check_exact=True)
+			pd.testing.assert_frame_equal(state.sort_index(), full_state.sort_index(), check_exact=True)
+	
+	# every column is checked, counts may be float only with NaN
+	validate_schema(full.assign(Population=full['Population'].where(full['Population'] > 10 ** 6)))
+	for invalid in [full.assign(Recovered=full['Recovered'].astype(np.float64)),
+	                full.assign(St=full['St'].astype(np.float64)), full.assign(Unknown=0)]:
+		try:
+			validate_schema(invalid)
+			raise AssertionError("invalid column types without error")
+		except ValueError as e:
+			print("- expected error:", e)
+	print("Test finished!")
+
+
+
+def test_window_features():
+	"""Window features of a country with missing days: the windows are
+	counted in days, so they must equal the window features of the data
+	reindexed to a daily grid, and windows over a missing day are NaN"""
+	import contextlib
+	
+	print("Testing window features with missing days:")
+	old_df = _synthetic_frame(num_countries=3, num_days=90)
+	with contextlib.redirect_stdout(io.StringIO()):
+		df, _ = process_data(old_df[MOBILITY_COLUMNS].copy(), old_df)
+		gap = pd.to_datetime(['2020-03-10', '2020-03-11', '2020-03-20'])
+		missing = (df['Country_Code'] == df['Country_Code'].iloc[0]) & df['DateTime'].isin(gap)
+		data = df[~missing].sample(frac=1, random_state=0)
+		windows = create_window_features(data)
 		
-	return df
+		daily = df.assign(**{col: np.nan for col in df.columns if col not in ['Country_Code', 'DateTime']})
+		daily = daily.where(missing, df)
+		expected = create_window_features(daily)[~missing].loc[data.index]
+	pd.testing.assert_frame_equal(windows, expected)
+	
+	name = window_feature_name('mean', COL.dcc, 7)
+	country = windows[data['Country_Code'] == df['Country_Code'].iloc[0]].join(data['DateTime']).set_index('DateTime').sort_index()
+	# 7-day windows ending 2020-03-12 to 2020-03-17 and 2020-03-21 to 2020-03-26 contain a missing day
+	nan_dates = pd.date_range('2020-03-12', '2020-03-17').append(pd.date_range('2020-03-21', '2020-03-26'))
+	assert country.loc[nan_dates, name].isna().all()
+	assert country.loc['2020-03-18':'2020-03-19', name].notna().all() and country.loc['2020-03-27':, name].notna().all()
+	
+	try:
+		create_window_features(pd.concat([data, data.head(1)]))
+		raise AssertionError("duplicate date without error")
+	except ValueError as e:
+		print("- expected error:", e)
+	print("Test finished!")
+
+
+def _reference_frames(max_date='2020-06-11') -> pd.DataFrame:
+	"""Bundled Hopkins data (until max_date, without duplicate country/date
+	rows) with synthetic Oxford indicators, the input of `test_reference`"""
+	data = pd.read_csv(os.path.join(FILE_PATH, "data/JEK_Hopkins_v21_latest.csv"))
+	data = data[data['Date'] <= max_date].drop_duplicates(subset=['Country_Code', 'Date'])
+	data = data.sort_values(by=['Country_Code', 'Date'], ignore_index=True)
+	data['DateTime'] = pd.to_datetime(data['Date'], format="%Y-%m-%d")
+	data['CountryName'] = data['Country_Code']
+	_synthetic_indicators(data, np.random.default_rng(0))
+	
+	return data
+
+
+def _column_digests(df) -> pd.DataFrame:
+	"""SHA-256 hash (of the float64 values, NaN unified) and sum of each
+	numeric column"""
+	digests = []
+	for col in df.columns:
+		if col == 'DateTime' or not pd.api.types.is_numeric_dtype(df[col]):
+			continue
+		values = df[col].to_numpy(dtype=np.float64, na_value=np.nan)
+		values = np.where(np.isnan(values), np.nan, values)
+		digests.append((col, hashlib.sha256(values.tobytes()).hexdigest(), np.nansum(values)))
+	
+	return pd.DataFrame(digests, columns=['column', 'sha256', 'sum'])
+
+
+def test_reference():
+	"""Process the bundled Hopkins data with synthetic Oxford indicators
+	(see `_reference_frames`), the features must be identical to the
+	reference of the previous per-country implementation (REFERENCE_CSV_PATH)"""
+	import contextlib
+	
+	print("Testing processing against reference:")
+	data = _reference_frames()
+	with contextlib.redirect_stdout(io.StringIO()):
+		df = extend_data(data[MOBILITY_COLUMNS].copy(), data)
+		df = fill_missing_values(df)
+		df = add_world_population_data(df)
+		df = create_features(df)
+	digests = _column_digests(df).set_index('column')
+	reference = pd.read_csv(REFERENCE_CSV_PATH, index_col='column')
+	
+	assert list(digests.index) == list(reference.index), "columns differ"
+	different = digests.index[digests['sha256'] != reference['sha256']]
+	assert len(different) == 0, "different values: {}".format(
+		{col: (digests.loc[col, 'sum'], reference.loc[col, 'sum']) for col in different})
+	print("Test finished!")
+
+
+def benchmark_window_features(num_countries=180, num_days=500, repeat=3):
+	"""Window features of a processed synthetic frame (see `_synthetic_frame`)
+	by `create_window_features` against groupby().rolling() and a loop over
+	the countries, best of `repeat`. The results must be equal (NaN at the
+	same positions).
+	
+	Parameters
+	----------
+	num_countries: int
+		Countries of the synthetic frame
+	num_days: int
+		Days of each country
+	repeat: int
+		Number of runs
+	"""
+	import contextlib
+	
+	def rolling(df, features):
+		groups = df.groupby('Country_Code', observed=True)
+		windows = pd.DataFrame(index=df.index)
+		for kind, col, window in features:
+			sums = groups[col].rolling(window).sum().reset_index(level=0, drop=True)
+			if kind == 'mean':
+				result = sums / window
+			elif kind == 'reproduction':
+				last = sums.groupby(df['Country_Code'], observed=True).shift(window)
+				result = (sums / last).where(last > 0)
+			elif kind == 'doubling':
+				growth = df[col] / groups[col].shift(window)
+				result = (window * np.log(2) / np.log(growth)).where(growth > 1)
+			else:
+				result = sums / df['Population'] * 100000
+			windows[window_feature_name(kind, col, window)] = result
+		return windows
+	
+	def per_country(df, features):
+		return pd.concat([rolling(df[df['Country_Code'] == code], features)
+		                  for code in df['Country_Code'].unique()]).loc[df.index]
+	
+	print("Benchmark window features:")
+	old_df = _synthetic_frame(num_countries, num_days)
+	with contextlib.redirect_stdout(io.StringIO()):
+		df, _ = process_data(old_df[MOBILITY_COLUMNS].copy(), old_df)
+		windows, t_segmented = best_of(lambda: create_window_features(df), repeat)
+	print("- frame {} x {}, {} features".format(*df.shape, len(WINDOW_FEATURES)))
+	print("- segmented             {:.3f}s".format(t_segmented))
+	for name, run in [('groupby().rolling()', rolling), ('per-country loop', per_country)]:
+		result, t_run = best_of(lambda: run(df, WINDOW_FEATURES), repeat)
+		for col in windows.columns:
+			np.testing.assert_allclose(windows[col].to_numpy(), result[col].to_numpy(dtype=float), rtol=1e-12,
+			                           err_msg=col)
+		print("- {:21s} {:.3f}s".format(name, t_run))
+
+
+if __name__ == "__main__":
+	
+	test_incremental()
+	test_reference()
+	test_window_features()
+	benchmark_window_features()
@@ -0,0 +1,523 @@
+""" Module that downloads the raw data sources (JHU time series, OxCGRT).
+
+All sources of an update are downloaded at once by a thread pool, so the
+total download time is about the time of the slowest single download. The
+threads share a pool of keep-alive HTTP(S) connections per host, failed
+downloads are retried with a growing delay.
+
+The downloaded bytes are handed to the parsers (e.g. `pd.read_csv` of an
+`io.BytesIO`), local file paths are read from disk.
+
+Downloads are cached on disk (CACHE_DIR) with their ETag/Last-Modified
+headers. Further downloads of a URL are conditional requests, a response
+304 (Not Modified) reuses the cached bytes. A cache entry is written at
+download time, before the source is processed, so a 304 only saves the
+download: whether a source is already processed is decided by the manifest
+of each dataset (see storage.is_unchanged).
+"""
+import os
+import json
+import hashlib
+import time
+import threading
+import http.client
+
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit, urljoin
+
+# timeout (seconds) of connecting and of each read of a connection
+TIMEOUT = 30
+# number of retries of a failed download
+RETRIES = 3
+# delay (seconds) before the first retry, doubled for each further retry
+BACKOFF = 1.0
+# maximal number of parallel downloads
+MAX_WORKERS = 8
+# maximal number of followed redirects
+MAX_REDIRECTS = 5
+
+FILE_PATH = os.path.dirname(os.path.abspath(__file__))
+# directory of the raw download cache, None disables the cache
+CACHE_DIR = os.path.join(FILE_PATH, "data/cache")
+
+# status codes that are retried
+RETRY_STATUS = {429, 500, 502, 503, 504}
+REDIRECT_STATUS = {301, 302, 303, 307, 308}
+
+
+class FetchError(IOError):
+	"""Download of a source failed (after all retries)"""
+
+
+class Download(bytes):
+	"""Downloaded bytes of a source.
+
+	Attributes
+	----------
+	cached: bool
+		True if the bytes are from the cache because the source is not
+		modified (response 304)
+	"""
+	cached = False
+
+
+# statistics of the download cache (hits, misses, bytes saved)
+CACHE_STATS = {'hits': 0, 'misses': 0, 'bytes_saved': 0}
+_STATS_LOCK = threading.Lock()
+
+
+class ConnectionPool:
+	"""Pool of keep-alive connections per host, shared between threads.
+
+	Attributes
+	----------
+	timeout: float
+		Timeout (seconds) of new connections
+
+	Methods
+	-------
+	get()
+		Idle connection to a host or a new connection
+	put()
+		Return a connection for reuse
+	close()
+		Close all idle connections
+	"""
+	def __init__(self, timeout=TIMEOUT):
+		self.timeout = timeout
+		self._idle = {}
+		self._lock = threading.Lock()
+
+	def get(self, scheme, netloc) -> http.client.HTTPConnection:
+		with self._lock:
+			idle = self._idle.get((scheme, netloc), [])
+			if len(idle) > 0:
+				return idle.pop()
+		if scheme == 'https':
+			return http.client.HTTPSConnection(netloc, timeout=self.timeout)
+		return http.client.HTTPConnection(netloc, timeout=self.timeout)
+
+	def put(self, scheme, netloc, conn):
+		with self._lock:
+			self._idle.setdefault((scheme, netloc), []).append(conn)
+
+	def close(self):
+		with self._lock:
+			for conns in self._idle.values():
+				for conn in conns:
+					conn.close()
+			self._idle = {}
+
+
+# connection pool used by default
+POOL = ConnectionPool()
+
+
+def is_url(source) -> bool:
+	"""Check if a source is a HTTP(S) URL (otherwise a local path)."""
+	return urlsplit(str(source)).scheme in ('http', 'https')
+
+
+def request(url, headers=None, pool=None):
+	"""Send a single GET request over a pooled connection (no retries).
+
+	Parameters
+	----------
+	url: str
+		HTTP(S) URL
+	headers: dict
+		Additional request headers
+	pool: ConnectionPool
+		Connection pool, default POOL
+
+	Returns
+	-------
+	status: int
+		HTTP status code
+	headers: HTTPMessage
+		Response headers
+	body: bytes
+		Response body
+	"""
+	pool = POOL if pool is None else pool
+	parts = urlsplit(url)
+	path = parts.path or '/'
+	if parts.query:
+		path += '?' + parts.query
+
+	conn = pool.get(parts.scheme, parts.netloc)
+	try:
+		conn.request('GET', path, headers=dict(headers or {}))
+		response = conn.getresponse()
+		body = response.read()
+	except Exception:
+		conn.close()
+		raise
+	if response.will_close:
+		conn.close()
+	else:
+		pool.put(parts.scheme, parts.netloc, conn)
+
+	return response.status, response.headers, body
+
+
+def _cache_paths(cache_dir, url):
+	"""Paths of the cached bytes and of the meta data (json) of a URL."""
+	key = hashlib.sha256(url.encode()).hexdigest()[:32]
+
+	return os.path.join(cache_dir, key + '.data'), os.path.join(cache_dir, key + '.json')
+
+
+def _read_cache(cache_dir, url):
+	"""Cached meta data (url, etag, last_modified) and path of the cached
+	bytes of a URL or None if the URL is not cached."""
+	data_path, meta_path = _cache_paths(cache_dir, url)
+	try:
+		with open(meta_path) as f:
+			meta = json.load(f)
+	except (OSError, ValueError):
+		return None
+	if meta.get('url') != url or not os.path.exists(data_path):
+		return None
+
+	return meta, data_path
+
+
+def _write_cache(cache_dir, url, headers, body):
+	"""Store the bytes of a URL with its ETag/Last-Modified headers. Sources
+	without these headers are not cached."""
+	meta = {'url': url,
+	        'etag': headers.get('ETag'),
+	        'last_modified': headers.get('Last-Modified')}
+	if meta['etag'] is None and meta['last_modified'] is None:
+		return
+
+	os.makedirs(cache_dir, exist_ok=True)
+	data_path, meta_path = _cache_paths(cache_dir, url)
+	# write to temporary files first, so parallel or aborted updates never
+	# leave a half written cache entry
+	for path, content, mode in [(data_path, body, 'wb'), (meta_path, json.dumps(meta), 'w')]:
+		tmp_path = "{}.{}.tmp".format(path, threading.get_ident())
+		with open(tmp_path, mode) as f:
+			f.write(content)
+		os.replace(tmp_path, path)
+
+
+def _count(hits=0, misses=0, bytes_saved=0):
+	with _STATS_LOCK:
+		CACHE_STATS['hits'] += hits
+		CACHE_STATS['misses'] += misses
+		CACHE_STATS['bytes_saved'] += bytes_saved
+
+
+def fetch(source, headers=None, retries=RETRIES, backoff=BACKOFF, pool=None, cache_dir=CACHE_DIR) -> Download:
+	"""Download a source (or read a local file). URLs are downloaded with
+	conditional requests if they are cached.
+
+	Parameters
+	----------
+	source: str
+		URL or local path
+	headers: dict
+		Additional request headers
+	retries: int
+		Number of retries of connection errors, timeouts and status codes
+		RETRY_STATUS
+	backoff: float
+		Delay (seconds) before the first retry, doubled for each retry
+	pool: ConnectionPool
+		Connection pool, default POOL
+	cache_dir: str
+		Directory of the download cache, None disables the cache
+
+	Returns
+	-------
+	data: Download
+		Downloaded bytes, `data.cached` is True if the source is not modified
+
+	Raises
+	------
+	FetchError
+		If the download failed
+	"""
+	if not is_url(source):
+		try:
+			with open(source, 'rb') as f:
+				return Download(f.read())
+		except OSError as e:
+			raise FetchError("reading of {} failed: {}".format(source, e))
+
+	headers = dict(headers or {})
+	entry = None if cache_dir is None else _read_cache(cache_dir, source)
+	if entry is not None:
+		meta, data_path = entry
+		if meta['etag'] is not None:
+			headers['If-None-Match'] = meta['etag']
+		if meta['last_modified'] is not None:
+			headers['If-Modified-Since'] = meta['last_modified']
+
+	url = source
+	redirects = 0
+	attempt = 0
+	while True:
+		try:
+			status, response_headers, body = request(url, headers=headers, pool=pool)
+		except (OSError, http.client.HTTPException) as e:
+			status, error = None, e
+		else:
+			if status == 200:
+				if cache_dir is not None:
+					_write_cache(cache_dir, source, response_headers, body)
+					_count(misses=1)
+				return Download(body)
+			if status == 304 and entry is not None:
+				with open(data_path, 'rb') as f:
+					data = Download(f.read())
+				data.cached = True
+				_count(hits=1, bytes_saved=len(data))
+				return data
+			if status in REDIRECT_STATUS and redirects < MAX_REDIRECTS:
+				url = urljoin(url, response_headers['Location'])
+				redirects += 1
+				continue
+			error = "HTTP status {}".format(status)
+
+		if (status is not None and status not in RETRY_STATUS) or attempt >= retries:
+			raise FetchError("download of {} failed: {}".format(source, error))
+		print("- retry download of {} ({})".format(source, error))
+		time.sleep(backoff * 2 ** attempt)
+		attempt += 1
+
+
+def fetch_all(sources, max_workers=MAX_WORKERS, **kwargs) -> dict:
+	"""Download all sources at once.
+
+	Parameters
+	----------
+	sources: dict
+		URLs or local paths by key (e.g. case)
+	max_workers: int
+		Maximal number of parallel downloads
+	kwargs:
+		Arguments of `fetch()`
+
+	Returns
+	-------
+	data: dict
+		Downloads (bytes, see `Download`) by key
+
+	Raises
+	------
+	FetchError
+		If any download failed
+	"""
+	if len(sources) == 0:
+		return {}
+
+	start = time.perf_counter()
+	with ThreadPoolExecutor(max_workers=min(max_workers, len(sources))) as executor:
+		futures = {key: executor.submit(fetch, source, **kwargs) for key, source in sources.items()}
+		data = {key: future.result() for key, future in futures.items()}
+	cached = [d for d in data.values() if d.cached]
+	print("- downloaded {} sources ({:.1f} MB) in {:.1f}s".format(
+		len(data), sum(len(d) for d in data.values() if not d.cached) / 1e6, time.perf_counter() - start))
+	if len(cached) > 0:
+		print("- cache: {} not modified ({:.1f} MB saved)".format(
+			len(cached), sum(len(d) for d in cached) / 1e6))
+
+	return data
+
+
+class StandInServer:
+	"""Local HTTP stand-in server of the sources for tests, with keep-alive
+	connections. Files are published with optional ETag and Last-Modified
+	headers, conditional requests of an unchanged file are answered with 304,
+	paths without file with 404.
+
+	Attributes
+	----------
+	url: str
+		Base URL of the server, e.g. url + '/a.csv'
+	requests: list
+		Path and status of each request
+	connections: set
+		Client addresses of all requests
+
+	Methods
+	-------
+	publish()
+		Publish (or change) a file
+	close()
+		Shut the server down
+	"""
+	def __init__(self, delay=0.0, flaky=()):
+		"""
+		Parameters
+		----------
+		delay: float
+			Delay (seconds) of each response 200
+		flaky: list
+			Paths whose first request is answered with 503
+		"""
+		from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+		self.delay = delay
+		self.flaky = set(flaky)
+		self.requests = []
+		self.connections = set()
+		self._files = {}
+		self._lock = threading.Lock()
+		server = self
+
+		class Handler(BaseHTTPRequestHandler):
+			protocol_version = 'HTTP/1.1'
+
+			def do_GET(self):
+				server._respond(self)
+
+			def log_message(self, *args):
+				pass
+
+		self._server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+		threading.Thread(target=self._server.serve_forever, daemon=True).start()
+		self.url = "http://127.0.0.1:{}".format(self._server.server_address[1])
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *args):
+		self.close()
+
+	def publish(self, path, body, etag=None, modified=None):
+		"""Publish (or change) a file.
+
+		Parameters
+		----------
+		path: str
+			Path of the file, e.g. '/a.csv'
+		body: bytes or callable
+			Content of the file or a function of the number of requests of
+			the path (including this one) that returns the content
+		etag: str
+			ETag header, e.g. '"v1"'
+		modified: str
+			Last-Modified header, e.g. 'Mon, 01 Jan 2024 00:00:00 GMT'
+		"""
+		with self._lock:
+			self._files[path] = (body, etag, modified)
+
+	def close(self):
+		self._server.shutdown()
+		self._server.server_close()
+
+	def _respond(self, handler):
+		path = handler.path
+		with self._lock:
+			self.connections.add(handler.client_address)
+			count = sum(1 for p, _ in self.requests if p == path) + 1
+			body, etag, modified = self._files.get(path, (None, None, None))
+		if path in self.flaky and count == 1:
+			status = 503
+		elif body is None:
+			status = 404
+		elif (etag is not None and handler.headers.get('If-None-Match') == etag) or \
+				(modified is not None and handler.headers.get('If-Modified-Since') == modified):
+			status = 304
+		else:
+			status = 200
+		with self._lock:
+			self.requests.append((path, status))
+
+		if status == 404:
+			handler.send_error(404)
+			return
+		if status == 200:
+			time.sleep(self.delay)
+			body = body(count) if callable(body) else body
+		else:
+			body = b''
+		handler.send_response(status)
+		if etag is not None:
+			handler.send_header('ETag', etag)
+		if modified is not None:
+			handler.send_header('Last-Modified', modified)
+		if status != 304:
+			handler.send_header('Content-Length', str(len(body)))
+		handler.end_headers()
+		handler.wfile.write(body)
+
+
+def test_fetch():
+	"""Download from a local HTTP stand-in server with delayed responses,
+	a failing first request and keep-alive connections."""
+	delay = 0.5
+
+	print("Testing fetch:")
+	pool = ConnectionPool(timeout=5)
+	with StandInServer(delay=delay, flaky=['/flaky.csv']) as server:
+		try:
+			sources = {key: "{}/{}.csv".format(server.url, key) for key in ['a', 'b', 'c', 'flaky']}
+			for key in sources:
+				path = '/{}.csv'.format(key)
+				server.publish(path, lambda count, path=path: "path,n\n{},{}\n".format(path, count).encode())
+			start = time.perf_counter()
+			data = fetch_all(sources, backoff=0.1, pool=pool, cache_dir=None)
+			elapsed = time.perf_counter() - start
+			assert data['a'] == b"path,n\n/a.csv,1\n"
+			assert data['flaky'] == b"path,n\n/flaky.csv,2\n"
+			assert elapsed < 3 * delay, "downloads are not concurrent: {:.2f}s".format(elapsed)
+
+			n_connections = len(server.connections)
+			fetch_all(sources, pool=pool, cache_dir=None)
+			assert len(server.connections) == n_connections, "connections are not reused"
+
+			try:
+				fetch(server.url + "/missing.csv", pool=pool, cache_dir=None)
+				raise AssertionError("missing source without error")
+			except FetchError as e:
+				print("- expected error:", e)
+		finally:
+			pool.close()
+	print("Test finished!")
+
+
+def test_fetch_cache():
+	"""Download from a local HTTP stand-in server with ETag and
+	Last-Modified headers, check responses 200 and 304."""
+	import tempfile
+
+	print("Testing fetch cache:")
+	pool = ConnectionPool(timeout=5)
+	with StandInServer() as server, tempfile.TemporaryDirectory() as cache_dir:
+		try:
+			server.publish('/etag.csv', b"path,version\n/etag.csv,1\n", etag='"v1"')
+			server.publish('/modified.csv', b"path,version\n/modified.csv,1\n",
+			               modified="Mon, 01 Jan 2024 00:00:00 GMT")
+			sources = {path: server.url + path for path in ['/etag.csv', '/modified.csv']}
+			stats = dict(CACHE_STATS)
+			first = fetch_all(sources, pool=pool, cache_dir=cache_dir)
+			assert [status for _, status in server.requests] == [200, 200]
+			assert not any(d.cached for d in first.values())
+
+			second = fetch_all(sources, pool=pool, cache_dir=cache_dir)
+			assert [status for _, status in server.requests[2:]] == [304, 304]
+			assert all(d.cached for d in second.values())
+			assert second == first
+			assert CACHE_STATS['hits'] - stats['hits'] == 2
+			assert CACHE_STATS['misses'] - stats['misses'] == 2
+			assert CACHE_STATS['bytes_saved'] - stats['bytes_saved'] == sum(len(d) for d in first.values())
+
+			server.publish('/etag.csv', b"path,version\n/etag.csv,2\n", etag='"v2"')
+			third = fetch_all(sources, pool=pool, cache_dir=cache_dir)
+			assert not third['/etag.csv'].cached and third['/modified.csv'].cached
+			assert third['/etag.csv'] == b"path,version\n/etag.csv,2\n"
+			print("- cache stats:", CACHE_STATS)
+		finally:
+			pool.close()
+	print("Test finished!")
+
+
+if __name__ == "__main__":
+
+	test_fetch()
+	test_fetch_cache()
@@ -5,16 +5,20 @@ This class provides a `pandas` DataFrame object of the daily cumulative case num
 Science and Engineering (CSSE).
 
 The DataFrame is loaded from local subdirectory, or, if not already existing,
-loaded from JHU repository and processed into desired DataFrame.
+loaded from JHU repository and processed into desired DataFrame. A stored
+DataFrame is loaded on first access of `data`, its dates are read from the
+sidecar manifest (see storage.py). The manifest also records the hashes of
+the sources and the code version, an update is skipped if both are unchanged.
 
 The processing steps are:
 (1) load global data
 (2) restructure data column-wise to row-wise
 (3) set country codes
 (4) prepare data (check provinces and NaN)
+    steps (1) to (4) run in parallel processes for each case
 (5) merge confirmed cases, confirmed deaths and recovered (all with different length)
 (6) expand dates backwards to 2020-01-01 (needed to have same starting date for other data)
-(7) save DataFrame to local subdirectory as csv
+(7) save DataFrame to local subdirectory (Parquet, see storage.py)
 
 This class can be updated with the latest data from Johns Hopkins University see README.md
 
@@ -24,12 +28,32 @@ NOTE:
 import pandas as pd
 import numpy as np
 import os
+import io
+import csv
 
-from data_utils import COL
+from functools import lru_cache
+from concurrent.futures import ProcessPoolExecutor
+
+from data_utils import COL, date_strings
 from iso_data import ISOCodes
+from storage import load_frame, save_frame, export_csv, read_manifest, write_manifest
+from storage import source_hashes, code_version, is_unchanged, is_outdated
+from fetch import fetch_all, CACHE_DIR
 
 FILE_PATH = os.path.dirname(os.path.abspath(__file__))
 HOPKINS_CSV_PATH = os.path.join(FILE_PATH, "data/JEK_Hopkins_v21_latest.csv")
+# modules of the processing code (see storage.code_version)
+HOPKINS_CODE = ['hopkins.py', 'data_utils.py', 'iso_data.py']
+# columns of the stored data and the version of their types, increment on
+# any change (an outdated dataset is built again, see storage.is_outdated)
+HOPKINS_COLUMNS = ['Date', 'Country_Code', 'ConfirmedCases', 'ConfirmedDeaths', 'Recovered']
+HOPKINS_SCHEMA_VERSION = 1
+# number of processes that process the cases of an update in parallel
+PROCESSES = os.cpu_count() or 1
+# minimal number of new dates to process the cases in parallel, smaller
+# (e.g. daily) updates are processed in this process, because starting the
+# worker processes takes longer than processing a few dates
+PARALLEL_MIN_DATES = 365
 
 BASE_URL = "https://raw.githubusercontent.com/CSSEGISandData/COVID-19/master/csse_covid_19_data/csse_covid_19_time_series"
 
@@ -38,11 +62,46 @@ GLOBAL_URLS = {COL.cc: f"{BASE_URL}/time_series_covid19_confirmed_global.csv",
                COL.rc: f"{BASE_URL}/time_series_covid19_recovered_global.csv"
                }
 
+# JHU doesn't report recovered cases for the US (see hopkins_us.py)
 US_URLS = {COL.cc: f"{BASE_URL}/time_series_covid19_confirmed_US.csv",
-           COL.cd: f"{BASE_URL}/time_series_covid19_deaths_US.csv",
-           COL.rc: f"{BASE_URL}/time_series_covid19_recovered_US.csv"
+           COL.cd: f"{BASE_URL}/time_series_covid19_deaths_US.csv"
            }
 
+# Hopkins country names not matching the ISO country names
+HOPKINS_NAMES = {'BOL': 'Bolivia',
+                 'BRN': 'Brunei',
+                 'MNR': 'Burma',  # Myanmar
+                 'CPV': 'Cabo Verde',
+                 'COG': 'Congo (Brazzaville)',
+                 'COD': 'Congo (Kinshasa)',
+                 'CIV': "Côte d'Ivoire",
+                 'CZE': 'Czechia',
+                 'DIP': 'Diamond Princess',
+                 'SWZ': 'Eswatini',
+                 'VAT': 'Holy See',
+                 'IRN': 'Iran',
+                 'KOR': 'Korea, South',
+                 'KOS': 'Kosovo',
+                 'LAO': 'Laos',
+                 'LBY': 'Libya',
+                 'MSZ': 'MS Zaandam',
+                 'MDA': 'Moldova',
+                 'MKD': 'North Macedonia',
+                 'RUS': 'Russia',
+                 'SDN': 'South Sudan',
+                 'SYR': 'Syria',
+                 'TWN': 'Taiwan*',
+                 'TZA': 'Tanzania',
+                 'USA': 'US',
+                 'VEN': 'Venezuela',
+                 'VNM': 'Vietnam',  # Viet Nam
+                 'GAZ': 'West Bank and Gaza'
+                 }
+
+# because of different writings
+HOPKINS_ALIASES = {"Cote d'Ivoire": 'CIV'}
+
+
 
 class Hopkins:
 	"""
@@ -56,172 +115,372 @@ class Hopkins:
 		Maximum or latest date of time series
 	num_date: int
 		Number of dates/days of complete time series
+	num_rows: int
+		Number of rows of data
+	sources: dict
+		Hashes of the sources of data (see storage.py), None if unknown
+	unknown_countries: dict
+		Country names without country code for each case (set by update)
+	path: str
+		Path of the csv file of the data (see storage.py)
+	urls: dict
+		URLs (or local paths) of the time series for each case
+	cache_dir: str
+		Directory of the download cache (see fetch.py)
 		
 	Methods
 	-------
 	update()
 		Update DataFrame with the latest data from Hopkins repository
 	save()
-		Save DataFrame to local subdirectory MOBILITY_CSV_PATH
+		Save DataFrame to local subdirectory (see storage.py)
+	export_csv()
+		Export DataFrame as csv file
 	"""
-	def __init__(self):
+	def __init__(self, path=None, urls=None, cache_dir=CACHE_DIR):
+		"""
+		Parameters
+		----------
+		path: str
+			Path of the csv file of the data, default HOPKINS_CSV_PATH
+		urls: dict
+			URLs (or local paths) of the time series for each case, default
+			GLOBAL_URLS
+		cache_dir: str
+			Directory of the download cache, default fetch.CACHE_DIR
+		"""
+		self.path = HOPKINS_CSV_PATH if path is None else path
+		self.urls = GLOBAL_URLS if urls is None else urls
+		self.cache_dir = cache_dir
+		self._data = None
+		manifest = read_manifest(self.path)
+		if manifest is not None and 'num_rows' in manifest:
+			# data is loaded on first access
+			self.min_date = manifest['min_date']
+			self.max_date = manifest['max_date']
+			self.num_date = manifest['num_date']
+			self.num_rows = manifest['num_rows']
+			self.sources = manifest['sources']
+			print("Hopkins data from {} to {} total {} days".format(self.min_date, self.max_date, self.num_date))
+			return
+		
 		try:
 			print("Load Hopkins data...")
-			self.data = pd.read_csv(HOPKINS_CSV_PATH)
+			self.data = _load_hopkins_frame(self.path)
 			print("- local data loaded")
 
-			self.data["DateTime"] = pd.to_datetime(self.data["Date"], format="%Y-%m-%d", errors="ignore")
-			self.data = self.data[['Date', 'Country_Code', 'ConfirmedCases', 'ConfirmedDeaths', 'Recovered']]
-			self.min_date = self.data["Date"].unique().min()
-			self.max_date = self.data["Date"].unique().max()
-			self.num_date = self.data["Date"].nunique()
+			self._set_dates()
+			self.sources = None
 			print("- dates from {} to {} total {} days".format(self.min_date, self.max_date, self.num_date))
 			print("- shape:", self.data.shape)
+			self._write_manifest()
 		except FileNotFoundError as e:
-			print("Error: no data present for file:", os.path.split(HOPKINS_CSV_PATH)[-1])
+			print("Error: no data present for file:", os.path.split(self.path)[-1])
 			print("Proceed loading data from Hopkins URL...")
 			self.update()
 	
-	def update(self):
+	@property
+	def data(self) -> pd.DataFrame:
+		"""Hopkins data, loaded on first access"""
+		if getattr(self, '_data', None) is None:
+			self._data = _load_hopkins_frame(self.path)
+		return self._data
+	
+	@data.setter
+	def data(self, data):
+		self._data = data
+	
+	def update(self, incremental=True, urls=None, sources=None):
 		"""Load Hopkins data from repository and prepare and save the data
-		as pandas's DataFrame"""
-		print("- update Hopkins data...")
-		self.data = {case: _load_global_data(case, url) for case, url in GLOBAL_URLS.items()}
-		self.data = _prepare_and_merge(self.data)
+		as pandas's DataFrame (see `update_time_series`)
 		
-		self.data["DateTime"] = pd.to_datetime(self.data["Date"], format="%Y-%m-%d", errors="ignore")
-		self.data['Date'] = self.data['Date'].apply(lambda x: x.strftime("%Y-%m-%d"))
-		self.data = _expand_dates(self.data)
+		Parameters
+		----------
+		incremental: bool
+			Process only the dates after `max_date` of the current data and
+			append them (default). The complete time series is processed if
+			there is no current data or a new country is reported.
+		urls: dict
+			URLs (or local paths) of the time series for each case,
+			default `urls`
+		sources: dict
+			Already downloaded time series (bytes) for each case (see
+			fetch.py), default download urls
+		"""
+		print("- update Hopkins data...")
+		update_time_series(self, HOPKINS_CODE, HOPKINS_SCHEMA_VERSION, incremental=incremental,
+		                   urls=self.urls if urls is None else urls, sources=sources)
+	
+	def _process(self, sources, min_date=None):
+		"""Process the time series of all cases (see `update_time_series`)"""
+		new_data, self.unknown_countries = _process_global_data(sources, min_date=min_date)
 		
-		self.data = self.data[['Date', 'Country_Code', 'ConfirmedCases', 'ConfirmedDeaths', 'Recovered']]
-		self.min_date = self.data["Date"].unique().min()
-		self.max_date = self.data["Date"].unique().max()
+		return new_data
+	
+	def _set_complete(self, new_data):
+		"""Set the complete time series"""
+		self.data = _expand_dates(new_data)[HOPKINS_COLUMNS]
+	
+	def _new_keys(self, new_data) -> list:
+		"""Countries of new data without current data"""
+		return sorted(set(new_data['Country_Code'].astype(str)) - set(self.data['Country_Code'].astype(str)))
+	
+	def _append(self, new_data):
+		"""Append new dates to the current data"""
+		self.data = pd.concat([self.data, new_data[HOPKINS_COLUMNS]], ignore_index=True)
+	
+	def _set_dates(self):
+		"""Set min_date, max_date (%Y-%m-%d), num_date and num_rows of the data"""
+		self.min_date = self.data["Date"].min()
+		self.max_date = self.data["Date"].max()
 		self.num_date = self.data["Date"].nunique()
-		print("- dates from {} to {} total {} days".format(self.min_date, self.max_date, self.num_date))
-		print("- merged data:", self.data.shape)
-		self.save()
+		self.num_rows = len(self.data)
 	
 	def save(self):
-		self.data.to_csv(HOPKINS_CSV_PATH, columns=self.data.columns, index=False)
-		print("- saved at:", HOPKINS_CSV_PATH)
+		path = save_frame(self.data, self.path)
+		self._write_manifest()
+		print("- saved at:", path)
+	
+	def _write_manifest(self):
+		write_manifest(self.path, min_date=self.min_date, max_date=self.max_date,
+		               num_date=int(self.num_date), num_rows=int(self.num_rows),
+		               sources=self.sources, schema_version=HOPKINS_SCHEMA_VERSION,
+		               code_version=code_version(*HOPKINS_CODE))
+	
+	def export_csv(self, path=None):
+		export_csv(self.data, self.path if path is None else path)
 
 
-def _prepare_and_merge(data):
-	"""Prepare data of three different sources (confirmed cases,
-	confirmed deaths and recovered). These three sources has different
-	length and some countries doesn't have accumulated values (they have
-	values for provinces instead, so before merging all three sources we
-	need to compute the cumulative values for a country).
+def _load_hopkins_frame(path=HOPKINS_CSV_PATH) -> pd.DataFrame:
+	"""Load local Hopkins data (see storage.py)"""
+	return load_frame(path, columns=HOPKINS_COLUMNS)
+
+
+def update_time_series(dataset, code, schema, incremental=True, urls=None, sources=None):
+	"""Update a JHU time series dataset (Hopkins, HopkinsUS) and save it.
+	The update is skipped if the sources and code are unchanged since the
+	last update (see storage.is_unchanged). Only the dates after `max_date`
+	of the current data are processed and appended, the complete time series
+	is processed if there is no current data, the data was built by another
+	code or schema version (see storage.is_outdated) or a new country
+	(county) is reported.
+	NOTE: JHU corrections of already stored dates are only taken over with
+	incremental=False
 	
-	Parameter
-	---------
-	data: DataFrame
-		Original, raw data from JHU repository (row-wise time-series)
+	Parameters
+	----------
+	dataset: Hopkins or HopkinsUS
+		Dataset with the attributes `path` (csv file, see storage.py) and
+		`cache_dir` (see fetch.py) and the methods `_process(sources,
+		min_date)` (new data or None if there are no new dates),
+		`_set_complete(new_data)`, `_new_keys(new_data)`, `_append(new_data)`,
+		`_set_dates()`, `save()` and `_write_manifest()`
+	code: list
+		Modules of the processing code (see storage.code_version)
+	schema: int
+		Version of the column types of the dataset
+	incremental: bool
+		Process only the dates after `max_date` of the current data
+	urls: dict
+		URLs (or local paths) of the time series for each case
+	sources: dict
+		Already downloaded time series (bytes) for each case (see
+		fetch.py), default download urls
+	"""
+	min_date = dataset.max_date if incremental and hasattr(dataset, 'max_date') else None
+	
+	sources = fetch_all(urls, cache_dir=dataset.cache_dir) if sources is None else sources
+	hashes = source_hashes(sources)
+	if min_date is not None and is_unchanged(dataset.path, hashes, code_version(*code)):
+		print("- sources and code unchanged since last update")
+		return
+	if min_date is not None and is_outdated(dataset.path, code_version(*code), schema):
+		print("- code or schema changed since last update, process complete time series")
+		min_date = None
+	
+	new_data = dataset._process(sources, min_date=min_date)
+	if min_date is None:
+		dataset._set_complete(new_data)
+	elif new_data is None:
+		print("- no new dates after", min_date)
+		# remember the sources, so the next update with the same sources
+		# is skipped
+		dataset.sources = hashes
+		dataset._write_manifest()
+		return
+	else:
+		new_keys = dataset._new_keys(new_data)
+		if len(new_keys) > 0:
+			print("- {} new keys {}, process complete time series".format(len(new_keys), new_keys[:10]))
+			return update_time_series(dataset, code, schema, incremental=False, urls=urls, sources=sources)
+		dataset._append(new_data)
+	
+	dataset._set_dates()
+	dataset.sources = hashes
+	print("- dates from {} to {} total {} days".format(dataset.min_date, dataset.max_date, dataset.num_date))
+	print("- merged data:", dataset.data.shape)
+	dataset.save()
+
+
+def _process_global_data(sources, min_date=None, processes=None, min_dates=None):
+	"""Load, restructure and merge the time series of all cases. The cases
+	are processed in parallel (see `_process_case`) if there are at least
+	min_dates new dates, only the final alignment of the cases is serial.
+	
+	Parameters
+	----------
+	sources: dict
+		Downloaded time series (bytes) for each case
+	min_date: str
+		Only dates after min_date (%Y-%m-%d) are processed, default all dates
+	processes: int
+		Maximal number of worker processes, default PROCESSES, 1 processes
+		the cases one after another in this process
+	min_dates: int
+		Minimal number of new dates to start worker processes, default
+		PARALLEL_MIN_DATES
 		
 	Returns
 	-------
 	data: DataFrame
-		Merged data of column-wise time-series
+		Merged data of column-wise time-series or None if there are no
+		dates after min_date
+	unknown_countries: dict
+		Country names without country code for each case
 	"""
-	print("- prepare and merge data... ")
-	# reorder columns
-	for case, url in GLOBAL_URLS.items():
-		new_cols = ['Date', 'Country_Code', 'Province_State', 'Country_Region', case]
-		temp = data[case]
-		temp = temp[new_cols]
-		
-		# get all countries having some provinces
-		provs = _check_provinces(temp)
-		# check countries without nan at Province_State
-		countries_without_nan = []
-		for p in provs:
-			lookup = (temp.Country_Code == p) & (temp.Province_State.isna())
-			if len(temp[lookup]['Province_State'].unique()) < 1:
-				countries_without_nan.append(p)
-		
-		collected_dfs = [temp]
-		for c in countries_without_nan:
-			nan_df = _compute_nan(temp, c, case)
-			collected_dfs.append(nan_df)
-		
-		temp = pd.concat(collected_dfs)
-		temp = temp.sort_values(by=["Country_Code", "Province_State", "Date"])
-		# get rid of Province_State
-		temp = temp[temp.Province_State.isna()]
-		temp = temp.drop(columns=["Province_State"])
-		data[case] = temp
-	
-	# merge all three different data frames
-	new_df = data[COL.cc]
-	new_df = new_df.merge(data[COL.cd],
-	                      left_on=['Date', 'Country_Code', 'Country_Region'],
-	                      right_on=['Date', 'Country_Code', 'Country_Region'])
-	new_df = new_df.merge(data[COL.rc], on=['Date', 'Country_Code', 'Country_Region'])
+	cases = list(sources)
+	args = (cases, [sources[case] for case in cases], [min_date] * len(cases))
+	processes = min(PROCESSES if processes is None else processes, len(cases))
+	min_dates = PARALLEL_MIN_DATES if min_dates is None else min_dates
+	if processes > 1 and _num_new_dates(sources[cases[0]], min_date) >= min_dates:
+		with ProcessPoolExecutor(max_workers=processes) as executor:
+			results = list(executor.map(_process_case, *args))
+	else:
+		results = list(map(_process_case, *args))
 	
-	return new_df
+	data = {case: values for case, (values, _) in zip(cases, results)}
+	unknown_countries = {case: unknown for case, (_, unknown) in zip(cases, results)}
+	if any(values is None for values in data.values()):
+		return None, unknown_countries
+	data = _merge_cases(data)
+	
+	data["DateTime"] = data["Date"]
+	data['Date'] = date_strings(data)
+	
+	return data, unknown_countries
+
 
+def _num_new_dates(source, min_date=None) -> int:
+	"""Number of date columns after min_date of a time series, only the
+	header is parsed.
 	
-def _check_provinces(data):
-	"""Helper function to check which country has values for provinces.
+	Parameters
+	----------
+	source: bytes
+		Downloaded time series of JHU repository (see URLs)
+	min_date: str
+		Latest date already available (%Y-%m-%d), default None (all dates)
 	
-	Parameter
-	---------
-	data: DataFrame
-		DataFrame of Hopkins class
-		
 	Returns
 	-------
-	country codes: list
-		List of country codes of countries having some provinces
+	num_dates: int
 	"""
-	def check_number_of_entries(data, code):
-		parts = data[(data.Country_Code == code)]
-		return parts.shape[0]
+	header = next(csv.reader([io.BytesIO(source).readline().decode()]))
+	dates = pd.to_datetime(header[4:], format='%m/%d/%y')
+	if min_date is None:
+		return len(dates)
 	
-	country_codes = data['Country_Code'].unique()
+	return int((dates > pd.to_datetime(min_date, format='%Y-%m-%d')).sum())
+
+
+def _process_case(case, source, min_date=None):
+	"""Load, restructure, set country codes and aggregate provinces of the
+	time series of a single case (runs in a worker process).
 	
-	prov_countries = {}
-	days = data["Date"].nunique()
-	for code in country_codes:
-		num = check_number_of_entries(data, code)
-		if num > days:
-			prov_countries[code] = num
+	Parameters
+	----------
+	case: str
+		String of case (ConfirmedCases, ConfirmedDeaths, Recovered)
+	source: bytes
+		Downloaded time series of JHU repository (see URLs)
+	min_date: str
+		Only dates after min_date (%Y-%m-%d) are processed, default all dates
 	
-	return prov_countries.keys()
+	Returns
+	-------
+	values: Series
+		Values of each country indexed by date, country code and region
+		or None if there are no dates after min_date
+	unknown_countries: list
+		Country names without country code
+	"""
+	data, unknown_countries = _load_global_data(case, source, min_date=min_date)
+	if data is None:
+		return None, unknown_countries
+	data = _aggregate_provinces(data, case)
 	
+	return data.set_index(['Date', 'Country_Code', 'Country_Region'])[case], unknown_countries
+
 
-def _compute_nan(data, c_code, case) -> pd.DataFrame:
-	"""Helper function to compute the cumulative values from
-	all provinces to be set as the countries values for the
-	provinces NaN values.
+def _merge_cases(data):
+	"""Merge the values of three different sources (confirmed cases,
+	confirmed deaths and recovered). These three sources has different
+	length, so only their common dates and countries are kept.
+	
+	Parameter
+	---------
+	data: dict
+		Values of each country for each case (see `_process_case`)
+		
+	Returns
+	-------
+	data: DataFrame
+		Merged data of column-wise time-series
+	"""
+	print("- merge data... ")
+	# align all three different data frames on their common dates and countries
+	new_df = pd.concat(list(data.values()), axis=1, join='inner').reset_index()
+	
+	return new_df
+
+
+def _aggregate_provinces(data, case) -> pd.DataFrame:
+	"""Helper function to get the values of each country. The values
+	of the country are used if JHU reports them (row with Province_State
+	NaN), otherwise the cumulative values of all provinces are computed.
 	
 	Parameters
 	----------
 	data: DataFrame
 		DataFrame of Hopkins class
-	c_code: str
-		Country code of interest
 	case: str
 		String of case (ConfirmedCases, ConfirmedDeaths, Recovered)
 		
 	Returns
 	-------
-	new_df: DataFrame
-		New DataFrame for each country and case with NaN set to Province_State
+	data: DataFrame
+		Values of each country sorted by country code and date
 	"""
-	lookup = (data.Country_Code == c_code)
-	country = data[lookup]
-	new_nan = country.groupby('Date')[case].sum()
+	data = data[['Date', 'Country_Code', 'Province_State', 'Country_Region', case]]
+	is_country = data['Province_State'].isna()
 	
-	new_df = pd.DataFrame({'Date': new_nan.index, case: new_nan.values})
-	new_df['Province_State'] = np.nan
-	new_df['Country_Region'] = country['Country_Region'].unique()[0]
-	new_df['Country_Code'] = c_code
+	# countries having only values for some provinces
+	by_code = is_country.groupby(data['Country_Code'])
+	has_provinces = by_code.size() > data['Date'].nunique()
+	without_nan = has_provinces & ~by_code.any()
+	provinces = data[data['Country_Code'].isin(without_nan.index[without_nan])]
 	
-	return new_df
+	sums = provinces.groupby(['Country_Code', 'Date'])[case].sum().reset_index()
+	regions = provinces.groupby('Country_Code')['Country_Region'].first()
+	sums['Country_Region'] = sums['Country_Code'].map(regions)
+	
+	data = pd.concat([data[is_country].drop(columns=['Province_State']), sums])
+	data = data.sort_values(by=['Country_Code', 'Date'])
+	
+	return data
 
 
-def _load_global_data(cases, path_url) -> pd.DataFrame:
+def _load_global_data(cases, source, min_date=None):
 	"""Load global data from Hopkins database at github (see URLs).
 	These database has dates column-wise. We need to restructure the
 	table to have dates row-wise.
@@ -230,16 +489,28 @@ def _load_global_data(cases, path_url) -> pd.DataFrame:
 	----------
 	cases: str
 		String of case (ConfirmedCases, ConfirmedDeaths, Recovered)
-	path_url: str
-		URL of JHU repository for the corresponding time series
+	source: bytes
+		Downloaded time series of JHU repository (see URLs)
+	min_date: str
+		Only date columns after min_date (%Y-%m-%d) are loaded, default all
 		
 	Returns
 	-------
 	data: DataFrame
-		Restructured and extended DataFrame
+		Restructured and extended DataFrame or None if there are no date
+		columns after min_date
+	unknown_countries: list
+		Country names without country code
 	"""
 	print("- load data for", cases)
-	data = pd.read_csv(path_url, ',')
+	if min_date is None:
+		data = pd.read_csv(io.BytesIO(source), sep=',')
+	else:
+		min_date = pd.to_datetime(min_date, format='%Y-%m-%d')
+		data = pd.read_csv(io.BytesIO(source), sep=',', usecols=lambda col: _is_new_column(col, min_date))
+		if data.shape[1] <= 4:
+			return None, []
+	
 	# reorganize dates
 	data = _restructure(data=data, idx=4, cases=cases)
 	# rename data
@@ -253,9 +524,30 @@ def _load_global_data(cases, path_url) -> pd.DataFrame:
 	                        ignore_index=True)
 	
 	# add country code
-	data = _set_hopkins_country_code(data=data)
+	data, unknown_countries = _set_hopkins_country_code(data=data)
 	
-	return data
+	return data, unknown_countries
+
+
+def _is_new_column(col, min_date) -> bool:
+	"""Check if a column is a feature column or a date column (%m/%d/%y)
+	after min_date.
+	
+	Parameters
+	----------
+	col: str
+		Column name of JHU time series
+	min_date: Timestamp
+		Latest date already available
+		
+	Returns
+	-------
+	bool
+	"""
+	try:
+		return pd.to_datetime(col, format='%m/%d/%y') > min_date
+	except ValueError:
+		return True
 
 
 def _restructure(data, idx, cases):
@@ -277,21 +569,18 @@ def _restructure(data, idx, cases):
 		Restructured (row-wise time-series) DataFrame
 	"""
 	print('-- restructure date columns to rows...')
-	cols = data.columns.to_list()
-	
-	id_vars = cols[:idx]
-	value_vars = cols[idx:]
-	# print('- id vars ', id_vars)
-	# print('val vars', value_vars)
-	data = data.melt(id_vars, value_vars)
+	# parse the date headers (%m/%d/%y) once
+	dates = pd.to_datetime(data.columns[idx:], format='%m/%d/%y')
+	values = data.iloc[:, idx:].to_numpy()
+	num_rows = len(data)
 	
-	# rename columns
-	data = data.rename(columns={'variable': 'Date',
-	                            'value': cases})
-	# reformat date
-	data['Date'] = pd.to_datetime(data['Date'], infer_datetime_format=True, errors='ignore')
+	# rows ordered by date and then by original row (like DataFrame.melt)
+	rows = np.tile(np.arange(num_rows), len(dates))
+	new_data = pd.DataFrame({col: data[col].to_numpy()[rows] for col in data.columns[:idx]})
+	new_data['Date'] = dates.repeat(num_rows)
+	new_data[cases] = values.ravel(order='F')
 	
-	return data
+	return new_data
 
 
 def _set_hopkins_country_code(data):
@@ -306,65 +595,45 @@ def _set_hopkins_country_code(data):
 	-------
 	data: DataFrame
 		Extended DataFrame including country codes
+	unknown_countries: list
+		Sorted country names without country code (set to -1)
 	"""
 	print('-- set country codes...')
+	lookup = _country_code_lookup()
+	
+	names = data['Country_Region']
+	data['Country_Code'] = names.map(lookup)
+	
+	unknown = data['Country_Code'].isna()
+	unknown_countries = sorted(names[unknown].unique())
+	if unknown_countries:
+		print('-- unknown countries:', unknown_countries)
+	data['Country_Code'] = data['Country_Code'].astype(object)
+	data.loc[unknown, 'Country_Code'] = -1
+	
+	return data, unknown_countries
+
+
+@lru_cache(maxsize=1)
+def _country_code_lookup():
+	"""Country name to ISO 3166-1 Alpha-3 code lookup of the ISO country
+	names, the Hopkins specific names (HOPKINS_NAMES) and other writings
+	(HOPKINS_ALIASES).
+	
+	Returns
+	-------
+	lookup: dict
+		Country names with corresponding country codes
+	"""
 	# load ISO country names and codes
 	iso = ISOCodes()
-	# collect unknown country names
-	unkown_countries = []
+	codes = iso.codes.drop_duplicates(subset=['Name'])
 	
-	for name in data['Country_Region'].unique():
-		try:
-			iso_code = iso.codes[iso.codes['Name'] == name]['Code'].unique()[0]
-			# print('set code {0} for {1}'.format(set_code, name))
-			data.loc[data['Country_Region'] == name, 'Country_Code'] = iso_code
-		except Exception as e:
-			unkown_countries.append(name)
-	
-	# print(unknown_countries)
-	# unknown countries by hand
-	kd_dict = {'BOL': 'Bolivia',
-	           'BRN': 'Brunei',
-	           'MNR': 'Burma',  # Myanmar
-	           'CPV': 'Cabo Verde',
-	           'COG': 'Congo (Brazzaville)',
-	           'COD': 'Congo (Kinshasa)',
-	           'CIV': "Côte d'Ivoire",
-	           'CZE': 'Czechia',
-	           'DIP': 'Diamond Princess',
-	           'SWZ': 'Eswatini',
-	           'VAT': 'Holy See',
-	           'IRN': 'Iran',
-	           'KOR': 'Korea, South',
-	           'KOS': 'Kosovo',
-	           'LAO': 'Laos',
-	           'LBY': 'Libya',
-	           'MSZ': 'MS Zaandam',
-	           'MDA': 'Moldova',
-	           'MKD': 'North Macedonia',
-	           'RUS': 'Russia',
-	           'SDN': 'South Sudan',
-	           'SYR': 'Syria',
-	           'TWN': 'Taiwan*',
-	           'TZA': 'Tanzania',
-	           'USA': 'US',
-	           'VEN': 'Venezuela',
-	           'VNM': 'Vietnam',  # Viet Nam
-	           'GAZ': 'West Bank and Gaza'
-	           }
-	
-	# update country codes
-	for c, n in zip(kd_dict.keys(), kd_dict.values()):
-		# print('set code {0} for {1}'.format(c, n))
-		data.loc[(data['Country_Region'] == n), 'Country_Code'] = c
-	
-	# because of different writings
-	data.loc[(data['Country_Region'] == "Cote d'Ivoire"), 'Country_Code'] = 'CIV'
-	data['Country_Code'].fillna(-1, inplace=True)
-	# TODO: (debug) finally check missing values
-	# check_missing_values(data)
+	lookup = dict(zip(codes['Name'], codes['Code']))
+	lookup.update({n: c for c, n in HOPKINS_NAMES.items()})
+	lookup.update(HOPKINS_ALIASES)
 	
-	return data
+	return lookup
 
 
 def _expand_dates(data):
@@ -382,34 +651,136 @@ def _expand_dates(data):
 		Extended DataFrame with time-series starting at 2020-01-01
 	"""
 	print('- expand dates...')
-	# collect new entries
-	new_entries = []
-	# check start and end date for each country and province
-	for c in data['Country_Code'].unique():
-		state = data.loc[data['Country_Code'] == c]
-		
-		ti = pd.to_datetime('2020-01-01', format='%Y-%m-%d', errors='ignore')
-		t1 = state['DateTime'].min()
-		
-		# backward fill values
-		bf = t1 - ti
-		
-		t1_row = state.loc[state['DateTime'] == t1]
-		for d in range(int(bf.days)):
-			a_date = ti + pd.Timedelta(d, 'd')
-			
-			new_row = t1_row.copy()
-			
-			new_row['DateTime'] = a_date
-			new_row['Date'] = a_date.strftime('%Y-%m-%d')
-			new_entries.append(new_row)
+	ti = pd.to_datetime('2020-01-01', format='%Y-%m-%d')
+	
+	# rows of the first date of each country are used to backward fill values
+	first_date = data.groupby('Country_Code', sort=False)['DateTime'].transform('min')
+	first_rows = data[data['DateTime'] == first_date]
+	num_days = (first_rows['DateTime'] - ti).dt.days.clip(lower=0).to_numpy()
+	
+	# build all missing (country, date) entries at once, ordered by
+	# country, date and row like the data
+	row_pos = np.repeat(np.arange(len(first_rows)), num_days)
+	day_pos = np.arange(len(row_pos)) - np.repeat(np.cumsum(num_days) - num_days, num_days)
+	country_pos = pd.factorize(first_rows['Country_Code'])[0][row_pos]
+	order = np.lexsort((row_pos, day_pos, country_pos))
+	
+	new_entries = first_rows.iloc[row_pos[order]].copy()
+	new_dates = ti + pd.to_timedelta(day_pos[order], unit='D')
+	new_entries['DateTime'] = new_dates
+	new_entries['Date'] = date_strings(new_entries)
 	
 	# finally append all new entries to data
-	data = data.append(new_entries)
+	data = pd.concat([data, new_entries])
 	
 	return data
 
 
+def _synthetic_global_csv(case, end, seed=0, rows=None) -> bytes:
+	"""Synthetic JHU global time series (wide csv) of a case from 2020-01-22
+	to end (%Y-%m-%d, at most 2023-03-09 like the real one), shaped like the
+	real one: the values of a date are the same for every end, by default
+	France is reported by provinces only.
+	
+	Parameters
+	----------
+	case: str
+		String of case (ConfirmedCases, ConfirmedDeaths, Recovered)
+	end: str
+		Last date column
+	seed: int
+		Seed of the random daily cases
+	rows: list
+		(Province/State, Country/Region) of the rows, default a few countries
+	
+	Returns
+	-------
+	source: bytes
+		csv file like a download (see fetch.py)
+	"""
+	if rows is None:
+		rows = [(np.nan, 'Germany'), ('Corsica', 'France'), ('Brittany', 'France'), (np.nan, 'Italy'),
+		        ('Hubei', 'China'), (np.nan, 'China'), (np.nan, 'Nowhere')]
+	dates = pd.date_range('2020-01-22', '2023-03-09')
+	rng = np.random.default_rng([seed, list(GLOBAL_URLS).index(case)])
+	values = np.cumsum(rng.integers(0, 50, (len(rows), len(dates))), axis=1)
+	num_days = dates.get_loc(pd.Timestamp(end)) + 1
+	
+	data = pd.DataFrame(rows, columns=['Province/State', 'Country/Region'])
+	data['Lat'], data['Long'] = 0.0, 0.0
+	columns = ['{}/{}/{}'.format(d.month, d.day, d.strftime('%y')) for d in dates[:num_days]]
+	data = pd.concat([data, pd.DataFrame(values[:, :num_days], columns=columns)], axis=1)
+	
+	return data.to_csv(index=False).encode()
+
+
+def test_process_global_data():
+	"""Cases processed by worker processes equal the cases processed in
+	this process, small updates don't start worker processes"""
+	import contextlib
+	global ProcessPoolExecutor
+	
+	print("Testing parallel processing of cases:")
+	sources = {case: _synthetic_global_csv(case, '2020-06-30') for case in GLOBAL_URLS}
+	with contextlib.redirect_stdout(io.StringIO()):
+		serial, _ = _process_global_data(sources, min_date='2020-03-31', processes=1)
+		parallel, _ = _process_global_data(sources, min_date='2020-03-31', processes=3, min_dates=0)
+	pd.testing.assert_frame_equal(serial, parallel)
+	
+	def no_pool(*args, **kwargs):
+		raise AssertionError("worker processes started for a small update")
+	
+	executor, ProcessPoolExecutor = ProcessPoolExecutor, no_pool
+	try:
+		with contextlib.redirect_stdout(io.StringIO()):
+			small, _ = _process_global_data(sources, min_date='2020-06-28', processes=3)
+	finally:
+		ProcessPoolExecutor = executor
+	assert sorted(small['Date'].unique()) == ['2020-06-29', '2020-06-30']
+	print("Test finished!")
+
+
+def test_incremental_update():
+	"""Incremental update of Hopkins data from a local HTTP stand-in server
+	of JHU must equal the complete processing of the same sources"""
+	import tempfile
+	import contextlib
+	from fetch import StandInServer
+	
+	def publish(server, end):
+		for case in GLOBAL_URLS:
+			server.publish('/' + case, _synthetic_global_csv(case, end))
+	
+	print("Testing incremental Hopkins update:")
+	with StandInServer() as server, tempfile.TemporaryDirectory() as tmp:
+		path = os.path.join(tmp, 'hopkins.csv')
+		urls = {case: server.url + '/' + case for case in GLOBAL_URLS}
+		with contextlib.redirect_stdout(io.StringIO()):
+			# complete processing of the first dates, then daily updates
+			publish(server, '2020-05-31')
+			hop = Hopkins(path, urls=urls, cache_dir=None)
+			for end in ['2020-06-01', '2020-06-02', '2020-08-31']:
+				publish(server, end)
+				hop.update()
+			incremental = Hopkins(path).data
+			hop.update(incremental=False)
+			full = Hopkins(path).data
+			
+			# data of another code version is built again completely
+			hop.data = hop.data.assign(ConfirmedCases=0)
+			hop.save()
+			write_manifest(path, **dict(read_manifest(path), code_version='outdated'))
+			Hopkins(path, urls=urls, cache_dir=None).update()
+			rebuilt = Hopkins(path).data
+	
+	assert hop.max_date == '2020-08-31'
+	incremental = incremental.sort_values(by=['Country_Code', 'Date'], ignore_index=True)
+	full = full.sort_values(by=['Country_Code', 'Date'], ignore_index=True)
+	pd.testing.assert_frame_equal(incremental, full, check_exact=True)
+	pd.testing.assert_frame_equal(rebuilt.sort_values(by=['Country_Code', 'Date'], ignore_index=True), full)
+	print("Test finished!")
+
+
 def test_hopkins_data():
 	print("Testing Hopkins DataFrame")
 	hop = Hopkins()
@@ -417,6 +788,71 @@ def test_hopkins_data():
 	print("Test finished")
 
 
+def benchmark_provinces(end='2023-03-09', repeat=3):
+	"""Province roll-up (`_aggregate_provinces`) against the previous
+	per-country scans on a JHU sized input (about 280 rows, 1143 dates at
+	the end of JHU), results must be equal. Processing of all cases
+	(`_process_global_data`) for comparison, best of `repeat`.
+	
+	Parameters
+	----------
+	end: str
+		Last date column (%Y-%m-%d)
+	repeat: int
+		Number of runs
+	"""
+	import contextlib
+	from data_utils import best_of
+	
+	def aggregate_per_country(data, case):
+		# previous implementation: scan the frame for each country code
+		data = data[['Date', 'Country_Code', 'Province_State', 'Country_Region', case]]
+		days = data['Date'].nunique()
+		provinces = [code for code in data['Country_Code'].unique()
+		             if len(data[data['Country_Code'] == code]) > days]
+		collected = [data]
+		for code in provinces:
+			country = data[data['Country_Code'] == code]
+			if country['Province_State'].isna().any():
+				continue
+			sums = country.groupby('Date')[case].sum()
+			collected.append(pd.DataFrame({'Date': sums.index, case: sums.values, 'Province_State': np.nan,
+			                               'Country_Region': country['Country_Region'].iloc[0],
+			                               'Country_Code': code}))
+		data = pd.concat(collected)
+		data = data[data['Province_State'].isna()].drop(columns=['Province_State'])
+		
+		return data.sort_values(by=['Country_Code', 'Date'])
+	
+	print("Benchmark province roll-up:")
+	names = [n for n in ISOCodes().codes['Name'].drop_duplicates()
+	         if n not in ['Australia', 'Canada', 'China', 'Denmark', 'France', 'United Kingdom']]
+	rows = [(np.nan, name) for name in names]
+	rows += [(p, 'Australia') for p in ['New South Wales', 'Victoria', 'Queensland', 'Tasmania']]
+	rows += [(p, 'Canada') for p in ['Ontario', 'Quebec', 'Alberta', 'Yukon']]
+	rows += [(p, 'China') for p in ['Hubei', 'Beijing', 'Shanghai', 'Tibet']]
+	rows += [(np.nan, 'France'), ('Reunion', 'France'), ('Martinique', 'France')]
+	rows += [(np.nan, 'United Kingdom'), ('Bermuda', 'United Kingdom')]
+	rows += [(np.nan, 'Denmark'), ('Greenland', 'Denmark')]
+	sources = {case: _synthetic_global_csv(case, end, rows=rows) for case in GLOBAL_URLS}
+	
+	with contextlib.redirect_stdout(io.StringIO()):
+		data = _load_global_data(COL.cc, sources[COL.cc])[0]
+		new = _aggregate_provinces(data, COL.cc)
+		old = aggregate_per_country(data, COL.cc)
+		pd.testing.assert_frame_equal(new.reset_index(drop=True), old[new.columns].reset_index(drop=True))
+		t_old = best_of(lambda: aggregate_per_country(data, COL.cc), repeat)[1]
+		t_new = best_of(lambda: _aggregate_provinces(data, COL.cc), repeat)[1]
+		t_all = best_of(lambda: _process_global_data(sources, processes=1), repeat)[1]
+	print("- {} rows x {} dates, {} long rows".format(len(rows), data['Date'].nunique(), len(data)))
+	print("- per-country scans     {:.3f}s".format(t_old))
+	print("- groupby roll-up       {:.3f}s".format(t_new))
+	print("- all cases, 1 process  {:.3f}s".format(t_all))
+
+
 if __name__ == '__main__':
 	# do some tests
+	test_process_global_data()
+	test_incremental_update()
 	test_hopkins_data()
+	benchmark_provinces()
@@ -0,0 +1,409 @@
+"""HopkinsUS Class
+
+This class provides a `pandas` DataFrame object of the daily cumulative case numbers
+of US counties (starting Jan 22, 2020) reported by the Johns Hopkins University Center
+for Systems Science and Engineering (CSSE), see US_URLS in hopkins.py.
+
+The DataFrame is loaded from local subdirectory, or, if not already existing,
+loaded from JHU repository and processed into desired DataFrame.
+
+The processing steps are:
+(1) load US data (only the new date columns for an incremental update)
+(2) restructure data column-wise to row-wise (see hopkins.py)
+(3) merge confirmed cases and confirmed deaths on county and date
+(4) save DataFrame and county table to local subdirectory (see storage.py)
+    with a manifest of source hashes and code version, an update with
+    unchanged sources and code is skipped
+
+The counties are identified by their FIPS code (int32), rows without FIPS code
+(e.g. cruise ships) use the last five digits of the JHU UID. Cases are stored as
+int32, county attributes (name, state, population) are stored once per county,
+so the data of thousands of counties fits in a few bytes per county and day.
+
+The county data can be rolled up to states (`by_state()`) and nation (`by_nation()`).
+"""
+import pandas as pd
+import numpy as np
+import os
+import io
+
+from data_utils import COL
+from hopkins import US_URLS, _restructure, _is_new_column, update_time_series
+from storage import load_frame, save_frame, export_csv, read_manifest, write_manifest, code_version
+from fetch import CACHE_DIR
+
+FILE_PATH = os.path.dirname(os.path.abspath(__file__))
+HOPKINS_US_CSV_PATH = os.path.join(FILE_PATH, "data/JEK_Hopkins_US_v21_latest.csv")
+HOPKINS_US_COUNTIES_CSV_PATH = os.path.join(FILE_PATH, "data/JEK_Hopkins_US_counties_v21_latest.csv")
+
+# modules of the processing code (see storage.code_version)
+HOPKINS_US_CODE = ['hopkins_us.py', 'hopkins.py', 'data_utils.py']
+# version of the stored column types, increment on any change (an outdated
+# dataset is built again, see storage.is_outdated)
+HOPKINS_US_SCHEMA_VERSION = 1
+# county attributes of the time series (Population only in deaths)
+COUNTY_COLUMNS = ['Admin2', 'Province_State', 'Population']
+
+
+class HopkinsUS:
+	"""
+	Attributes
+	----------
+	data: DataFrame
+		Cumulative cases (ConfirmedCases, ConfirmedDeaths) of each county
+		(FIPS) and date (DateTime), ordered by date and county
+	counties: DataFrame
+		County name (Admin2), state (Province_State) and Population indexed
+		by FIPS
+	min_date: str
+		Minimum or starting date of time series
+	max_date: str
+		Maximum or latest date of time series
+	num_date: int
+		Number of dates/days
+	path: str
+		Path of the csv file of the data (see storage.py)
+	counties_path: str
+		Path of the csv file of the county table
+	urls: dict
+		URLs (or local paths) of the time series for each case
+	cache_dir: str
+		Directory of the download cache (see fetch.py)
+
+	Methods
+	-------
+	update()
+		Update DataFrame with the latest data from Hopkins repository
+	save()
+		Save DataFrame and county table to local subdirectory (see storage.py)
+	export_csv()
+		Export DataFrame as csv file
+	by_state()
+		Cumulative cases of each state and date
+	by_nation()
+		Cumulative cases of the US for each date
+	"""
+	def __init__(self, path=None, counties_path=None, urls=None, cache_dir=CACHE_DIR):
+		"""
+		Parameters
+		----------
+		path: str
+			Path of the csv file of the data, default HOPKINS_US_CSV_PATH
+		counties_path: str
+			Path of the csv file of the county table, default
+			HOPKINS_US_COUNTIES_CSV_PATH
+		urls: dict
+			URLs (or local paths) of the time series for each case, default
+			US_URLS
+		cache_dir: str
+			Directory of the download cache, default fetch.CACHE_DIR
+		"""
+		self.path = HOPKINS_US_CSV_PATH if path is None else path
+		self.counties_path = HOPKINS_US_COUNTIES_CSV_PATH if counties_path is None else counties_path
+		self.urls = US_URLS if urls is None else urls
+		self.cache_dir = cache_dir
+		try:
+			print("Load Hopkins US data...")
+			self.data = _compact(load_frame(self.path, parse_dates={'DateTime': 'DateTime'}))
+			self.counties = _compact_counties(load_frame(self.counties_path))
+			manifest = read_manifest(self.path)
+			self.sources = None if manifest is None else manifest.get('sources')
+			print("- local data loaded")
+
+			self._set_dates()
+			print("- dates from {} to {} total {} days".format(self.min_date, self.max_date, self.num_date))
+			print("- shape:", self.data.shape)
+		except FileNotFoundError as e:
+			print("Error: no data present for file:", os.path.split(self.path)[-1])
+			print("Proceed loading data from Hopkins URL...")
+			self.update()
+
+	def _set_dates(self):
+		"""Set min_date, max_date (%Y-%m-%d) and num_date of the data"""
+		dates = self.data['DateTime']
+		self.min_date = dates.min().strftime("%Y-%m-%d")
+		self.max_date = dates.max().strftime("%Y-%m-%d")
+		self.num_date = dates.nunique()
+
+	def update(self, incremental=True, urls=None, sources=None):
+		"""Load Hopkins US data from repository and prepare and save the data
+		as pandas's DataFrame (see hopkins.update_time_series)
+
+		Parameters
+		----------
+		incremental: bool
+			Process only the dates after `max_date` of the current data and
+			append them (default). The complete time series is processed if
+			there is no current data or a new county is reported.
+		urls: dict
+			URLs (or local paths) of the time series for each case,
+			default `urls`
+		sources: dict
+			Already downloaded time series (bytes) for each case (see
+			fetch.py), default download urls
+		"""
+		print("- update Hopkins US data...")
+		update_time_series(self, HOPKINS_US_CODE, HOPKINS_US_SCHEMA_VERSION, incremental=incremental,
+		                   urls=self.urls if urls is None else urls, sources=sources)
+
+	def _process(self, sources, min_date=None):
+		"""Process the time series of all cases, the data and the county table
+		or None if there are no new dates"""
+		new_data, counties = _process_us_data(sources, min_date=min_date)
+
+		return None if new_data is None else (new_data, counties)
+
+	def _set_complete(self, new_data):
+		"""Set the complete time series and county table"""
+		self.data, self.counties = new_data
+		print("- counties:", len(self.counties))
+
+	def _new_keys(self, new_data) -> list:
+		"""Counties of new data without current data"""
+		return list(new_data[1].index.difference(self.counties.index))
+
+	def _append(self, new_data):
+		"""Append new dates to the current data"""
+		self.data = pd.concat([self.data, new_data[0]], ignore_index=True)
+
+	def save(self):
+		path = save_frame(self.data, self.path)
+		save_frame(self.counties.reset_index(), self.counties_path)
+		self._write_manifest()
+		print("- saved at:", path)
+
+	def _write_manifest(self):
+		write_manifest(self.path, min_date=self.min_date, max_date=self.max_date,
+		               num_date=int(self.num_date), num_rows=len(self.data), num_counties=len(self.counties),
+		               sources=getattr(self, 'sources', None), schema_version=HOPKINS_US_SCHEMA_VERSION,
+		               code_version=code_version(*HOPKINS_US_CODE))
+
+	def export_csv(self, path=None):
+		export_csv(self.data, self.path if path is None else path)
+
+	def by_state(self) -> pd.DataFrame:
+		"""Cumulative cases of each state and date
+
+		Returns
+		-------
+		data: DataFrame
+			Cases indexed by Province_State and DateTime
+		"""
+		states = self.counties['Province_State'].reindex(self.data['FIPS'])
+		states = pd.Series(states.to_numpy(), index=self.data.index, name='Province_State')
+
+		return self.data.groupby([states, 'DateTime'], observed=True)[[COL.cc, COL.cd]].sum()
+
+	def by_nation(self) -> pd.DataFrame:
+		"""Cumulative cases of the US for each date
+
+		Returns
+		-------
+		data: DataFrame
+			Cases indexed by DateTime
+		"""
+		return self.data.groupby('DateTime')[[COL.cc, COL.cd]].sum()
+
+
+def _process_us_data(sources, min_date=None):
+	"""Load, restructure and merge the time series of all cases.
+
+	Parameters
+	----------
+	sources: dict
+		Downloaded time series (bytes) for each case
+	min_date: str
+		Only dates after min_date (%Y-%m-%d) are processed, default all dates
+
+	Returns
+	-------
+	data: DataFrame
+		Cases of each county and date or None if there are no dates after
+		min_date
+	counties: DataFrame
+		County attributes indexed by FIPS
+	"""
+	values = []
+	counties = None
+	for case, source in sources.items():
+		data, case_counties = _load_us_data(case, source, min_date=min_date)
+		if data is None:
+			return None, None
+		values.append(data.set_index(['FIPS', 'DateTime'])[case])
+
+		if counties is None:
+			counties = case_counties
+		else:
+			counties = counties.join(case_counties[case_counties.columns.difference(counties.columns)])
+
+	print("- merge data...")
+	# align the cases on their common counties and dates
+	data = pd.concat(values, axis=1, join='inner').reset_index()
+	data = data.sort_values(by=['DateTime', 'FIPS'], ignore_index=True)
+
+	return _compact(data), _compact_counties(counties.reset_index())
+
+
+def _load_us_data(case, source, min_date=None):
+	"""Load US data from Hopkins database at github (see US_URLS) and
+	restructure the date columns to rows.
+
+	Parameters
+	----------
+	case: str
+		String of case (ConfirmedCases, ConfirmedDeaths)
+	source: bytes
+		Downloaded time series of JHU repository
+	min_date: str
+		Only date columns after min_date (%Y-%m-%d) are loaded, default all
+
+	Returns
+	-------
+	data: DataFrame
+		Cases of each county (FIPS) and date (DateTime) or None if there
+		are no date columns after min_date
+	counties: DataFrame
+		County attributes indexed by FIPS
+	"""
+	print("- load US data for", case)
+	if min_date is None:
+		data = pd.read_csv(io.BytesIO(source), sep=',')
+	else:
+		min_date = pd.to_datetime(min_date, format='%Y-%m-%d')
+		data = pd.read_csv(io.BytesIO(source), sep=',', usecols=lambda col: _is_new_column(col, min_date))
+
+	date_cols = [col for col in data.columns if _is_date_column(col)]
+	if len(date_cols) == 0:
+		return None, None
+
+	# rows without FIPS code use the last five digits of the UID
+	data['FIPS'] = data['FIPS'].fillna(data['UID'] % 100000).astype(np.int32)
+	counties = data[['FIPS'] + [col for col in COUNTY_COLUMNS if col in data.columns]].set_index('FIPS')
+
+	data = _restructure(data=data[['FIPS'] + date_cols], idx=1, cases=case)
+	data = data.rename(columns={'Date': 'DateTime'})
+
+	return data, counties
+
+
+def _is_date_column(col) -> bool:
+	"""Check if a column is a date column (%m/%d/%y) of the JHU time series"""
+	try:
+		pd.to_datetime(col, format='%m/%d/%y')
+		return True
+	except ValueError:
+		return False
+
+
+def _compact(data) -> pd.DataFrame:
+	"""Convert FIPS codes and cases to int32"""
+	return data.astype({'FIPS': np.int32, COL.cc: np.int32, COL.cd: np.int32})
+
+
+def _compact_counties(counties) -> pd.DataFrame:
+	"""Index the county table by FIPS (int32) and store states as categories"""
+	counties = counties.astype({'FIPS': np.int32, 'Province_State': 'category'})
+
+	return counties.set_index('FIPS')
+
+
+def _synthetic_us_csv(path, num_counties=3000, num_days=400, population=False, seed=0):
+	"""Write a synthetic wide time series shaped like the JHU US files
+	(county columns followed by one cumulative column per date)."""
+	rng = np.random.default_rng(seed)
+	fips = 1000 + np.arange(num_counties, dtype=np.int64) * 7
+	data = pd.DataFrame({'UID': 84000000 + fips,
+	                     'iso2': 'US', 'iso3': 'USA', 'code3': 840,
+	                     'FIPS': fips.astype(float),
+	                     'Admin2': ['County {}'.format(f) for f in fips],
+	                     'Province_State': ['State {}'.format(f // 1000) for f in fips],
+	                     'Country_Region': 'US',
+	                     'Lat': rng.uniform(25, 48, num_counties),
+	                     'Long_': rng.uniform(-124, -67, num_counties)})
+	# cruise ships without FIPS code
+	data.loc[num_counties - 2:, 'FIPS'] = np.nan
+	data.loc[num_counties - 2:, 'UID'] = [84088888, 84099999]
+	data['Combined_Key'] = data['Admin2'] + ', ' + data['Province_State'] + ', US'
+	if population:
+		data['Population'] = rng.integers(1000, 1000000, num_counties)
+
+	dates = pd.date_range('2020-01-22', periods=num_days)
+	values = np.cumsum(rng.integers(0, 50, (num_counties, num_days)), axis=1)
+	date_cols = ['{}/{}/{}'.format(d.month, d.day, d.strftime('%y')) for d in dates]
+	data = pd.concat([data, pd.DataFrame(values, columns=date_cols)], axis=1)
+	data.to_csv(path, index=False)
+
+	return data
+
+
+def test_hopkins_us_data():
+	"""Full and incremental update from synthetic wide csv files"""
+	import tempfile
+	import time
+	import contextlib
+
+	print("Testing Hopkins US DataFrame")
+	with tempfile.TemporaryDirectory() as tmp:
+		files = {}
+		for days in [300, 400]:
+			for case, population in [(COL.cc, False), (COL.cd, True)]:
+				path = os.path.join(tmp, "{}_{}.csv".format(case, days))
+				files[case, days] = _synthetic_us_csv(path, num_days=days, population=population, seed=days)
+		urls = {days: {case: os.path.join(tmp, "{}_{}.csv".format(case, days)) for case in [COL.cc, COL.cd]}
+		        for days in [300, 400]}
+		paths = {name: (os.path.join(tmp, name + ".csv"), os.path.join(tmp, name + "_counties.csv"))
+		         for name in ['full', 'us']}
+
+		start = time.perf_counter()
+		full = HopkinsUS(*paths['full'], urls=urls[400], cache_dir=None)
+		print("- full update: {:.2f}s, {:.1f} MB".format(
+			time.perf_counter() - start, full.data.memory_usage(deep=True).sum() / 1e6))
+		assert full.data.shape == (3000 * 400, 4)
+		assert full.num_date == 400 and full.min_date == '2020-01-22'
+
+		wide = files[COL.cc, 400]
+		nation = full.by_nation()
+		assert (nation[COL.cc].to_numpy() == wide.iloc[:, -400:].sum().to_numpy()).all()
+		state = full.by_state()
+		assert (state.groupby('DateTime')[COL.cc].sum().to_numpy() == nation[COL.cc].to_numpy()).all()
+		assert full.counties.loc[84088888 % 100000, 'Population'] > 0
+
+		inc = HopkinsUS(*paths['us'], urls=urls[300], cache_dir=None)
+		start = time.perf_counter()
+		# the first 300 days of both files are different (other seed), so
+		# only the new dates of the second file are taken over
+		inc.update(urls=urls[400])
+		print("- incremental update: {:.2f}s".format(time.perf_counter() - start))
+		pd.testing.assert_frame_equal(inc.data[inc.data['DateTime'] > '2020-11-16'].reset_index(drop=True),
+		                              full.data[full.data['DateTime'] > '2020-11-16'].reset_index(drop=True))
+		assert inc.num_date == 400
+
+		log = io.StringIO()
+		with contextlib.redirect_stdout(log):
+			inc.update(urls=urls[400])
+		assert "sources and code unchanged" in log.getvalue()
+
+		# sources without new dates are recorded, the next update is skipped
+		with contextlib.redirect_stdout(io.StringIO()):
+			inc.update(urls=urls[300])
+		log = io.StringIO()
+		with contextlib.redirect_stdout(log):
+			inc.update(urls=urls[300])
+		assert "sources and code unchanged" in log.getvalue()
+
+		loaded = HopkinsUS(*paths['us'])
+		pd.testing.assert_frame_equal(loaded.data, inc.data, check_dtype=False)
+
+		# data of another code version is built again completely
+		write_manifest(loaded.path, **dict(read_manifest(loaded.path), code_version='outdated'))
+		log = io.StringIO()
+		with contextlib.redirect_stdout(log):
+			loaded.update(urls=urls[400])
+		assert "process complete time series" in log.getvalue()
+		pd.testing.assert_frame_equal(loaded.data, full.data)
+	print("Test finished")
+
+
+if __name__ == '__main__':
+	# do some tests
+	test_hopkins_us_data()
@@ -8,23 +8,37 @@ This class can be updated with the latest data from two different sources:
 (2) Latest stringency index from Oxford University see Readme.md
 
 This class allows the user to plot some features of the data.
+
+The data is loaded lazily: min_date, max_date and num_date are read from the
+sidecar manifest of the stored data (see storage.py), the DataFrame itself is
+loaded on first access of `data`. Oxford, Hopkins and matplotlib are only
+imported when the data is built, updated or plotted. The manifest also records
+the hashes of the sources and the code version, an update is skipped if both
+are unchanged.
 """
 
 import numpy as np
 import pandas as pd
 
-import matplotlib.pyplot as plt
-import matplotlib.gridspec as gridspec
 import os
 
-from data_utils import COL, FEATURE, FEATURE_DICT
-from data_utils import load_oxford_data, extend_data, fill_missing_values
-from data_utils import create_features, add_world_population_data
-from oxford import Oxford
-from hopkins import Hopkins
+from data_utils import FEATURE
+from data_utils import OXFORD_DATA_URL, MOBILITY_COLUMNS, load_oxford_data, process_data
+from data_utils import downcast, validate_schema, SCHEMA
+from data_utils import create_window_features, WINDOW_FEATURES
+from storage import load_frame, save_frame, export_csv, read_manifest, write_manifest
+from storage import source_hashes, code_version, is_unchanged, is_outdated, dataset_version
+from fetch import fetch_all, FetchError, CACHE_DIR
+from panel import TensorIndex, tensor_index, to_tensor, from_tensor, export_panel, MOBILITY_PANEL_PATH
 
 FILE_PATH = os.path.dirname(os.path.abspath(__file__))
 MOBILITY_CSV_PATH = os.path.join(FILE_PATH, "data/JEK_OxCGRT_v21_latest.csv")
+# window features of the data, stored next to the data (see get_window_features)
+MOBILITY_WINDOW_CSV_PATH = os.path.join(FILE_PATH, "data/JEK_OxCGRT_v21_windows.csv")
+# state table to continue the data, stored next to the data (see update)
+MOBILITY_STATE_CSV_PATH = os.path.join(FILE_PATH, "data/JEK_OxCGRT_v21_state.csv")
+# modules of the processing code (see storage.code_version)
+MOBILITY_CODE = ['mobility.py', 'oxford.py', 'hopkins.py', 'data_utils.py', 'world_data.py', 'iso_data.py']
 
 
 class Mobility:
@@ -39,54 +53,321 @@ class Mobility:
 			Maximum or latest date of time series
 		num_date: int
 			Number of dates/days
+		num_rows: int
+			Number of rows of data
+		sources: dict
+			Hashes of the Oxford and Hopkins sources of data (see storage.py),
+			None if unknown
+		version: str
+			Version of the data, changes with every update
+		offsets: DataFrame
+			First (start) and last + 1 (stop) row of each country in data
+		tensor: ndarray
+			Dense features (country x date x feature) of data (see panel.py)
+		tensor_index: TensorIndex
+			Country codes, dates and feature names of the tensor axes
+		path: str
+			Path of the csv file of the data (see storage.py)
+		window_path: str
+			Path of the csv file of the window features
+		state_path: str
+			Path of the csv file of the state table (see
+			data_utils.country_state)
+		hopkins_path: str
+			Path of the csv file of the Hopkins data (see hopkins.py), None
+			for the default path
+		urls: dict
+			URLs (or local paths) of the Oxford (key 'Oxford') and JHU
+			sources, None for OXFORD_DATA_URL and hopkins.GLOBAL_URLS
+		cache_dir: str
+			Directory of the download cache (see fetch.py)
 			
 		Methods
 		-------
 		load_mobility_data()
-			Load local data stored at subdirectory MOBILITY_CSV_PATH
+			Load local data stored at subdirectory (see storage.py)
 		print_info()
 			Print information about the timeseries data
 		update()
 			Update data with the latest data from Hopkins and Oxford
 		save()
-			Save data to local subdirectory MOBILITY_CSV_PATH
+			Save data to local subdirectory (see storage.py)
+		export_csv()
+			Export data as csv file
+		export_panel()
+			Export features as memory-mapped panel (see panel.py)
+		get_country()
+			Data of a single country
+		get_range()
+			Data of a single country between two dates
+		get_features()
+			Features of some countries
+		get_tensor()
+			Tensor of some countries, dates and features
+		tensor_to_frame()
+			Long DataFrame of a tensor
+		get_window_features()
+			Rolling window features of all countries (stored with the data)
+		get_plot_series()
+			Prepared (and cached) series to plot of a single country
 		plot_mobility()
 			Plot cases and mobility data of a single country
+		render_plots()
+			Render plots of many countries to image files
+		"""
+	def __init__(self, columns=None, path=None, window_path=None, hopkins_path=None, urls=None,
+	             cache_dir=CACHE_DIR):
+		"""
+		Parameters
+		----------
+		columns: list
+			Columns to load (additional to the key columns), default all
+			columns
+		path: str
+			Path of the csv file of the data, default MOBILITY_CSV_PATH
+		window_path: str
+			Path of the csv file of the window features, default
+			MOBILITY_WINDOW_CSV_PATH or next to path
+		hopkins_path: str
+			Path of the csv file of the Hopkins data, default
+			hopkins.HOPKINS_CSV_PATH
+		urls: dict
+			URLs (or local paths) of the Oxford (key 'Oxford') and JHU
+			sources, default OXFORD_DATA_URL and hopkins.GLOBAL_URLS
+		cache_dir: str
+			Directory of the download cache, default fetch.CACHE_DIR
 		"""
-	def __init__(self):
+		if window_path is None:
+			window_path = MOBILITY_WINDOW_CSV_PATH if path is None else os.path.splitext(path)[0] + '_windows.csv'
+		self.path = MOBILITY_CSV_PATH if path is None else path
+		self.window_path = window_path
+		self.state_path = MOBILITY_STATE_CSV_PATH if path is None else os.path.splitext(path)[0] + '_state.csv'
+		self.hopkins_path = hopkins_path
+		self.urls = urls
+		self.cache_dir = cache_dir
+		self._columns = columns
+		self._data = None
+		self._tensor = None
+		self._tensor_index = None
+		self._windows = None
+		self.sources = None
+		
+		manifest = read_manifest(self.path)
+		if manifest is None or 'num_rows' not in manifest:
+			self._load()
+		else:
+			self.min_date = manifest['min_date']
+			self.max_date = manifest['max_date']
+			self.num_date = manifest['num_date']
+			self.num_rows = manifest['num_rows']
+			self.sources = manifest['sources']
+	
+	@property
+	def data(self) -> pd.DataFrame:
+		"""Mobility data, loaded on first access"""
+		if self._data is None:
+			self._load()
+		return self._data
+	
+	@property
+	def offsets(self) -> pd.DataFrame:
+		"""First (start) and last + 1 (stop) row of each country in data"""
+		if self._data is None:
+			self._load()
+		return self._offsets
+	
+	@property
+	def version(self) -> str:
+		"""Version of the data (latest date, rows and sources), known
+		without loading the data"""
+		return dataset_version(self.max_date, int(self.num_rows), self.sources)
+	
+	@property
+	def tensor_index(self) -> TensorIndex:
+		"""Axes of the tensor, dates on the grid from 2020-01-01"""
+		if self._tensor_index is None:
+			self._tensor_index = tensor_index(self.data)
+		return self._tensor_index
+	
+	@property
+	def tensor(self) -> np.ndarray:
+		"""Dense features (country x date x feature), built on first access"""
+		if self._tensor is None:
+			self._tensor = to_tensor(self.data, self.tensor_index)
+		return self._tensor
+	
+	def _load(self):
+		"""Load local data or prepare the data from Oxford and Hopkins data
+		if there is no local data"""
 		try:
 			print("Loading mobility data...")
-			self.data = pd.read_csv(MOBILITY_CSV_PATH)
-			# reformat date
-			self.data["DateTime"] = pd.to_datetime(self.data["Date"], format="%Y-%m-%d", errors="ignore")
+			self._set_data(_load_mobility_frame(self.path, self._columns))
+			manifest = read_manifest(self.path)
+			if manifest is None or 'num_rows' not in manifest:
+				self._write_manifest()
 			
-			self.min_date = self.data["Date"].unique().min()
-			self.max_date = self.data["Date"].unique().max()
-			self.num_date = self.data["Date"].nunique()
-			
-			print("- shape:", self.data.shape)
+			print("- shape:", self._data.shape)
 		except FileNotFoundError as e:
-			print("Error: no data present for file:", os.path.split(MOBILITY_CSV_PATH)[-1])
+			print("Error: no data present for file:", os.path.split(self.path)[-1])
 			print("Proceed preparing mobility data...")
-			ox = Oxford()
-			ox.save()
-			
-			self.data = ox.mdf
-			self.min_date = self.data["Date"].unique().min()
-			self.max_date = self.data["Date"].unique().max()
-			self.num_date = self.data["Date"].nunique()
-			
-	def load_mobility_data(self):
-		print("Loading mobility data...")
-		self.data = pd.read_csv(MOBILITY_CSV_PATH)
+			sources = self._fetch()
+			self._rebuild(sources, source_hashes(sources))
+	
+	def load_mobility_data(self, columns=None):
+		self._columns = columns
+		self._load()
+	
+	def _set_data(self, data):
+		"""Set data sorted by country and date, the offsets of each country
+		and min_date, max_date (%Y-%m-%d) and num_date of the data"""
+		self._data = data.sort_values(by=['Country_Code', 'DateTime'], ignore_index=True)
+		self._tensor = None
+		self._tensor_index = None
+		self._windows = None
+		
+		codes = self._data['Country_Code']
+		starts = np.flatnonzero(codes.ne(codes.shift()) & codes.notna())
+		stops = np.append(starts[1:], codes.notna().sum())
+		self._offsets = pd.DataFrame({'start': starts, 'stop': stops},
+		                            index=pd.Index(codes.iloc[starts].astype(object), name='Country_Code'))
+		
+		dates = self._data["DateTime"]
+		self.min_date = dates.min().strftime("%Y-%m-%d")
+		self.max_date = dates.max().strftime("%Y-%m-%d")
+		self.num_date = dates.nunique()
+		self.num_rows = len(self._data)
+	
+	def get_country(self, code) -> pd.DataFrame:
+		"""Data of a single country (slice of data, no copy)
+		
+		Parameters
+		----------
+		code: str
+			Country code
+		
+		Returns
+		-------
+		data: DataFrame
+			Rows of the country sorted by date
+		
+		Raises
+		------
+		KeyError
+			If there is no data for the country code
+		"""
+		if code not in self.offsets.index:
+			raise KeyError("No data for country code {}".format(code))
+		start, stop = self.offsets.loc[code]
+		
+		return self.data.iloc[start:stop]
+	
+	def get_range(self, code, start=None, end=None) -> pd.DataFrame:
+		"""Data of a single country between two dates (both included)
+		
+		Parameters
+		----------
+		code: str
+			Country code
+		start: str or Timestamp
+			First date, default min_date
+		end: str or Timestamp
+			Last date, default max_date
+		
+		Returns
+		-------
+		data: DataFrame
+			Rows of the country sorted by date
+		"""
+		country = self.get_country(code)
+		dates = country['DateTime'].to_numpy()
+		first = 0 if start is None else np.searchsorted(dates, pd.to_datetime(start).to_datetime64(), side='left')
+		last = len(dates) if end is None else np.searchsorted(dates, pd.to_datetime(end).to_datetime64(), side='right')
+		
+		return country.iloc[first:last]
+	
+	def get_features(self, codes=None, feats=None) -> pd.DataFrame:
+		"""Features of some countries
 		
-		self.data["DateTime"] = pd.to_datetime(self.data["Date"], format="%Y-%m-%d", errors="ignore")
+		Parameters
+		----------
+		codes: list
+			Country codes, default all countries
+		feats: list
+			Feature columns, default all columns
+		
+		Returns
+		-------
+		data: DataFrame
+			Columns Country_Code, DateTime and features sorted by country and date
+		"""
+		columns = self.data.columns if feats is None else _with_keys(feats)
+		if codes is None:
+			return self.data[columns]
 		
-		self.min_date = self.data["Date"].unique().min()
-		self.max_date = self.data["Date"].unique().max()
-		self.num_date = self.data["Date"].nunique()
+		return pd.concat([self.get_country(c)[columns] for c in codes])
+	
+	def get_tensor(self, codes=None, feats=None, start=None, end=None) -> tuple:
+		"""Tensor of some countries, dates and features
 		
-		print("- shape:", self.data.shape)
+		Parameters
+		----------
+		codes: list
+			Country codes, default all countries
+		feats: list
+			Feature columns, default all features
+		start: str or Timestamp
+			First date, default first date of the grid
+		end: str or Timestamp
+			Last date, default max_date
+		
+		Returns
+		-------
+		values: ndarray
+			Tensor (country x date x feature), a view if neither codes nor
+			feats are given
+		index: TensorIndex
+			Axes of values
+		
+		Raises
+		------
+		KeyError
+			If there is no data for a country code or feature
+		"""
+		countries, dates, features = self.tensor_index
+		period = dates.slice_indexer(start, end)
+		values, dates = self.tensor[:, period], dates[period]
+		if codes is not None:
+			pos = _positions(countries, codes)
+			values, countries = values[pos], countries[pos]
+		if feats is not None:
+			pos = _positions(features, feats)
+			values, features = values[:, :, pos], features[pos]
+		
+		return values, TensorIndex(countries, dates, features)
+	
+	def tensor_to_frame(self, values, index=None) -> pd.DataFrame:
+		"""Long DataFrame of a tensor with the types of data
+		
+		Parameters
+		----------
+		values: ndarray
+			Tensor (country x date x feature), e.g. of `get_tensor()`
+		index: TensorIndex
+			Axes of values, default tensor_index
+		
+		Returns
+		-------
+		data: DataFrame
+			Columns Country_Code, DateTime and features sorted by country
+			and date
+		"""
+		df = from_tensor(values, self.tensor_index if index is None else index)
+		for col in df.columns:
+			dtype = self.data[col].dtype if col in self.data.columns else None
+			if dtype is not None and (dtype.kind == 'f' or not df[col].isna().any()):
+				df[col] = df[col].astype(dtype)
+		
+		return df
 		
 	def print_info(self):
 		print("Mobility DataFrame Info")
@@ -103,51 +384,246 @@ class Mobility:
 			print("- current data is up-to-date.")
 	
 	def update(self):
+		"""Update data with the latest data from Hopkins and Oxford. Only
+		the new dates are processed, the features are continued from the
+		stored state table (see data_utils.country_state). The data is
+		prepared again completely if it was built by another code or schema
+		version (see storage.is_outdated) or the state table is missing. The data is left unchanged if a
+		download fails or the OxCGRT data can't be parsed.
+		
+		Raises
+		------
+		FetchError
+			If the download of a source failed (see fetch.py)
+		ValueError
+			If the OxCGRT data can't be parsed (see data_utils.load_oxford_data)
+		"""
+		from plotting import SERIES_CACHE
+		
 		print("Update Mobility Data...")
-		od = load_oxford_data()
+		try:
+			sources = self._fetch()
+		except FetchError as e:
+			print("ERROR: download failed")
+			print(e)
+			raise
+		hashes = source_hashes(sources)
+		if is_unchanged(self.path, hashes, code_version(*MOBILITY_CODE)):
+			print("No update necessary: sources and code unchanged since last update")
+			return
+		if is_outdated(self.path, code_version(*MOBILITY_CODE), SCHEMA.version):
+			print("Code or schema changed since last update, prepare mobility data again")
+			self._rebuild(sources, hashes)
+			return
+		state = self._load_state()
+		if state is None:
+			print("No state table of the data, prepare mobility data again")
+			self._rebuild(sources, hashes)
+			return
+		# load only the dates after the current data
+		od = load_oxford_data(sources.pop('Oxford'), min_date=self.max_date)
+		if len(od) == 0:
+			print("No update necessary: no Oxford data after", self.max_date)
+			self._set_sources(hashes)
+			return
 		
-		# merge with Hopkins data
-		hopkins = Hopkins()
-		hopkins.update()
+		# merge with Hopkins data (the update is skipped if the manifest
+		# of the Hopkins data records the same sources, a response 304
+		# only means the sources were downloaded before, not processed)
+		hopkins = self._hopkins()
+		hopkins.update(sources=sources)
 		od = od.merge(hopkins.data, on=['Date', 'Country_Code'])
 		
-		if od is not None:
-			od_max_date = od["DateTime"].unique().max()
-			md_max_date = pd.to_datetime(self.max_date)
-
-			if md_max_date < od_max_date:
-				# get entries for new dates
-				od = od.loc[od["DateTime"] > md_max_date]
-				
-				new_df = od[["Country_Code", "CountryName", "Date", "DateTime", "ConfirmedCases",
-		                    "ConfirmedDeaths", "Recovered", "StringencyIndex"]].copy()
-				print("Update with new data", new_df.shape)
-				print("- dates", new_df["Date"].unique())
-				
-				new_df = extend_data(new_df, od)
-				new_df = add_world_population_data(new_df)
-				print("- new_df processed:", new_df.shape)
-
-				# merge new and current data
-				self.data = pd.concat([self.data, new_df])
-				self.data = fill_missing_values(self.data)
-				
-				self.data = create_features(self.data)
-				print("- updated data", self.data.shape)
-				
-				self.save()
-				
-			else:
-				print("No update necessary:")
-				print("- latest Oxford data  :", od_max_date)
-				print("- latest Mobility data:", md_max_date)
+		od_max_date = od["DateTime"].max()
+		md_max_date = pd.to_datetime(self.max_date)
+
+		if md_max_date < od_max_date:
+			# get entries for new dates
+			od = od.loc[od["DateTime"] > md_max_date]
+			
+			new_df = od[MOBILITY_COLUMNS].copy()
+			print("Update with new data", new_df.shape)
+			print("- dates", new_df["Date"].unique())
+			
+			# continue the features of the current data
+			new_df, state = process_data(new_df, od, state=state)
+			print("- new_df processed:", new_df.shape)
+
+			# merge new and current data
+			self._set_data(downcast(pd.concat([self.data, new_df], ignore_index=True)))
+			print("- updated data", self.data.shape)
+			# drop the cached plot series of the old data
+			SERIES_CACHE.clear()
+			
+			self.sources = hashes
+			self.save()
+			self._save_state(state)
+			
+		else:
+			print("No update necessary:")
+			print("- latest Oxford data  :", od_max_date)
+			print("- latest Mobility data:", md_max_date)
+			self._set_sources(hashes)
+	
+	def _fetch(self) -> dict:
+		"""Download the Oxford and JHU sources at once (see fetch.py)"""
+		from hopkins import GLOBAL_URLS
+		
+		urls = {'Oxford': OXFORD_DATA_URL, **GLOBAL_URLS} if self.urls is None else self.urls
+		
+		return fetch_all(urls, cache_dir=self.cache_dir)
+	
+	def _hopkins(self):
+		"""Hopkins data of the JHU sources (see hopkins.py)"""
+		from hopkins import Hopkins
+		
+		urls = None if self.urls is None else {key: url for key, url in self.urls.items() if key != 'Oxford'}
+		
+		return Hopkins(self.hopkins_path, urls=urls, cache_dir=self.cache_dir)
+	
+	def _rebuild(self, sources, hashes):
+		"""Prepare the complete data from the downloaded Oxford and Hopkins
+		sources (see oxford.py)"""
+		from oxford import Oxford
+		from plotting import SERIES_CACHE
+		
+		sources = dict(sources)
+		oxford_source = sources.pop('Oxford')
+		hopkins = self._hopkins()
+		hopkins.update(sources=sources)
+		ox = Oxford(hopkins=hopkins, source=oxford_source, path=self.path)
+		ox.save()
+		self._save_state(ox.state)
+		
+		self._set_data(ox.mdf if self._columns is None else ox.mdf[_with_keys(self._columns)])
+		SERIES_CACHE.clear()
+		self.sources = hashes
+		self._write_manifest()
+	
+	def _load_state(self):
+		"""State table stored next to the data, None if there is none or
+		it is not the state of the latest date of the data"""
+		try:
+			state = load_frame(self.state_path, parse_dates={'DateTime': 'DateTime'})
+		except FileNotFoundError:
+			return None
+		if state['DateTime'].max().strftime("%Y-%m-%d") != self.max_date:
+			return None
+		state = state.set_index('Country_Code')
+		state.index = state.index.astype(object)
+		
+		return state
+	
+	def _save_state(self, state):
+		"""Store the state table to continue the data next to the data"""
+		save_frame(state.reset_index(), self.state_path)
 	
 	def save(self):
 		"""Save data as pandas DataFrame to local subdirectory
 		"""
-		self.data.to_csv(MOBILITY_CSV_PATH, columns=self.data.columns, index=False)
+		validate_schema(self.data)
+		path = save_frame(self.data, self.path)
+		self._write_manifest()
+		print("- saved at:", path)
+	
+	def _write_manifest(self):
+		"""Write dates, number of rows, source hashes, schema and code
+		version to the manifest of the stored data"""
+		write_manifest(self.path, min_date=self.min_date, max_date=self.max_date,
+		               num_date=int(self.num_date), num_rows=int(self.num_rows),
+		               sources=self.sources, schema_version=SCHEMA.version,
+		               code_version=code_version(*MOBILITY_CODE))
 	
-	def plot_mobility(self, ccode, feat="st"):
+	def _set_sources(self, hashes):
+		"""Record the sources of an update without new data, so the next
+		update with the same sources is skipped"""
+		self.sources = hashes
+		self._write_manifest()
+	
+	def export_csv(self, path=None):
+		"""Export data as csv file, default the csv file of the data
+		"""
+		export_csv(self.data, self.path if path is None else path)
+	
+	def export_panel(self, path=MOBILITY_PANEL_PATH, features=None):
+		"""Export features as dense memory-mapped panel (country x date x
+		feature) for worker processes, open it with `panel.open_panel()`
+		
+		Parameters
+		----------
+		path: str
+			Directory of the panel
+		features: list
+			Feature columns, default all numeric columns
+		"""
+		return export_panel(self.data, path, features)
+	
+	def get_window_features(self, features=WINDOW_FEATURES) -> pd.DataFrame:
+		"""Rolling window features (rolling means, reproduction number
+		proxies, doubling times and incidences) of all countries, computed
+		on first access and stored next to the data for the version of the
+		data (see `data_utils.create_window_features()`)
+		
+		Parameters
+		----------
+		features: list
+			Window features (kind, column, window in days), default
+			WINDOW_FEATURES
+		
+		Returns
+		-------
+		windows: DataFrame
+			Country_Code, DateTime and one column per feature, rows in the
+			order of data
+		"""
+		features = [list(feature) for feature in features]
+		if self._windows is not None and self._windows[0] == (self.version, features):
+			return self._windows[1]
+		
+		manifest = read_manifest(self.window_path)
+		if manifest is not None and manifest.get('data_version') == self.version \
+				and manifest.get('features') == features:
+			windows = load_frame(self.window_path, parse_dates={'DateTime': 'DateTime'})
+		else:
+			windows = create_window_features(self.data, features)
+			windows.insert(0, 'DateTime', self.data['DateTime'])
+			windows.insert(0, 'Country_Code', self.data['Country_Code'])
+			save_frame(windows, self.window_path)
+			write_manifest(self.window_path, data_version=self.version, features=features)
+		self._windows = ((self.version, features), windows)
+		
+		return windows
+	
+	def get_plot_series(self, ccode, feat="st", points=None, method='lttb') -> tuple:
+		"""Series to plot of a single country, prepared on first access and
+		cached for the version of the data (see plotting.py)
+		
+		Parameters
+		----------
+		ccode: str
+			Country Code to select country specific data
+		feat: str
+			Feature of mobility data, e.g Stringency (st), Mobility (mt)
+		points: int
+			Maximal number of points of each series, default all points
+		method: str
+			Downsampling method 'lttb' or 'minmax'
+		
+		Returns
+		-------
+		series: DataFrame
+			Series indexed by DateTime
+		limits: Series
+			Maximum of ConfirmedCases and DailyConfirmedCases
+		name: str
+			Name of the country
+		"""
+		from plotting import SERIES_CACHE, country_series
+		
+		return SERIES_CACHE.get(self.version, (ccode, feat, points, method),
+		                        lambda: country_series(self.get_country(ccode), ccode, feat, points, method))
+	
+	def plot_mobility(self, ccode, feat="st", points=None, method='lttb'):
 		"""Plot cases and mobility data of a single country
 		
 		Parameters
@@ -156,62 +632,80 @@ class Mobility:
 			Country Code to select country specific data
 		feat: str
 			Feature of mobility data, e.g Stringency (st), Mobility (mt)
+		points: int
+			Maximal number of points of each series, default all points
+		method: str
+			Downsampling method 'lttb' or 'minmax'
 		"""
-		country = self.data[self.data['Country_Code'] == ccode]['CountryName'].unique()[0]
-		
-		feats = ['ConfirmedCases', 'ConfirmedDeaths', 'Recovered', 'Active']
-		
-		# data to plot
-		dcc_date = self.data[(self.data.Country_Code == ccode) & (self.data[COL.dcc] >= 0.0)].groupby(['Date']).agg({COL.dcc: ['sum']})
-		mt_date = self.data[(self.data['Country_Code'] == ccode) & (self.data[COL.dcc] >= 0.0)].groupby(['Date']).agg({feat: ['sum']})
-		cc_max = int(self.data[self.data['Country_Code'] == ccode][COL.cc].max() * 1.05)
-		dcc_max = int(self.data[self.data['Country_Code'] == ccode][COL.dcc].max() * 1.05)
-		
-		# plot figure
-		fig = plt.figure(figsize=(15, 10), constrained_layout=False)
-		gs = gridspec.GridSpec(2, 1, figure=fig)
-		
-		# plot total cases vs. Mobility
-		ax1 = fig.add_subplot(gs[0, 0])
-		ax1.set_title(country + "\n", size=16)
-		ax1.set_ylabel("Total Cases", size=13)
-		ax1.set_ylim([0, cc_max])
-		for f in feats:
-			data = self.data[(self.data['Country_Code'] == ccode) & (self.data[f] >= 0.0)].groupby(['Date']).agg({f: ['sum']})
-			ax1.plot(data)
-		ax1.legend([ax1.get_children()[0], ax1.get_children()[1],
-		            ax1.get_children()[2], ax1.get_children()[3]],
-		           ['Total Confirmed Cases', 'Total Confirmed Deaths',
-		            'Total Recovered', 'Total Active'],
-		           bbox_to_anchor=[0, 0, 1, 1])
-		
-		plt.xticks(dcc_date.index[::30])
-		
-		# plot daily cases vs. Mobility
-		ax2 = fig.add_subplot(gs[1, 0])
-		# right scale
-		ax2m = ax2.twinx()
-		rspine_2 = ax2m.spines['right']
-		rspine_2.set_position(('axes', 1.0))
-		# left scale
-		ax2.set_ylabel("Daily Confirmed Cases", size=13)
-		ax2.set_ylim([0, dcc_max])
-		new_cases = np.reshape(dcc_date.values, (dcc_date.values.shape[0]))
-		ax2.bar(dcc_date.index, new_cases, width=1.0, alpha=0.6)
-		
-		# plot Mobility with right scale
-		ax2m.set_frame_on(True)
-		ax2m.patch.set_visible(False)
-		ax2m.set_ylabel(FEATURE_DICT[feat], size=13)
-		ax2m.set_ylim([0, 1])
-		ax2m.plot(mt_date, 'ro', markersize=5.0, mfc='red', mec='red')
-		ax2box = ax2.get_position()
-		ax2m.legend([ax2.get_children()[0], ax2m.get_lines()[0]],
-		            ['Daily Confirmed Cases', FEATURE_DICT[feat]],
-		            bbox_to_anchor=[0, 0, 1, 1])
-		
-		plt.xticks(dcc_date.index[::30])
+		import matplotlib.pyplot as plt
+		from plotting import FigureTemplate
+		
+		series, limits, name = self.get_plot_series(ccode, feat, points, method)
+		template = FigureTemplate(plt.figure(figsize=(15, 10), constrained_layout=False))
+		template.draw(name, series, feat, limits, spans=points is not None)
 		plt.show()
+	
+	def render_plots(self, codes=None, feats=None, path=None, fmt='png', processes=None) -> list:
+		"""Render the plots of some countries and features to image files
+		(headless, in worker processes, see plotting.py)
+		
+		Parameters
+		----------
+		codes: list
+			Country codes, default all countries
+		feats: list
+			Features of mobility data, default ['st']
+		path: str
+			Directory of the image files, default plotting.PLOT_PATH
+		fmt: str
+			Image format, e.g. 'png' or 'svg'
+		processes: int
+			Maximal number of worker processes
+		
+		Returns
+		-------
+		files: list
+			Paths of the image files
+		"""
+		from plotting import render, PLOT_PATH
+		
+		return render(self.data, codes, feats, PLOT_PATH if path is None else path, fmt, processes=processes)
+
+
+def _with_keys(columns):
+	"""Columns to load including the key columns Country_Code and DateTime."""
+	return list(dict.fromkeys(['Country_Code', 'DateTime'] + list(columns)))
+
+
+def _positions(axis, labels) -> np.ndarray:
+	"""Positions of labels in an axis of the tensor"""
+	pos = axis.get_indexer(labels)
+	if (pos < 0).any():
+		raise KeyError("No data for {}".format([l for l, p in zip(labels, pos) if p < 0]))
+	
+	return pos
+
+
+def _load_mobility_frame(path=MOBILITY_CSV_PATH, columns=None) -> pd.DataFrame:
+	"""Load local mobility data (see storage.py).
+	
+	Parameters
+	----------
+	path: str
+		Path of the csv file of the data
+	columns: list
+		Columns to load (additional to the key columns), default all columns
+	
+	Returns
+	-------
+	data: DataFrame
+	"""
+	columns = None if columns is None else _with_keys(columns)
+	
+	data = downcast(load_frame(path, columns=columns, parse_dates={'DateTime': 'Date'}))
+	validate_schema(data)
+	
+	return data
 
 
 def test_mobility_data():
@@ -224,6 +718,69 @@ def test_mobility_data():
 	print("Test finished!")
 
 
+
+def test_update_sources():
+	"""Updates from a local HTTP stand-in server with Last-Modified headers:
+	JHU sources that were downloaded (and cached) by an update without new
+	Oxford data are still processed by the next update"""
+	import tempfile
+	from fetch import StandInServer
+	from hopkins import Hopkins, GLOBAL_URLS, _synthetic_global_csv
+	from oxford import _synthetic_oxford_csv
+
+	def publish(name, source, day):
+		server.publish('/' + name, source, modified="Sun, {:02d} Aug 2020 00:00:00 GMT".format(day))
+
+	print("Testing Mobility update sources:")
+	with StandInServer() as server, tempfile.TemporaryDirectory() as tmp:
+		hopkins_path = os.path.join(tmp, 'hopkins.csv')
+		settings = dict(path=os.path.join(tmp, 'mobility.csv'), hopkins_path=hopkins_path,
+		                urls={name: server.url + '/' + name for name in ['Oxford', *GLOBAL_URLS]},
+		                cache_dir=os.path.join(tmp, 'cache'))
+
+		publish('Oxford', _synthetic_oxford_csv('2020-08-08'), 8)
+		for case in GLOBAL_URLS:
+			publish(case, _synthetic_global_csv(case, '2020-08-08'), 8)
+		mobility = Mobility(**settings)
+		assert mobility.max_date == '2020-08-08' and Hopkins(hopkins_path).max_date == '2020-08-08'
+
+		# (1) new JHU data, Oxford unchanged: nothing to merge yet
+		for case in GLOBAL_URLS:
+			publish(case, _synthetic_global_csv(case, '2020-08-23'), 23)
+		mobility.update()
+		assert mobility.max_date == '2020-08-08'
+
+		# (2) new Oxford data, the JHU sources are cached (304)
+		publish('Oxford', _synthetic_oxford_csv('2020-08-15'), 15)
+		mobility.update()
+		statuses = dict(server.requests[-len(settings['urls']):])
+		assert statuses == {'/' + name: 304 if name in GLOBAL_URLS else 200 for name in settings['urls']}
+		assert Hopkins(hopkins_path).max_date == '2020-08-23'
+		assert mobility.max_date == '2020-08-15'
+		assert Mobility(**settings).max_date == '2020-08-15'
+		
+		# (3) unchanged sources, but data of another code version
+		expected = mobility.data
+		mobility._set_data(expected.assign(st=np.float32(0)))
+		mobility.save()
+		write_manifest(mobility.path, **dict(read_manifest(mobility.path), code_version='outdated'))
+		mobility = Mobility(**settings)
+		mobility.update()
+		pd.testing.assert_frame_equal(Mobility(**settings).data, expected)
+		
+		# (4) failed download: raised, the data is unchanged
+		version = mobility.version
+		mobility.urls = dict(settings['urls'], Oxford=server.url + '/missing')
+		try:
+			mobility.update()
+			raise AssertionError("failed download without error")
+		except FetchError as e:
+			print("- expected error:", e)
+		assert Mobility(**settings).version == version
+	print("Test finished!")
+
+
 if __name__ == "__main__":
 	
 	test_mobility_data()
+	test_update_sources()
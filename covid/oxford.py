@@ -7,8 +7,8 @@ The DataFrame is loaded from local subdirectory, or, if not already existing,
 loaded from Oxford repository and processed into desired DataFrame.
 
 The processing steps are (see data_utils.py)
-(1) load Oxford data
-(2) init Hopkins data
+(1) init Hopkins data
+(2) load Oxford data (until the latest date of Hopkins data)
 (3) merge Oxford with Hopkins data
 (4) extend data
 (5) fill missing values
@@ -22,10 +22,15 @@ NOTE:
 """
 
 import pandas as pd
+import numpy as np
 import os
+import io
 
 from hopkins import Hopkins
-from data_utils import load_oxford_data, process_data
+from data_utils import OXFORD_DATA_URL, load_oxford_data, process_data
+from data_utils import COL, MOBILITY_INDICATORS, MOBILITY_DIVISORS
+from storage import save_frame, source_hashes
+from fetch import fetch
 
 FILE_PATH = os.path.dirname(os.path.abspath(__file__))
 OXFORD_CSV_PATH = os.path.join(FILE_PATH, "data/JEK_OxCGRT_v21_latest.csv")
@@ -43,40 +48,59 @@ class Oxford:
 			Maximum or latest date of time series
 		num_date: int
 			Number of dates/days
-			
+		sources: dict
+			Hashes of the Oxford and Hopkins sources (see storage.py)
+		state: DataFrame
+			State table to continue the time series of mdf (see
+			data_utils.country_state)
+
 		Methods
 		-------
 		save()
-			Save DataFrame to local subdirectory OXFORD_CSV_PATH
+			Save DataFrame to local subdirectory (see storage.py)
 		print_info()
 			Print some information about the DataFrame
 	"""
-	def __init__(self):
-		self.df = load_oxford_data()
-		self.min_date = self.df["Date"].unique().min()
-		self.max_date = self.df["Date"].unique().max()
-		self.num_date = self.df["Date"].nunique()
-		# merge with Hopkins data
-		hopkins = Hopkins()
+	def __init__(self, hopkins=None, source=None, path=None):
+		"""
+		Parameters
+		----------
+		hopkins: Hopkins
+			Hopkins data, default the local Hopkins data
+		source: bytes
+			Downloaded OxCGRT csv file (see fetch.py), default download from
+			OXFORD_DATA_URL
+		path: str
+			Path of the csv file of the data, default OXFORD_CSV_PATH
+		"""
+		self.path = OXFORD_CSV_PATH if path is None else path
+		hopkins = Hopkins() if hopkins is None else hopkins
 		hdf = hopkins.data
 		hdf_max_date = hdf['Date'].max()
-		
-		self.df = self.df[self.df['Date'] <= hdf_max_date]
+		# load only dates with Hopkins data
+		source = fetch(OXFORD_DATA_URL) if source is None else source
+		self.df = load_oxford_data(source, max_date=hdf_max_date)
+		self.sources = {'Oxford': source_hashes({'Oxford': source})['Oxford']}
+		self.sources.update(hopkins.sources or {})
+		self.min_date = self.df["Date"].min()
+		self.max_date = self.df["Date"].max()
+		self.num_date = self.df["Date"].nunique()
+		# merge with Hopkins data
 		self.df = self.df.merge(hdf, on=['Date', 'Country_Code'], how='left')
 		print("- merged Oxford and Hopkins", self.df.shape)
 
-		self.min_date = self.df["Date"].unique().min()
-		self.max_date = self.df["Date"].unique().max()
+		self.min_date = self.df["Date"].min()
+		self.max_date = self.df["Date"].max()
 		self.num_date = self.df["Date"].nunique()
 		print("- dates from {} to {} total {} days".format(self.min_date, self.max_date, self.num_date))
 		self.mdf = self.df[["Country_Code", "CountryName", "Date", "DateTime", "ConfirmedCases",
 		                    "ConfirmedDeaths", "Recovered", "StringencyIndex"]].copy()
 		
-		self.mdf = process_data(self.mdf, self.df)
+		self.mdf, self.state = process_data(self.mdf, self.df)
 		
 	def save(self):
-		print("- saved: ", OXFORD_CSV_PATH)
-		self.mdf.to_csv(OXFORD_CSV_PATH, columns=self.mdf.columns, index=False)
+		path = save_frame(self.mdf, self.path)
+		print("- saved: ", path)
 		
 	def print_info(self):
 		print("Oxford DataFrame Info")
@@ -87,6 +111,42 @@ class Oxford:
 		print("- columns:\n", self.mdf.columns)
 	
 
+def _synthetic_oxford_csv(end, seed=0) -> bytes:
+	"""Synthetic OxCGRT csv file from 2020-01-01 to end (%Y-%m-%d) with the
+	columns of the real one used by load_oxford_data, the values of a date
+	are the same for every end.
+	
+	Parameters
+	----------
+	end: str
+		Last date
+	seed: int
+		Seed of the random indicators
+	
+	Returns
+	-------
+	source: bytes
+		csv file like a download (see fetch.py)
+	"""
+	countries = [('Germany', 'DEU'), ('France', 'FRA'), ('Italy', 'ITA')]
+	dates = pd.date_range('2020-01-01', '2020-12-31')
+	rng = np.random.default_rng(seed)
+	df = pd.DataFrame({'CountryName': np.repeat([name for name, _ in countries], len(dates)),
+	                   'CountryCode': np.repeat([code for _, code in countries], len(dates)),
+	                   'Date': np.tile(dates.strftime('%Y%m%d'), len(countries))})
+	for col, divisor in zip(MOBILITY_INDICATORS, MOBILITY_DIVISORS):
+		name, rest = col.split('_', 1)
+		values = rng.integers(0, divisor + 1, len(df)).astype(float)
+		values[rng.random(len(df)) < 0.05] = np.nan
+		df[name + '_' + rest.replace('_', ' ')] = values
+		if col != COL.c8:
+			df[name + '_Flag'] = rng.integers(0, 2, len(df)).astype(float)
+	df['StringencyIndex'] = np.round(rng.random(len(df)) * 100, 2)
+	df = df[df['Date'] <= end.replace('-', '')]
+	
+	return df.to_csv(index=False).encode()
+
+
 def test_oxford_data():
 	print("Testing Oxford DataFrame:")
 	ox = Oxford()
@@ -94,6 +154,32 @@ def test_oxford_data():
 	print("Test finished!")
 
 
+def test_load_oxford_data():
+	"""OxCGRT data that can't be parsed raises ValueError instead of
+	returning None"""
+	import contextlib
+	
+	print("Testing load_oxford_data:")
+	source = _synthetic_oxford_csv('2020-03-31')
+	with contextlib.redirect_stdout(io.StringIO()):
+		df = load_oxford_data(source, min_date='2020-03-01')
+	assert df['Date'].min() == '2020-03-02' and df['Date'].max() == '2020-03-31'
+	
+	invalid = {'missing column': source.replace(b'CountryCode', b'Code'),
+	           'invalid date': source.replace(b'20200315', b'2020-03-15'),
+	           'no csv': b'<html>Not Found</html>'}
+	for case, data in invalid.items():
+		try:
+			with contextlib.redirect_stdout(io.StringIO()):
+				load_oxford_data(data, countries=['DEU'])
+		except ValueError as e:
+			assert 'OxCGRT' in str(e), case
+		else:
+			raise AssertionError("no error for " + case)
+	print("Test finished!")
+
+
 if __name__ == "__main__":
 	
+	test_load_oxford_data()
 	test_oxford_data()
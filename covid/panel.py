@@ -0,0 +1,369 @@
+""" Module that lays out the numeric features of the mobility data as dense
+(country x date x feature) tensor and exports it to a memory-mapped file.
+
+The dates of the tensor are the daily grid from 2020-01-01 (the first date
+of the Hopkins and Oxford data) to the latest date, the countries are sorted
+by code. `to_tensor()` and `from_tensor()` convert between the long frame
+and the tensor, the axes are described by a `TensorIndex`.
+
+A panel version is a directory with the array (values.npy) and small index
+files for the country codes, dates and feature names (countries.txt,
+dates.txt, features.txt, one entry per line). Missing country/date entries
+are NaN. The panel directory holds the versions and a pointer file CURRENT
+with the name of the current version. An export writes a new version and
+then replaces CURRENT in one step, so a reader always opens the array and
+index files of the same version. The previous version is kept for readers
+that are just opening it, older versions are removed.
+
+Opening a panel maps the array read-only, so many worker processes share
+one copy in the page cache instead of each holding a private DataFrame,
+and slices of countries or features are views without copy.
+"""
+import os
+import time
+import shutil
+import tempfile
+from collections import namedtuple
+import numpy as np
+import pandas as pd
+
+FILE_PATH = os.path.dirname(os.path.abspath(__file__))
+MOBILITY_PANEL_PATH = os.path.join(FILE_PATH, "data/JEK_OxCGRT_v21_panel")
+
+# key columns of the mobility data, all other numeric columns are features
+KEY_COLUMNS = ['Country_Code', 'CountryName', 'Date', 'DateTime']
+
+# first date of the date grid
+GRID_START = '2020-01-01'
+
+# pointer file with the name of the current version of a panel
+CURRENT = 'CURRENT'
+
+# axes of a tensor: country codes, dates and feature names
+TensorIndex = namedtuple('TensorIndex', ['countries', 'dates', 'features'])
+
+
+class Panel:
+	"""
+	Attributes
+	----------
+	values: ndarray
+		Read-only memory-mapped array (country x date x feature)
+	countries: Index
+		Country codes of the first axis
+	dates: DatetimeIndex
+		Dates of the second axis
+	features: Index
+		Feature names of the third axis
+	index: TensorIndex
+		All three axes
+
+	Methods
+	-------
+	country()
+		Features of a single country (date x feature), no copy
+	feature()
+		Single feature of all countries (country x date), no copy
+	series()
+		Single feature of a single country as Series
+	frame()
+		Features of a single country as DataFrame
+	to_frame()
+		All features as long DataFrame (see `from_tensor()`)
+	"""
+	def __init__(self, path=MOBILITY_PANEL_PATH):
+		path = _version_path(path)
+		self.values = np.load(os.path.join(path, 'values.npy'), mmap_mode='r')
+		self.countries = pd.Index(_read_index(path, 'countries'), name='Country_Code')
+		self.dates = pd.DatetimeIndex(_read_index(path, 'dates'), name='DateTime')
+		self.features = pd.Index(_read_index(path, 'features'))
+		shape = (len(self.countries), len(self.dates), len(self.features))
+		if self.values.shape != shape:
+			raise ValueError("Panel {}: array shape {} does not match the index files {}".format(
+				path, self.values.shape, shape))
+
+	@property
+	def index(self) -> TensorIndex:
+		return TensorIndex(self.countries, self.dates, self.features)
+
+	def country(self, code) -> np.ndarray:
+		"""Features of a single country (date x feature), no copy
+
+		Raises
+		------
+		KeyError
+			If there is no data for the country code
+		"""
+		return self.values[self.countries.get_loc(code)]
+
+	def feature(self, name) -> np.ndarray:
+		"""Single feature of all countries (country x date), no copy
+
+		Raises
+		------
+		KeyError
+			If there is no feature with this name
+		"""
+		return self.values[:, :, self.features.get_loc(name)]
+
+	def series(self, code, name) -> pd.Series:
+		"""Single feature of a single country indexed by date"""
+		values = self.values[self.countries.get_loc(code), :, self.features.get_loc(name)]
+
+		return pd.Series(values, index=self.dates, name=name)
+
+	def frame(self, code) -> pd.DataFrame:
+		"""Features of a single country indexed by date"""
+		return pd.DataFrame(self.country(code), index=self.dates, columns=self.features)
+
+	def to_frame(self) -> pd.DataFrame:
+		"""All features as long DataFrame (see `from_tensor()`)"""
+		return from_tensor(self.values, self.index)
+
+
+def tensor_index(data, features=None, start=GRID_START) -> TensorIndex:
+	"""Axes of the tensor of the mobility data.
+
+	Parameters
+	----------
+	data: DataFrame
+		Mobility data (see mobility.py)
+	features: list
+		Feature columns, default all numeric columns
+	start: str
+		First date of the grid, earlier dates of data are included
+
+	Returns
+	-------
+	index: TensorIndex
+	"""
+	if features is None:
+		features = [col for col in data.columns if col not in KEY_COLUMNS
+		            and pd.api.types.is_numeric_dtype(data[col])]
+	codes = data['Country_Code']
+	countries = pd.Index(np.sort(codes[codes.notna()].astype(str).unique()).astype(object), name='Country_Code')
+	times = data['DateTime']
+	dates = pd.date_range(min(times.min(), pd.Timestamp(start)), times.max(), freq='D', name='DateTime')
+
+	return TensorIndex(countries, dates, pd.Index(features))
+
+
+def to_tensor(data, index=None, dtype=np.float64) -> np.ndarray:
+	"""Dense tensor (country x date x feature) of the mobility data,
+	missing country/date entries are NaN, of duplicate country/date rows
+	the last one is used.
+
+	Parameters
+	----------
+	data: DataFrame
+		Mobility data (see mobility.py)
+	index: TensorIndex
+		Axes of the tensor, default `tensor_index(data)`
+	dtype: dtype
+		Type of the array, default float64 (exact for all counts)
+
+	Returns
+	-------
+	values: ndarray
+	"""
+	index = tensor_index(data) if index is None else index
+	values = np.empty(tuple(len(axis) for axis in index), dtype=dtype)
+	_fill(values, data, index)
+
+	return values
+
+
+def from_tensor(values, index, dropna=True) -> pd.DataFrame:
+	"""Long DataFrame of a tensor, the inverse of `to_tensor()`.
+
+	Parameters
+	----------
+	values: ndarray
+		Tensor (country x date x feature)
+	index: TensorIndex
+		Axes of the tensor
+	dropna: bool
+		Drop the country/date entries without any value (missing in data)
+
+	Returns
+	-------
+	data: DataFrame
+		Columns Country_Code, DateTime and features sorted by country and
+		date
+	"""
+	num_countries, num_dates, num_features = values.shape
+	flat = values.reshape(num_countries * num_dates, num_features)
+	df = pd.DataFrame({'Country_Code': np.repeat(index.countries.to_numpy(), num_dates),
+	                   'DateTime': np.tile(index.dates.to_numpy(), num_countries)})
+	for j, col in enumerate(index.features):
+		df[col] = flat[:, j]
+	if dropna:
+		df = df[~np.isnan(flat).all(axis=1)].reset_index(drop=True)
+
+	return df
+
+
+def export_panel(data, path=MOBILITY_PANEL_PATH, features=None, dtype=np.float64) -> str:
+	"""Export the numeric features of the mobility data as new version of
+	a dense panel.
+
+	Parameters
+	----------
+	data: DataFrame
+		Mobility data (see mobility.py)
+	path: str
+		Directory of the panel
+	features: list
+		Feature columns, default all numeric columns
+	dtype: dtype
+		Type of the array, default float64 (exact for all counts)
+
+	Returns
+	-------
+	path: str
+	"""
+	index = tensor_index(data, features)
+
+	os.makedirs(path, exist_ok=True)
+	# write the version to a temporary directory, so workers never open a
+	# half written version
+	tmp_path = tempfile.mkdtemp(prefix='.tmp-', dir=path)
+	try:
+		os.chmod(tmp_path, 0o755)
+		values = np.lib.format.open_memmap(os.path.join(tmp_path, 'values.npy'), mode='w+', dtype=dtype,
+		                                   shape=tuple(len(axis) for axis in index))
+		_fill(values, data, index)
+		values.flush()
+		del values
+
+		files = {'countries': index.countries, 'dates': index.dates.strftime('%Y-%m-%d'),
+		         'features': index.features}
+		for name, entries in files.items():
+			with open(os.path.join(tmp_path, name + '.txt'), 'w') as f:
+				f.write('\n'.join(entries) + '\n')
+		version = 'v{:020d}'.format(time.time_ns())
+		os.replace(tmp_path, os.path.join(path, version))
+	except BaseException:
+		shutil.rmtree(tmp_path, ignore_errors=True)
+		raise
+
+	# switch the readers to the new version in one step
+	previous = _read_current(path)
+	with open(os.path.join(path, CURRENT + '.tmp'), 'w') as f:
+		f.write(version + '\n')
+	os.replace(os.path.join(path, CURRENT + '.tmp'), os.path.join(path, CURRENT))
+	_remove_versions(path, keep=[version, previous])
+
+	print("- exported panel {} x {} x {} to: {}".format(*(len(axis) for axis in index), path))
+
+	return path
+
+
+def open_panel(path=MOBILITY_PANEL_PATH) -> Panel:
+	"""Open a panel read-only (see `Panel`)."""
+	return Panel(path)
+
+
+def _fill(values, data, index):
+	"""Fill the tensor with the features of data, NaN elsewhere"""
+	data = data[data['Country_Code'].notna()]
+	country_pos = index.countries.get_indexer(data['Country_Code'].astype(str))
+	date_pos = index.dates.get_indexer(data['DateTime'])
+	rows = (country_pos >= 0) & (date_pos >= 0)
+	country_pos, date_pos = country_pos[rows], date_pos[rows]
+
+	values[:] = np.nan
+	for j, col in enumerate(index.features):
+		values[country_pos, date_pos, j] = data[col].to_numpy(dtype=values.dtype, na_value=np.nan)[rows]
+
+
+def _read_current(path):
+	"""Name of the current version of a panel, None for a panel without
+	versions (array and index files directly in path)"""
+	try:
+		with open(os.path.join(path, CURRENT)) as f:
+			return f.read().strip()
+	except FileNotFoundError:
+		return None
+
+
+def _version_path(path) -> str:
+	"""Directory of the current version of a panel"""
+	version = _read_current(path)
+
+	return path if version is None else os.path.join(path, version)
+
+
+def _remove_versions(path, keep):
+	"""Remove all versions of a panel but the versions `keep`"""
+	for name in os.listdir(path):
+		if name.startswith('v') and name not in keep and os.path.isdir(os.path.join(path, name)):
+			shutil.rmtree(os.path.join(path, name), ignore_errors=True)
+
+
+def _read_index(path, name) -> list:
+	with open(os.path.join(path, name + '.txt')) as f:
+		return f.read().splitlines()
+
+
+def test_panel():
+	"""Export a small synthetic panel and read it in worker processes"""
+	import tempfile
+	from concurrent.futures import ProcessPoolExecutor
+
+	print("Testing panel:")
+	dates = pd.date_range('2020-01-01', periods=30)
+	data = pd.DataFrame({'Country_Code': np.repeat(['DEU', 'FRA', 'ITA'], 30),
+	                     'CountryName': np.repeat(['Germany', 'France', 'Italy'], 30),
+	                     'DateTime': np.tile(dates, 3),
+	                     'ConfirmedCases': np.arange(90) * 1000,
+	                     'st': np.linspace(0, 1, 90).astype(np.float32)})
+	# missing date of a country
+	data = data.drop(index=45)
+
+	values = to_tensor(data)
+	back = from_tensor(values, tensor_index(data))
+	assert values.shape == (3, 30, 2)
+	assert back['ConfirmedCases'].tolist() == data['ConfirmedCases'].tolist()
+	assert (back['DateTime'].to_numpy() == data['DateTime'].to_numpy()).all()
+
+	with tempfile.TemporaryDirectory() as tmp:
+		export_panel(data, tmp)
+		panel = open_panel(tmp)
+		assert panel.values.shape == (3, 30, 2)
+		assert list(panel.features) == ['ConfirmedCases', 'st']
+		assert np.isnan(panel.series('FRA', 'st').iloc[15])
+		assert panel.series('ITA', 'ConfirmedCases').iloc[-1] == 89000
+		assert np.shares_memory(panel.country('DEU'), panel.values)
+		assert not panel.values.flags.writeable
+
+		with ProcessPoolExecutor(max_workers=2) as executor:
+			sums = list(executor.map(_sum_feature, [tmp, tmp], ['ConfirmedCases', 'st']))
+		assert sums[0] == data['ConfirmedCases'].sum()
+
+		# new exports are new versions, the open panel keeps its version and
+		# only the current and the previous version are kept
+		export_panel(data[data['Country_Code'] != 'ITA'], tmp)
+		export_panel(data[data['Country_Code'] == 'DEU'], tmp)
+		assert open_panel(tmp).values.shape == (1, 30, 2)
+		assert panel.series('ITA', 'ConfirmedCases').iloc[-1] == 89000
+		assert len([name for name in os.listdir(tmp) if name.startswith('v')]) == 2
+
+		# index files not matching the array are detected
+		with open(os.path.join(_version_path(tmp), 'countries.txt'), 'w') as f:
+			f.write('DEU\nFRA\n')
+		try:
+			open_panel(tmp)
+			raise AssertionError("mismatching index files without error")
+		except ValueError as e:
+			print("- expected error:", e)
+	print("Test finished!")
+
+
+def _sum_feature(path, name):
+	return np.nansum(open_panel(path).feature(name))
+
+
+if __name__ == "__main__":
+
+	test_panel()
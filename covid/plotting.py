@@ -0,0 +1,463 @@
+""" Module that renders the plots of cases and mobility data (see
+`Mobility.plot_mobility`) for many countries to image files.
+
+The series of all countries are prepared in one grouped pass over the data
+(`plot_series`), the countries are then rendered headless with the Agg
+backend by a pool of worker processes. Every worker draws all its plots
+into one figure template, only the data artists are replaced for each plot.
+
+The prepared series of a country and feature are cached for a version of
+the data (`SERIES_CACHE`), so redrawing a plot doesn't touch the data again.
+Long series can be downsampled (LTTB or min-max per bucket) to a number of
+points before they are cached.
+
+The optional package `matplotlib` is needed to draw the plots.
+"""
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+
+from data_utils import COL, FEATURE_DICT
+
+FILE_PATH = os.path.dirname(os.path.abspath(__file__))
+PLOT_PATH = os.path.join(FILE_PATH, "data/plots")
+
+PROCESSES = os.cpu_count() or 1
+
+# total cases of the upper plot
+TOTAL_COLUMNS = [COL.cc, COL.cd, COL.rc, COL.ac]
+TOTAL_LABELS = ['Total Confirmed Cases', 'Total Confirmed Deaths', 'Total Recovered', 'Total Active']
+
+
+class FigureTemplate:
+	"""Figure with the axes, artists and legends of the plot of a country,
+	`draw()` only sets the data of the artists and the scales.
+
+	Attributes
+	----------
+	fig: Figure
+		Figure (matplotlib), a new headless figure if None is given
+	"""
+	def __init__(self, fig=None):
+		import matplotlib.dates as mdates
+		from matplotlib.figure import Figure
+		from matplotlib.gridspec import GridSpec
+		from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+		if fig is None:
+			fig = Figure(figsize=(15, 10))
+			FigureCanvasAgg(fig)
+		self.fig = fig
+		gs = GridSpec(2, 1, figure=self.fig)
+
+		# total cases
+		self.ax1 = self.fig.add_subplot(gs[0, 0])
+		self.ax1.set_ylabel("Total Cases", size=13)
+		self.lines = [self.ax1.plot([], [])[0] for _ in TOTAL_COLUMNS]
+		self.ax1.legend(self.lines, TOTAL_LABELS, bbox_to_anchor=[0, 0, 1, 1])
+
+		# daily cases (left scale) vs. mobility (right scale), the bars of
+		# the days (width 1 day) are drawn as one step patch
+		self.ax2 = self.fig.add_subplot(gs[1, 0])
+		self.ax2m = self.ax2.twinx()
+		self.ax2m.spines['right'].set_position(('axes', 1.0))
+		self.ax2.set_ylabel("Daily Confirmed Cases", size=13)
+		self.bars = self.ax2.stairs([0.0], [0.0, 1.0], fill=True, alpha=0.6)
+		self.ax2m.set_frame_on(True)
+		self.ax2m.patch.set_visible(False)
+		self.ax2m.set_ylim([0, 1])
+		self.feature = self.ax2m.plot([], [], 'ro', markersize=5.0, mfc='red', mec='red')[0]
+		self.legend = self.ax2m.legend([self.bars, self.feature], ['Daily Confirmed Cases', ''],
+		                               bbox_to_anchor=[0, 0, 1, 1])
+
+		for ax in [self.ax1, self.ax2]:
+			ax.xaxis_date()
+			ax.xaxis.set_major_formatter(mdates.DateFormatter('%Y-%m-%d'))
+
+	def draw(self, country, series, feat, limits, spans=False):
+		"""Draw the plot of a country.
+
+		Parameters
+		----------
+		country: str
+			Name of the country
+		series: DataFrame
+			Series of the country indexed by date (see `plot_series()`)
+		feat: str
+			Feature of mobility data, e.g Stringency (st), Mobility (mt)
+		limits: Series
+			Maximum of ConfirmedCases and DailyConfirmedCases
+		spans: bool
+			The daily cases span the days to the next value (downsampled
+			series), instead of gaps for days without value
+		"""
+		import matplotlib.dates as mdates
+
+		days = mdates.date2num(series.index)
+		self.ax1.set_title(country + "\n", size=16)
+		self.ax1.set_ylim([0, int(limits[COL.cc] * 1.05)])
+		for line, col in zip(self.lines, TOTAL_COLUMNS):
+			valid = series[col].notna().to_numpy()
+			line.set_data(days[valid], series[col].to_numpy()[valid])
+
+		daily = series[COL.dcc]
+		valid = daily.notna().to_numpy()
+		if spans and valid.any():
+			daily_days = days[valid]
+			edges = np.concatenate([daily_days[:1] - 0.5, (daily_days[1:] + daily_days[:-1]) / 2,
+			                        daily_days[-1:] + 0.5])
+			self.bars.set_data(daily.to_numpy()[valid], edges)
+			ticks = np.arange(daily_days[0], daily_days[-1] + 1, 30)
+		else:
+			# days without daily cases are gaps (NaN) of the steps
+			grid = np.arange(days[0], days[-1] + 1) if len(days) > 0 else days
+			steps = np.full(len(grid), np.nan)
+			steps[np.searchsorted(grid, days)] = daily.to_numpy()
+			self.bars.set_data(steps, np.append(grid, grid[-1] + 1) - 0.5 if len(grid) > 0 else [0.0])
+			ticks = days[valid][::30]
+		self.ax2.set_ylim([0, int(limits[COL.dcc] * 1.05)])
+
+		valid = series[feat].notna().to_numpy()
+		self.feature.set_data(days[valid], series[feat].to_numpy()[valid])
+		self.ax2m.set_ylabel(FEATURE_DICT[feat], size=13)
+		self.legend.get_texts()[1].set_text(FEATURE_DICT[feat])
+
+		if len(days) > 0:
+			# margins of the autoscale of matplotlib
+			margin = 0.05 * max(days[-1] - days[0], 1)
+			self.ax1.set_xlim(days[0] - margin, days[-1] + margin)
+			self.ax2.set_xlim(days[0] - 0.5 - margin, days[-1] + 0.5 + margin)
+		self.ax1.set_xticks(ticks)
+		self.ax2.set_xticks(ticks)
+
+
+def plot_series(data, feats) -> tuple:
+	"""Series to plot of all countries in one grouped pass. Like the plot of
+	a single country, negative values of the total and daily cases and the
+	features of days with negative daily cases are left out (NaN).
+
+	Parameters
+	----------
+	data: DataFrame
+		Mobility data (see mobility.py)
+	feats: list
+		Features of mobility data
+
+	Returns
+	-------
+	series: DataFrame
+		Series indexed by Country_Code and DateTime
+	limits: DataFrame
+		Maximum of ConfirmedCases and DailyConfirmedCases of each country
+	names: Series
+		Name of each country
+	"""
+	columns = TOTAL_COLUMNS + [COL.dcc]
+	masked = pd.DataFrame({col: data[col].where(data[col] >= 0.0) for col in columns})
+	for feat in dict.fromkeys(feats):
+		masked[feat] = data[feat].where(data[COL.dcc] >= 0.0)
+	masked['Country_Code'] = data['Country_Code'].astype(str)
+	masked['DateTime'] = data['DateTime']
+
+	grouped = masked.groupby(['Country_Code', 'DateTime'], sort=True)
+	series = grouped.sum(min_count=1)
+	codes = data['Country_Code'].astype(str)
+	limits = data[[COL.cc, COL.dcc]].groupby(codes).max()
+	names = data['CountryName'].astype(str).groupby(codes).first()
+
+	return series, limits, names
+
+
+class SeriesCache:
+	"""Prepared series of countries and features (see `country_series()`)
+	for one version of the data, all series are dropped if the version
+	changes or on `clear()`.
+
+	Attributes
+	----------
+	version: str
+		Version of the data of the cached series
+	hits: int
+		Number of series taken from the cache
+	misses: int
+		Number of series prepared
+	"""
+	def __init__(self):
+		self.version = None
+		self.hits = 0
+		self.misses = 0
+		self._series = {}
+
+	def get(self, version, key, prepare):
+		"""Cached series of the key, prepared with `prepare()` on first access
+
+		Parameters
+		----------
+		version: str
+			Version of the data, e.g. `Mobility.version`
+		key: tuple
+			Key of the series, e.g. (code, feat, points, method)
+		prepare: callable
+			Function without arguments that prepares the series
+		"""
+		if version != self.version:
+			self.clear()
+			self.version = version
+		if key in self._series:
+			self.hits += 1
+		else:
+			self.misses += 1
+			self._series[key] = prepare()
+
+		return self._series[key]
+
+	def clear(self):
+		self._series = {}
+		self.version = None
+
+
+# cache of the prepared series, shared by all Mobility objects
+SERIES_CACHE = SeriesCache()
+
+
+def country_series(data, code, feat, points=None, method='lttb') -> tuple:
+	"""Series to plot of a single country and feature (see `plot_series()`)
+
+	Parameters
+	----------
+	data: DataFrame
+		Mobility data of the country (or of all countries)
+	code: str
+		Country code
+	feat: str
+		Feature of mobility data
+	points: int
+		Maximal number of points of each series, default all points
+	method: str
+		Downsampling method 'lttb' or 'minmax' (see `downsample()`)
+
+	Returns
+	-------
+	series: DataFrame
+		Series indexed by DateTime
+	limits: Series
+		Maximum of ConfirmedCases and DailyConfirmedCases
+	name: str
+		Name of the country
+	"""
+	series, limits, names = plot_series(data, [feat])
+	series = series.loc[code]
+	if points is not None:
+		series = downsample(series, points, method)
+
+	return series, limits.loc[code], names[code]
+
+
+def downsample(series, points, method='lttb') -> pd.DataFrame:
+	"""Downsample each column of the series to at most `points` values,
+	the other values are set to NaN (rows without any value are dropped).
+
+	Parameters
+	----------
+	series: DataFrame
+		Series indexed by DateTime
+	points: int
+		Maximal number of values of each column
+	method: str
+		'lttb' (Largest-Triangle-Three-Buckets, keeps the shape of lines)
+		or 'minmax' (minimum and maximum of each bucket, keeps peaks)
+
+	Returns
+	-------
+	series: DataFrame
+	"""
+	select = {'lttb': lttb, 'minmax': min_max}[method]
+	x = series.index.to_numpy().astype('datetime64[ns]').astype(np.int64).astype(np.float64)
+	keep = np.zeros(series.shape, dtype=bool)
+	for j, col in enumerate(series.columns):
+		rows = np.flatnonzero(series[col].notna().to_numpy())
+		keep[rows[select(x[rows], series[col].to_numpy(dtype=np.float64)[rows], points)], j] = True
+	series = series.where(keep)
+
+	return series[keep.any(axis=1)]
+
+
+def lttb(x, y, points) -> np.ndarray:
+	"""Largest-Triangle-Three-Buckets downsampling: the first and last point
+	and of each of `points - 2` buckets the point that forms the largest
+	triangle with the point selected before and the mean of the next bucket.
+
+	Returns
+	-------
+	index: ndarray
+		Positions of the selected points
+	"""
+	n = len(x)
+	if points >= n or points < 3:
+		return np.arange(n)
+
+	edges = (np.arange(points - 1) * (n - 2) / (points - 2)).astype(np.int64) + 1
+	edges[-1] = n - 1
+	index = np.empty(points, dtype=np.int64)
+	index[0], index[-1] = 0, n - 1
+	for i in range(points - 2):
+		start, stop = edges[i], edges[i + 1]
+		next_stop = edges[i + 2] if i + 2 < len(edges) else n
+		xc, yc = x[stop:next_stop].mean(), y[stop:next_stop].mean()
+		xa, ya = x[index[i]], y[index[i]]
+		area = np.abs((xa - xc) * (y[start:stop] - ya) - (xa - x[start:stop]) * (yc - ya))
+		index[i + 1] = start + np.argmax(area)
+
+	return index
+
+
+def min_max(x, y, points) -> np.ndarray:
+	"""Min-max downsampling: the minimum and maximum of each of `points / 2`
+	buckets.
+
+	Returns
+	-------
+	index: ndarray
+		Positions of the selected points
+	"""
+	n = len(x)
+	buckets = points // 2
+	if points >= n or buckets < 1:
+		return np.arange(n)
+
+	edges = (np.arange(buckets + 1) * n / buckets).astype(np.int64)
+	pos = np.arange(n)
+	bucket = np.searchsorted(edges, pos, side='right') - 1
+	offset = pos - edges[bucket]
+	padded = np.full((buckets, offset.max() + 1), np.nan)
+	padded[bucket, offset] = y
+
+	return np.unique(np.concatenate([edges[:-1] + np.nanargmin(padded, axis=1),
+	                                 edges[:-1] + np.nanargmax(padded, axis=1)]))
+
+
+def render(data, codes=None, feats=None, path=PLOT_PATH, fmt='png', dpi=100, processes=None) -> list:
+	"""Render the plots of some countries and features to image files
+	`<path>/<code>_<feat>.<fmt>`.
+
+	Parameters
+	----------
+	data: DataFrame
+		Mobility data (see mobility.py)
+	codes: list
+		Country codes, default all countries
+	feats: list
+		Features of mobility data, default ['st']
+	path: str
+		Directory of the image files
+	fmt: str
+		Image format, e.g. 'png' or 'svg'
+	dpi: int
+		Resolution of raster images
+	processes: int
+		Maximal number of worker processes, default PROCESSES, 1 renders
+		the plots one after another in this process
+
+	Returns
+	-------
+	files: list
+		Paths of the image files
+	"""
+	feats = ['st'] if feats is None else feats
+	if codes is not None:
+		data = data[data['Country_Code'].astype(str).isin(codes)]
+	series, limits, names = plot_series(data, feats)
+	codes = list(names.index)
+	os.makedirs(path, exist_ok=True)
+
+	processes = max(min(PROCESSES if processes is None else processes, len(codes)), 1)
+	chunks = [codes[i::processes] for i in range(processes)]
+	args = ([series.loc[chunk] for chunk in chunks], [limits.loc[chunk] for chunk in chunks],
+	        [names.loc[chunk] for chunk in chunks])
+	kwargs = {'feats': feats, 'path': path, 'fmt': fmt, 'dpi': dpi}
+	print("Render {} plots of {} countries...".format(len(codes) * len(feats), len(codes)))
+	if processes > 1:
+		with ProcessPoolExecutor(max_workers=processes) as executor:
+			futures = [executor.submit(_render_chunk, *chunk_args, **kwargs) for chunk_args in zip(*args)]
+			files = [file for future in futures for file in future.result()]
+	else:
+		files = _render_chunk(*[arg[0] for arg in args], **kwargs)
+	print("- rendered to:", path)
+
+	return sorted(files)
+
+
+def _render_chunk(series, limits, names, feats, path, fmt, dpi) -> list:
+	"""Render the plots of the countries of a chunk into one figure template"""
+	template = FigureTemplate()
+	files = []
+	for code, name in names.items():
+		for feat in feats:
+			template.draw(name, series.loc[code], feat, limits.loc[code])
+			file = os.path.join(path, "{}_{}.{}".format(code, feat, fmt))
+			template.fig.savefig(file, format=fmt, dpi=dpi)
+			files.append(file)
+
+	return files
+
+
+def test_render():
+	"""Render plots of synthetic data in worker processes"""
+	import tempfile
+
+	print("Testing render:")
+	dates = pd.date_range('2020-01-01', periods=90)
+	codes = ['DEU', 'FRA', 'ITA']
+	cc = np.tile(np.arange(90) * 10.0, 3)
+	data = pd.DataFrame({'Country_Code': pd.Categorical(np.repeat(codes, 90)),
+	                     'CountryName': np.repeat(['Germany', 'France', 'Italy'], 90),
+	                     'DateTime': np.tile(dates, 3),
+	                     COL.cc: cc, COL.cd: cc / 10, COL.rc: cc / 2, COL.ac: cc / 2 - cc / 10,
+	                     COL.dcc: np.tile(np.r_[0, np.full(89, 10.0)], 3),
+	                     'st': np.linspace(0, 1, 270), 'mt': np.linspace(1, 0, 270)})
+	data.loc[5, COL.dcc] = -3.0
+
+	series, limits, names = plot_series(data, ['st'])
+	assert np.isnan(series.loc[('DEU', dates[5]), 'st'])
+	assert limits.loc['ITA', COL.cc] == 890.0
+	assert names['FRA'] == 'France'
+
+	with tempfile.TemporaryDirectory() as tmp:
+		files = render(data, feats=['st', 'mt'], path=tmp, processes=2)
+		assert len(files) == 6 and all(os.path.getsize(file) > 0 for file in files)
+		files = render(data, codes=['FRA'], feats=['mt'], path=tmp, fmt='svg', processes=1)
+		assert files == [os.path.join(tmp, 'FRA_mt.svg')]
+	print("Test finished!")
+
+
+def test_series_cache():
+	"""Downsample and cache series"""
+	print("Testing series cache:")
+	x = np.arange(1000, dtype=np.float64)
+	y = np.sin(x / 50) * 100 + (x == 500) * 1000
+	index = lttb(x, y, 100)
+	assert len(index) == 100 and index[0] == 0 and index[-1] == 999 and 500 in index
+	assert (np.diff(index) > 0).all()
+	index = min_max(x, y, 100)
+	assert len(index) <= 100 and 500 in index and np.argmin(y) in index
+	assert len(lttb(x[:50], y[:50], 100)) == 50
+
+	dates = pd.date_range('2020-01-01', periods=1000)
+	data = pd.DataFrame({'Country_Code': 'DEU', 'CountryName': 'Germany', 'DateTime': dates,
+	                     COL.cc: np.cumsum(np.abs(y)), COL.cd: x, COL.rc: x, COL.ac: x,
+	                     COL.dcc: np.abs(y), 'st': np.abs(y) / 1000})
+	cache = SeriesCache()
+	series, limits, name = cache.get('v1', ('DEU', 'st', 200, 'lttb'),
+	                                 lambda: country_series(data, 'DEU', 'st', 200))
+	assert series[COL.cc].count() == 200 and name == 'Germany' and limits[COL.dcc] == np.abs(y).max()
+	assert cache.get('v1', ('DEU', 'st', 200, 'lttb'), None)[0] is series
+	cache.get('v2', ('DEU', 'st', None, 'lttb'), lambda: country_series(data, 'DEU', 'st'))
+	assert (cache.hits, cache.misses, len(cache._series)) == (1, 2, 1)
+	print("Test finished!")
+
+
+if __name__ == "__main__":
+
+	test_render()
+	test_series_cache()
@@ -0,0 +1,466 @@
+""" Module that stores and loads the processed datasets (Hopkins, Mobility
+and world population data) in a columnar binary format.
+
+The binary formats (Parquet or Feather) keep the column types (datetime64,
+categorical, float32 etc.) and allow to load only some columns, so dates
+don't need to be parsed again on every load. Both formats need the optional
+package `pyarrow`, without it the datasets are stored as csv files.
+
+CSV files are still used as export format and as fallback if there is no
+binary file, e.g. for the csv files of the repository. A csv file that is
+newer than the binary file (e.g. a csv file of the repository updated by
+`git pull`) is converted again.
+
+Metadata of a dataset (e.g. its dates) can be stored in a small sidecar
+manifest (json) next to the dataset, so it is available without loading
+the dataset. A manifest is only valid for the stored file it was written
+for (same size and modification time) and as long as the csv file is not
+newer than the stored file.
+
+The manifest also records the hashes of the sources and the version of the
+processing code (hash of the modules) the dataset was built from, so an
+update can be skipped if neither has changed (see `is_unchanged()`). A
+dataset of another code or schema version is built again completely (see
+`is_outdated()`).
+"""
+import os
+import json
+import hashlib
+import pandas as pd
+
+FILE_PATH = os.path.dirname(os.path.abspath(__file__))
+
+# binary storage format: 'parquet', 'feather' or 'csv'
+STORAGE_FORMAT = 'parquet'
+
+EXTENSIONS = {'parquet': '.parquet',
+              'feather': '.feather',
+              'csv': '.csv'}
+
+
+def storage_format() -> str:
+	"""Storage format that is used, STORAGE_FORMAT if `pyarrow` is
+	available, otherwise 'csv'.
+
+	Returns
+	-------
+	fmt: str
+		Storage format
+	"""
+	if STORAGE_FORMAT == 'csv':
+		return 'csv'
+	try:
+		import pyarrow
+	except ImportError:
+		return 'csv'
+
+	return STORAGE_FORMAT
+
+
+def dataset_path(csv_path, fmt=None) -> str:
+	"""Path of the dataset in the given format next to the csv file.
+
+	Parameters
+	----------
+	csv_path: str
+		Path of the csv file of the dataset
+	fmt: str
+		Storage format, default `storage_format()`
+
+	Returns
+	-------
+	path: str
+	"""
+	fmt = storage_format() if fmt is None else fmt
+
+	return os.path.splitext(csv_path)[0] + EXTENSIONS[fmt]
+
+
+def save_frame(df, csv_path, fmt=None) -> str:
+	"""Save DataFrame in the storage format next to the csv file.
+
+	Parameters
+	----------
+	df: DataFrame
+		Data to save
+	csv_path: str
+		Path of the csv file of the dataset
+	fmt: str
+		Storage format, default `storage_format()`
+
+	Returns
+	-------
+	path: str
+		Path of the saved file
+	"""
+	fmt = storage_format() if fmt is None else fmt
+	path = dataset_path(csv_path, fmt)
+
+	if fmt == 'parquet':
+		_with_str_codes(df).to_parquet(path, index=False)
+	elif fmt == 'feather':
+		_with_str_codes(df).reset_index(drop=True).to_feather(path)
+	else:
+		df.to_csv(path, columns=df.columns, index=False)
+
+	return path
+
+
+def _with_str_codes(df) -> pd.DataFrame:
+	"""Convert columns of mixed strings and numbers (e.g. the country
+	code -1 of unknown countries) to strings like a csv file does."""
+	mixed = [col for col in df.columns if df[col].dtype == object
+	         and pd.api.types.infer_dtype(df[col], skipna=True).startswith('mixed')]
+	if len(mixed) == 0:
+		return df
+
+	df = df.copy()
+	for col in mixed:
+		df[col] = df[col].where(df[col].isna(), df[col].astype(str))
+
+	return df
+
+
+def load_frame(csv_path, columns=None, parse_dates=None, fmt=None) -> pd.DataFrame:
+	"""Load DataFrame of the dataset. The binary file is used if present
+	and not older than the csv file, otherwise the csv file is loaded and
+	stored as binary file for the next time.
+
+	Parameters
+	----------
+	csv_path: str
+		Path of the csv file of the dataset
+	columns: list
+		Columns to load, default all columns
+	parse_dates: dict
+		Date columns to create from string columns of the csv file, e.g.
+		{'DateTime': 'Date'} (the date column itself is parsed if the string
+		column is missing), binary files already have these columns
+	fmt: str
+		Storage format, default `storage_format()`
+
+	Returns
+	-------
+	df: DataFrame
+
+	Raises
+	------
+	FileNotFoundError
+		If there is neither a binary file nor a csv file
+	"""
+	fmt = storage_format() if fmt is None else fmt
+	path = dataset_path(csv_path, fmt)
+
+	if fmt != 'csv' and _is_current(path, csv_path):
+		if fmt == 'parquet':
+			return pd.read_parquet(path, columns=columns)
+		return pd.read_feather(path, columns=columns)
+
+	df = pd.read_csv(csv_path)
+	for date_col, str_col in (parse_dates or {}).items():
+		str_col = str_col if str_col in df.columns else date_col
+		df[date_col] = pd.to_datetime(df[str_col], format="%Y-%m-%d")
+	if fmt != 'csv':
+		print("- convert {} to {}".format(os.path.split(csv_path)[-1], fmt))
+		save_frame(df, csv_path, fmt=fmt)
+
+	return df if columns is None else df[columns]
+
+
+def _is_current(path, csv_path) -> bool:
+	"""Check if the binary file exists and is not older than the csv file"""
+	if not os.path.exists(path):
+		return False
+
+	return not os.path.exists(csv_path) or os.path.getmtime(csv_path) <= os.path.getmtime(path)
+
+
+def export_csv(df, csv_path):
+	"""Export DataFrame as csv file. The export of the saved data of a
+	dataset keeps the binary file current (the csv file gets the time of
+	the binary file), so it isn't converted again by `load_frame`.
+
+	Parameters
+	----------
+	df: DataFrame
+		Data to export
+	csv_path: str
+		Path of the csv file
+	"""
+	path = dataset_path(csv_path)
+	current = path != csv_path and _is_current(path, csv_path)
+	df.to_csv(csv_path, columns=df.columns, index=False)
+	if current:
+		mtime = os.path.getmtime(path)
+		os.utime(csv_path, (mtime, mtime))
+	print("- exported to:", csv_path)
+
+
+def manifest_path(csv_path) -> str:
+	"""Path of the sidecar manifest of the dataset next to the csv file."""
+	return os.path.splitext(csv_path)[0] + '.json'
+
+
+def write_manifest(csv_path, fmt=None, **meta) -> str:
+	"""Write the sidecar manifest of the stored dataset.
+
+	Parameters
+	----------
+	csv_path: str
+		Path of the csv file of the dataset
+	fmt: str
+		Storage format, default `storage_format()`
+	meta:
+		Metadata to store (json serializable)
+
+	Returns
+	-------
+	path: str
+		Path of the manifest
+	"""
+	data_path = dataset_path(csv_path, fmt)
+	stat = os.stat(data_path)
+	manifest = {'file': os.path.basename(data_path),
+	            'size': stat.st_size,
+	            'mtime': stat.st_mtime}
+	manifest.update(meta)
+
+	path = manifest_path(csv_path)
+	with open(path, 'w') as f:
+		json.dump(manifest, f, indent=1)
+
+	return path
+
+
+def read_manifest(csv_path, fmt=None) -> dict:
+	"""Read the sidecar manifest of the stored dataset.
+
+	Parameters
+	----------
+	csv_path: str
+		Path of the csv file of the dataset
+	fmt: str
+		Storage format, default `storage_format()`
+
+	Returns
+	-------
+	manifest: dict
+		Metadata of the dataset or None if there is no manifest, the stored
+		file has changed since the manifest was written or the csv file is
+		newer than the stored file (it is converted again by `load_frame`)
+	"""
+	data_path = dataset_path(csv_path, fmt)
+	if not _is_current(data_path, csv_path):
+		return None
+	try:
+		with open(manifest_path(csv_path)) as f:
+			manifest = json.load(f)
+		stat = os.stat(data_path)
+	except (OSError, ValueError):
+		return None
+	if manifest.get('file') != os.path.basename(data_path) or \
+			manifest.get('size') != stat.st_size or manifest.get('mtime') != stat.st_mtime:
+		return None
+
+	return manifest
+
+
+def source_hashes(sources) -> dict:
+	"""SHA-256 hashes of downloaded sources.
+
+	Parameters
+	----------
+	sources: dict
+		Downloaded bytes by key (see fetch.py)
+
+	Returns
+	-------
+	hashes: dict
+		Hex digest by key
+	"""
+	return {key: hashlib.sha256(data).hexdigest() for key, data in sources.items()}
+
+
+def code_version(*modules) -> str:
+	"""Version of the processing code, the hash of the module files.
+
+	Parameters
+	----------
+	modules: str
+		File names of the modules in this package, e.g. 'hopkins.py'
+
+	Returns
+	-------
+	version: str
+	"""
+	code_hash = hashlib.sha256()
+	for module in modules:
+		with open(os.path.join(FILE_PATH, module), 'rb') as f:
+			code_hash.update(f.read())
+
+	return code_hash.hexdigest()[:16]
+
+
+def dataset_version(*meta) -> str:
+	"""Version of a dataset, the hash of its metadata (e.g. latest date,
+	number of rows and hashes of the sources).
+
+	Parameters
+	----------
+	meta:
+		Metadata (json serializable)
+
+	Returns
+	-------
+	version: str
+	"""
+	return hashlib.sha256(json.dumps(meta, sort_keys=True).encode()).hexdigest()[:16]
+
+
+def is_unchanged(csv_path, hashes, code) -> bool:
+	"""Check if the stored dataset was built from the same sources with the
+	same processing code.
+
+	Parameters
+	----------
+	csv_path: str
+		Path of the csv file of the dataset
+	hashes: dict
+		Hashes of the sources (see `source_hashes()`)
+	code: str
+		Version of the processing code (see `code_version()`)
+
+	Returns
+	-------
+	bool
+	"""
+	manifest = read_manifest(csv_path)
+
+	return manifest is not None and manifest.get('sources') == hashes and manifest.get('code_version') == code
+
+
+def is_outdated(csv_path, code, schema) -> bool:
+	"""Check if the stored dataset was built by another version of the
+	processing code or with another schema, so it has to be built again
+	completely instead of being updated incrementally.
+
+	Parameters
+	----------
+	csv_path: str
+		Path of the csv file of the dataset
+	code: str
+		Version of the processing code (see `code_version()`)
+	schema: int
+		Version of the column types of the dataset
+
+	Returns
+	-------
+	bool
+		False if there is no valid manifest (unknown versions)
+	"""
+	manifest = read_manifest(csv_path)
+
+	return manifest is not None and (manifest.get('code_version') != code or manifest.get('schema_version') != schema)
+
+
+def test_load_frame():
+	"""A csv file newer than the binary file is converted again"""
+	import tempfile
+
+	print("Testing load_frame:")
+	if storage_format() == 'csv':
+		print("- skipped, no binary format (pyarrow) available")
+		return
+	with tempfile.TemporaryDirectory() as tmp:
+		csv_path = os.path.join(tmp, 'data.csv')
+		pd.DataFrame({'Date': ['2020-01-01', '2020-01-02'], 'n': [1, 2]}).to_csv(csv_path, index=False)
+		df = load_frame(csv_path, parse_dates={'DateTime': 'Date'})
+		assert os.path.exists(dataset_path(csv_path)) and df['n'].tolist() == [1, 2]
+		assert load_frame(csv_path, columns=['n'])['n'].tolist() == [1, 2]
+
+		# e.g. the csv file of the repository updated by git pull
+		pd.DataFrame({'Date': ['2020-01-01', '2020-01-02', '2020-01-03'], 'n': [1, 2, 3]}).to_csv(
+			csv_path, index=False)
+		mtime = os.path.getmtime(csv_path)
+		os.utime(dataset_path(csv_path), (mtime - 10, mtime - 10))
+		df = load_frame(csv_path, parse_dates={'DateTime': 'Date'})
+		assert df['n'].tolist() == [1, 2, 3] and pd.api.types.is_datetime64_dtype(df['DateTime'])
+		assert load_frame(csv_path, columns=['n'])['n'].tolist() == [1, 2, 3]
+
+		# the export of the saved data is not converted again
+		mtime = os.path.getmtime(dataset_path(csv_path))
+		export_csv(df, csv_path)
+		load_frame(csv_path)
+		assert os.path.getmtime(dataset_path(csv_path)) == mtime
+	print("Test finished!")
+
+
+def test_manifest():
+	"""A manifest is invalid after the csv file of the dataset was edited"""
+	import tempfile
+
+	print("Testing manifest:")
+	with tempfile.TemporaryDirectory() as tmp:
+		csv_path = os.path.join(tmp, 'data.csv')
+		pd.DataFrame({'Date': ['2020-01-01', '2020-01-02'], 'n': [1, 2]}).to_csv(csv_path, index=False)
+		load_frame(csv_path)
+		write_manifest(csv_path, max_date='2020-01-02', num_rows=2)
+		assert read_manifest(csv_path)['max_date'] == '2020-01-02'
+
+		# e.g. the csv file of the repository updated by git pull
+		pd.DataFrame({'Date': ['2020-01-01', '2020-01-02', '2099-01-01'], 'n': [1, 2, 3]}).to_csv(
+			csv_path, index=False)
+		mtime = os.path.getmtime(csv_path)
+		os.utime(dataset_path(csv_path), (mtime - 10, mtime - 10))
+		assert read_manifest(csv_path) is None
+
+		# a new manifest of the converted data is valid again
+		df = load_frame(csv_path)
+		write_manifest(csv_path, max_date=df['Date'].max(), num_rows=len(df))
+		assert read_manifest(csv_path) == dict(read_manifest(csv_path), max_date='2099-01-01', num_rows=3)
+	print("Test finished!")
+
+
+def benchmark_storage(num_countries=180, num_days=600, repeat=3):
+	"""Cold load of a processed mobility frame from the storage formats
+	(best of `repeat`), csv with date parsing as reference.
+
+	Parameters
+	----------
+	num_countries: int
+		Countries of the synthetic frame (see `data_utils._synthetic_frame`)
+	num_days: int
+		Days of each country
+	repeat: int
+		Number of loads of each format
+	"""
+	import tempfile
+	import contextlib
+	import io
+	from data_utils import _synthetic_frame, process_data, best_of, MOBILITY_COLUMNS
+
+	print("Benchmark storage formats:")
+	old_df = _synthetic_frame(num_countries, num_days)
+	with contextlib.redirect_stdout(io.StringIO()):
+		df, _ = process_data(old_df[MOBILITY_COLUMNS].copy(), old_df)
+	print("- frame {} x {}".format(*df.shape))
+
+	formats = ['csv'] + ([] if storage_format() == 'csv' else ['parquet', 'feather'])
+	with tempfile.TemporaryDirectory() as tmp:
+		csv_path = os.path.join(tmp, 'mobility.csv')
+		for fmt in formats:
+			path = save_frame(df, csv_path, fmt=fmt)
+			runs = {fmt: lambda: load_frame(csv_path, parse_dates={'DateTime': 'Date'}, fmt=fmt)}
+			if fmt == 'parquet':
+				runs['parquet, 3 columns'] = lambda: load_frame(csv_path, columns=['DateTime', 'Country_Code', 'st'],
+				                                                fmt=fmt)
+			for name, run in runs.items():
+				seconds = best_of(run, repeat)[1]
+				print("- {:20s} {:.3f}s  ({:.1f} MB)".format(name, seconds, os.path.getsize(path) / 1e6))
+
+
+if __name__ == "__main__":
+
+	test_load_frame()
+	test_manifest()
+	benchmark_storage()
@@ -0,0 +1,189 @@
+""" Module that runs sensitivity sweeps of the mobility weight model (see
+`data_utils.mobility_matrix()`).
+
+A sweep computes the mobility features pt, Pt, mt and Mt of all countries
+for N parameter sets (general scope weights and indicator divisors) in one
+vectorized pass, instead of running process_data once per set. The Oxford
+indicators are laid out as (country x day x indicator) tensor on the date
+grid of panel.py, the features have the shape [param, country, day], days
+without Oxford data of a country are NaN.
+
+The features are computed like in `fill_missing_values()`: zeros of S1..S9
+are filled with the last non-zero value of the country, pt is the mean of
+S1..S9, mt = 1 - pt and Pt, Mt are the cumulative sums over the days.
+
+The parameter sets are processed in chunks to bound the memory of the
+intermediate (param x country x day x 9) features, large sweeps can spread
+the chunks over a process pool.
+"""
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+
+from data_utils import COL, MOBILITY_WEIGHT, MOBILITY_DIVISORS, indicator_matrix, mobility_matrix
+from panel import tensor_index
+
+PROCESSES = os.cpu_count() or 1
+# parameter sets that are computed at once
+CHUNK_SIZE = 8
+
+SWEEP_FEATURES = ['pt', 'Pt', 'mt', 'Mt']
+
+# indicator tensors of the worker processes (see `_init_worker`)
+_tensors = None
+
+
+def sweep(old_df, weights=MOBILITY_WEIGHT, divisors=MOBILITY_DIVISORS,
+          features=None, processes=None, chunk_size=CHUNK_SIZE) -> tuple:
+	"""Mobility features of all countries for N parameter sets.
+
+	Parameters
+	----------
+	old_df: DataFrame
+		Oxford data with the indicators and flags, one row per country and
+		date (see oxford.py)
+	weights: array
+		General scope weights of the N sets (N,), or a weight per feature
+		of each set (N, 9)
+	divisors: array
+		Maximum levels of the indicators, the same for all sets (9,) or of
+		each set (N, 9)
+	features: list
+		Features to return, default SWEEP_FEATURES
+	processes: int
+		Maximal number of worker processes, default PROCESSES, 1 processes
+		the chunks one after another in this process
+	chunk_size: int
+		Parameter sets that are computed at once
+
+	Returns
+	-------
+	features: dict
+		Array [param, country, day] of each feature
+	index: TensorIndex
+		Country codes, dates and feature names of the arrays
+	"""
+	features = SWEEP_FEATURES if features is None else features
+	weights, divisors = _parameter_sets(weights, divisors)
+	tensors, index = _indicator_tensors(old_df)
+	index = index._replace(features=pd.Index(features))
+
+	chunks = [slice(start, start + chunk_size) for start in range(0, len(weights), chunk_size)]
+	args = ([weights[chunk] for chunk in chunks], [divisors[chunk] for chunk in chunks],
+	        [features] * len(chunks))
+	processes = min(PROCESSES if processes is None else processes, len(chunks))
+	print("Sweep {} parameter sets in {} chunks...".format(len(weights), len(chunks)))
+	if processes > 1:
+		with ProcessPoolExecutor(max_workers=processes, initializer=_init_worker,
+		                         initargs=(tensors,)) as executor:
+			results = list(executor.map(_sweep_chunk, *args))
+	else:
+		_init_worker(tensors)
+		results = list(map(_sweep_chunk, *args))
+		_init_worker(None)
+
+	return {feat: np.concatenate([result[feat] for result in results]) for feat in features}, index
+
+
+def _parameter_sets(weights, divisors) -> tuple:
+	"""Weights and divisors as (N, 9) arrays"""
+	weights = np.asarray(weights, dtype=np.float64)
+	weights = weights.reshape(-1, 1) if weights.ndim < 2 else weights
+	divisors = np.asarray(divisors, dtype=np.float64)
+	num = max(len(weights), len(divisors) if divisors.ndim == 2 else 1)
+
+	return (np.broadcast_to(weights, (num, len(COL.si_cols))),
+	        np.broadcast_to(divisors, (num, len(COL.si_cols))))
+
+
+def _indicator_tensors(old_df) -> tuple:
+	"""Indicator values and flags (country x day x 9) and the days with
+	data of each country (country x day)"""
+	old_df = old_df[old_df['Country_Code'].notna()]
+	index = tensor_index(old_df, features=COL.si_cols)
+	country_pos = index.countries.get_indexer(old_df['Country_Code'].astype(str))
+	date_pos = index.dates.get_indexer(old_df['DateTime'])
+
+	# the days of an indicator are contiguous (indicator x country x day
+	# in memory), mobility_matrix keeps this layout
+	shape = (len(COL.si_cols), len(index.countries), len(index.dates))
+	values, flags = np.full(shape, np.nan).transpose(1, 2, 0), np.full(shape, np.nan).transpose(1, 2, 0)
+	values[country_pos, date_pos], flags[country_pos, date_pos] = indicator_matrix(old_df)
+	present = np.zeros(shape[1:], dtype=bool)
+	present[country_pos, date_pos] = True
+
+	return (values, flags, present), index
+
+
+def _init_worker(tensors):
+	global _tensors
+	_tensors = tensors
+
+
+def _sweep_chunk(weights, divisors, features) -> dict:
+	"""Features of a chunk of parameter sets [param, country, day]"""
+	values, flags, present = _tensors
+	# param x indicator x country x day, contiguous
+	s = np.ascontiguousarray(np.moveaxis(mobility_matrix(values, flags, weights, divisors), -1, 1))
+	s[np.isnan(s)] = 0.0
+
+	# fill zeros with the last non-zero value of the country
+	pos = np.arange(s.size).reshape(s.shape)
+	first = pos[..., :1]
+	last = np.maximum.accumulate(np.where(s != 0, pos, first - 1), axis=-1)
+	s = np.where(last >= first, s.ravel()[np.maximum(last, 0)], s)
+
+	# sum up in the same order as fill_missing_values
+	pt = np.zeros(s.shape[:1] + s.shape[2:])
+	for j in range(s.shape[1]):
+		pt = pt + s[:, j]
+	pt = np.where(present, pt / 9, 0.0)
+	mt = np.where(present, 1 - pt, 0.0)
+	result = {'pt': pt, 'Pt': np.cumsum(pt, axis=2), 'mt': mt, 'Mt': np.cumsum(mt, axis=2)}
+
+	return {feat: np.where(present, result[feat], np.nan) for feat in features}
+
+
+def test_sweep():
+	"""Compare a sweep with the features of the processing steps"""
+	from data_utils import extend_data, fill_missing_values
+	import io
+	import contextlib
+
+	print("Testing sweep:")
+	rng = np.random.default_rng(0)
+	codes = ['DEU', 'FRA', 'ITA', 'ESP']
+	dates = pd.date_range('2020-01-01', periods=60)
+	old_df = pd.DataFrame({'Country_Code': np.repeat(codes, len(dates)),
+	                       'DateTime': np.tile(dates, len(codes))})
+	for col in COL.ci_cols:
+		old_df[col] = rng.integers(0, 3, len(old_df)).astype(float)
+		old_df.loc[rng.random(len(old_df)) < 0.1, col] = np.nan
+		if col != COL.c8:
+			old_df[col.split('_')[0] + '_Flag'] = rng.integers(0, 2, len(old_df)).astype(float)
+	# a country without data for some days
+	old_df = old_df.drop(index=range(70, 80)).reset_index(drop=True)
+	for col in [COL.cc, COL.cd, COL.rc, COL.si]:
+		old_df[col] = rng.random(len(old_df)) * 100
+
+	weights = np.array([0.0, 0.28375, 0.5, 1.0])
+	divisors = np.array([MOBILITY_DIVISORS, MOBILITY_DIVISORS, MOBILITY_DIVISORS + 1, MOBILITY_DIVISORS])
+	result, index = sweep(old_df, weights, divisors, processes=2, chunk_size=3)
+	assert result['Pt'].shape == (4, 4, 60)
+	assert np.isnan(result['pt'][:, index.countries.get_loc('FRA'), 10:20]).all()
+
+	for k in [0, 1, 3]:
+		df = old_df[['Country_Code', 'DateTime', COL.cc, COL.cd, COL.rc, COL.si]].copy()
+		with contextlib.redirect_stdout(io.StringIO()):
+			df = fill_missing_values(extend_data(df, old_df, weights[k]))
+		for feat in SWEEP_FEATURES:
+			values = result[feat][k][index.countries.get_indexer(df['Country_Code']),
+			                         index.dates.get_indexer(df['DateTime'])]
+			assert np.array_equal(values, df[feat].to_numpy()), feat
+	print("Test finished!")
+
+
+if __name__ == "__main__":
+
+	test_sweep()
@@ -4,6 +4,7 @@ import pandas as pd
 import os
 
 from iso_data import ISOCodes
+from storage import load_frame, save_frame
 
 FILE_PATH = os.path.dirname(os.path.abspath(__file__))
 WP_2020_CSV_FILE = os.path.join(FILE_PATH, "data/World_population_by_country_2020.csv")
@@ -65,11 +66,11 @@ class WorldPopulationData:
 	add_iso_codes()
 		Add ISO country codes
 	save()
-		Save data to WP_CSV_FILE
+		Save data to local subdirectory (see storage.py)
 	"""
 	def __init__(self):
 		try:
-			self.df = pd.read_csv(WP_CSV_FILE)
+			self.df = load_frame(WP_CSV_FILE)
 		except FileNotFoundError as e:
 			self.df = pd.read_csv(WP_2020_CSV_FILE)
 			self.process_world_data()
@@ -116,8 +117,8 @@ class WorldPopulationData:
 		self.df.loc[self.df.CountryName == 'Caribbean Netherlands', 'Code'] = 'ANT'
 	
 	def save(self):
-		self.df.to_csv(WP_CSV_FILE, columns=self.df.columns, index=False)
-		print("- saved to:", WP_CSV_FILE)
+		path = save_frame(self.df, WP_CSV_FILE)
+		print("- saved to:", path)
 
 
 def test_world_population_data():